@@ -0,0 +1,70 @@
+"""
+Compares the type-3 non-uniform FFT of
+:func:`javelin.nufft.sum_phases_nufft` with the kernels of
+:mod:`javelin.fourier` it can replace, for random atoms in a cube of
+cells. For random Q points, a :class:`javelin.grid.PointGrid`, the
+reference is the direct sum :func:`javelin.fourier.sum_phases`. For the
+points of a regular :class:`javelin.grid.Grid` it is the factorised
+:func:`javelin.fourier.sum_phase_factors`. The time of each and the
+relative error of the NUFFT are printed.
+
+Run with ``python benchmarks/nufft_benchmark.py``.
+"""
+from __future__ import print_function
+import time
+import numpy as np
+from javelin.fourier import sum_phases, sum_phase_factors
+from javelin.grid import Grid, PointGrid
+from javelin.nufft import sum_phases_nufft
+
+
+def compare(positions, q, reference, tolerance):
+    start = time.time()
+    expected = np.ravel(reference())
+    reference_time = time.time() - start
+    start = time.time()
+    results = sum_phases_nufft(positions, q, tolerance=tolerance)
+    nufft_time = time.time() - start
+    error = np.abs(results - expected).max()/np.abs(expected).max()
+    return reference_time, nufft_time, error
+
+
+def benchmark_points(cells, atoms, points, qmax, tolerance=1e-6):
+    rng = np.random.RandomState(0)
+    positions = rng.rand(atoms, 3)*cells
+    q = (rng.rand(points, 3)*2 - 1)*qmax
+    grid = PointGrid(q)
+    print('{:6d} {:8d} {:8d} {:5.1f} {:9.3f} {:9.3f} {:9.1e}'.format(
+        cells, atoms, points, qmax,
+        *compare(positions, q, lambda: sum_phases(positions, grid), tolerance)))
+
+
+def benchmark_grid(cells, atoms, bins, qmax, tolerance=1e-6):
+    rng = np.random.RandomState(0)
+    positions = rng.rand(atoms, 3)*cells
+    grid = Grid(ll=[-qmax, -qmax, -qmax], lr=[qmax, -qmax, -qmax], ul=[-qmax, qmax, -qmax],
+                tl=[-qmax, -qmax, qmax], bins=[bins]*3)
+    q = np.array([np.ravel(qi) for qi in grid.get_q_meshgrid()]).T
+    print('{:6d} {:8d} {:8d} {:5.1f} {:9.3f} {:9.3f} {:9.1e}'.format(
+        cells, atoms, bins**3, qmax,
+        *compare(positions, q, lambda: sum_phase_factors(positions, grid), tolerance)))
+
+
+if __name__ == '__main__':
+    print('Random Q points against the direct sum, sum_phases')
+    print(' cells    atoms   points  qmax    direct     nufft     error')
+    for cells, atoms, points, qmax in [(5, 1000, 1000, 1),
+                                       (5, 10000, 10000, 1),
+                                       (5, 100000, 10000, 1),
+                                       (10, 10000, 10000, 1),
+                                       (10, 10000, 10000, 2),
+                                       (20, 10000, 10000, 2),
+                                       (20, 1000, 10000, 2)]:
+        benchmark_points(cells, atoms, points, qmax)
+    print('Grid points against the factorised sum, sum_phase_factors')
+    print(' cells    atoms   points  qmax    factor     nufft     error')
+    for cells, atoms, bins, qmax in [(5, 1000, 21, 1),
+                                     (5, 10000, 21, 1),
+                                     (10, 10000, 41, 2),
+                                     (20, 10000, 41, 2)]:
+        benchmark_grid(cells, atoms, bins, qmax)
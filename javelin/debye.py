@@ -0,0 +1,170 @@
+"""
+=====
+debye
+=====
+
+Powder diffraction of a :class:`javelin.structure.Structure` from the
+Debye scattering equation
+
+.. math::
+
+    I(Q) = \\sum_i f_i^2 + 2\\sum_{i<j} f_i f_j \\frac{\\sin(Q r_{ij})}{Q r_{ij}}
+
+The distances between the atoms are found in chunks with the
+:class:`javelin.neighborlist.NeighborList` of the structure and
+histogrammed for each pair of elements, so memory does not grow with
+the number of pairs and the sum runs over the histogram bins instead
+of the pairs of atoms.
+"""
+from __future__ import absolute_import
+import numpy as np
+from javelin.neighborlist import get_ncells, get_rmax
+
+
+def get_pair_histograms(structure, rmax=None, dr=0.01, periodic=True, max_memory=2**27,
+                        workers=1):
+    """Returns the histograms of the distances between each pair of
+    elements, every pair of atoms counted once.
+
+    The chunks of neighbouring cells are histogrammed independently, in
+    a thread pool with more than one worker.
+
+    :param structure: the structure
+    :type structure: :class:`javelin.structure.Structure`
+    :param rmax: largest distance, defaults to
+       :func:`javelin.neighborlist.get_rmax`
+    :type rmax: float
+    :param dr: width of the histogram bins in Angstrom
+    :type dr: float
+    :param periodic: if the structure is periodic, with the minimum
+       image distances used
+    :type periodic: bool
+    :param max_memory: memory for each chunk of pairs, see
+       :meth:`javelin.neighborlist.NeighborList.get_chunks`
+    :type max_memory: int
+    :param workers: number of threads
+    :type workers: int
+    :return: the atomic numbers, the centres of the bins and the
+       histograms, with the pairs of elements a and b at [a, b] for
+       a <= b
+    :rtype: tuple of :class:`numpy.ndarray` (M,), (nbins,), (M, M, nbins)
+    """
+    if rmax is None:
+        rmax = get_rmax(structure, periodic)
+    atomic_numbers, types = np.unique(structure.get_atomic_numbers().astype(np.int64),
+                                      return_inverse=True)
+    types = types.ravel()
+    nbins = int(np.ceil(rmax / dr)) + 1
+    nlist = structure.get_neighbor_list(rmax, periodic)
+    ntypes = len(atomic_numbers)
+
+    def histogram(chunk):
+        i, j, distances = nlist.get_chunk_pairs(*chunk)
+        if nlist.rmax > rmax:  # the cached list can be longer
+            within = distances <= rmax
+            i, j, distances = i[within], j[within], distances[within]
+        a = np.minimum(types[i], types[j])
+        b = np.maximum(types[i], types[j])
+        index = (a*ntypes + b)*nbins + np.minimum((distances/dr).astype(np.int64), nbins-1)
+        return np.bincount(index, minlength=ntypes*ntypes*nbins)
+
+    chunks = nlist.get_chunks(max_memory)
+    histograms = np.zeros(ntypes*ntypes*nbins, dtype=np.int64)
+    if workers > 1 and len(chunks) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(chunks)))
+        try:
+            for partial in pool.imap_unordered(histogram, chunks):
+                histograms += partial
+        finally:
+            pool.terminate()
+    else:
+        for chunk in chunks:
+            histograms += histogram(chunk)
+    return (atomic_numbers, (np.arange(nbins) + 0.5)*dr,
+            histograms.reshape((ntypes, ntypes, nbins)))
+
+
+def sum_histograms(q, r, histograms, max_memory=2**27):
+    """Returns :math:`\\sum_k h_k \\sin(Q r_k)/(Q r_k)` of each histogram
+
+    :param q: Q values in inverse Angstrom
+    :type q: :class:`numpy.ndarray` (nq,)
+    :param r: the centres of the bins
+    :type r: :class:`numpy.ndarray` (nbins,)
+    :param histograms: the histograms
+    :type histograms: :class:`numpy.ndarray` (..., nbins)
+    :param max_memory: memory for each block of bins
+    :type max_memory: int
+    :return: the sums
+    :rtype: :class:`numpy.ndarray` (nq, ...)
+    """
+    q = np.asarray(q, dtype=np.float64).ravel()
+    shape = histograms.shape[:-1]
+    histograms = histograms.reshape((-1, len(r))).T.astype(np.float64)
+    nonzero = np.flatnonzero(histograms.any(axis=1))
+    block = max(1, int(max_memory // (8*max(1, len(q)))))
+    results = np.zeros((len(q), histograms.shape[1]))
+    for start in range(0, len(nonzero), block):
+        bins = nonzero[start:start+block]
+        results += np.dot(np.sinc(q[:, None]*r[bins]/np.pi), histograms[bins])
+    return results.reshape((len(q),) + shape)
+
+
+def calc_debye(structure, q, rmax=None, dr=0.01, radiation='neutron', periodic=True,
+               max_memory=2**27, workers=1):
+    """Calculates the powder averaged intensity per atom from the Debye
+    scattering equation.
+
+    In a periodic structure only the pairs within rmax are summed over
+    and the scattering of a uniform density of atoms within rmax,
+    :math:`4\\pi\\rho_0\\langle f\\rangle^2(\\sin(QR)-QR\\cos(QR))/Q^3`, is
+    subtracted to remove the small angle scattering of the sphere of
+    radius rmax.
+
+    :param structure: the structure
+    :type structure: :class:`javelin.structure.Structure`
+    :param q: Q values in inverse Angstrom
+    :type q: :class:`numpy.ndarray`
+    :param rmax: largest distance, defaults to
+       :func:`javelin.neighborlist.get_rmax`
+    :type rmax: float
+    :param dr: width of the histogram bins in Angstrom
+    :type dr: float
+    :param radiation: 'neutron' or 'xray'
+    :type radiation: str
+    :param periodic: if the structure is periodic
+    :type periodic: bool
+    :param max_memory: memory for each chunk of pairs or bins
+    :type max_memory: int
+    :param workers: number of threads histogramming the pairs
+    :type workers: int
+    :return: DataArray of the intensity per atom
+    :rtype: :class:`xarray.DataArray`
+    """
+    import xarray as xr
+    from javelin.fourier import get_ff
+    q = np.asarray(q, dtype=np.float64).ravel()
+    if rmax is None:
+        rmax = get_rmax(structure, periodic)
+    atomic_numbers, r, histograms = get_pair_histograms(structure, rmax, dr, periodic,
+                                                        max_memory, workers)
+    sums = sum_histograms(q, r, histograms, max_memory)
+    ff = np.array([get_ff(Z, radiation, q) * np.ones(len(q)) for Z in atomic_numbers])
+    counts = np.array([np.count_nonzero(structure.get_atomic_numbers() == Z)
+                       for Z in atomic_numbers])
+    number = max(1, counts.sum())
+    intensity = np.dot(counts, ff**2) + 2*np.einsum('aq,bq,qab->q', ff, ff, sums)
+    intensity /= number
+    if periodic:
+        density = number / (structure.unitcell.volume * np.prod(get_ncells(structure)))
+        average = np.dot(counts, ff) / number
+        qr = q*rmax
+        sphere = np.where(q > 0, 4*np.pi*(np.sin(qr) - qr*np.cos(qr))/np.where(q > 0, q, 1)**3,
+                          4*np.pi*rmax**3/3)
+        intensity -= density * average**2 * sphere
+    return xr.DataArray(data=intensity,
+                        name="Intensity",
+                        dims=("Q",),
+                        coords=(q,),
+                        attrs=(("units", "A^-1"),))
@@ -7,9 +7,9 @@ This module define the Fourier object and other functions related to
 the fourier transformation.
 """
 from __future__ import absolute_import
+from itertools import permutations
 import numpy as np
-from random import randrange
-from javelin.grid import Grid
+from javelin.grid import Grid, PointGrid, SliceGrid, get_slice_grid
 
 
 class Fourier(object):
@@ -20,7 +20,21 @@ class Fourier(object):
         self._radiation = 'neutron'
         self._lots = None
         self._number_of_lots = None
+        self._seed = None
         self._average = False
+        self._max_memory = 2**27
+        self._precision = 'double'
+        self._engine = 'grid'
+        self._tolerance = 1e-6
+        self._symmetry = None
+        self._operators = None
+        self._friedel = False
+        self._g_factor = None
+        self._workers = 1
+        self._deterministic = False
+        self._processes = None
+        self._output = None
+        self._cache = LRUCache(16)
         self.grid = Grid()
 
     @property
@@ -51,6 +65,44 @@ class Fourier(object):
     @structure.setter
     def structure(self, structure):
         self._structure = structure
+        self._cache.clear()
+
+    @property
+    def grid(self):
+        """The grid over which the fourier transform is calculated. With
+        a :class:`javelin.grid.PointGrid` only those points are calculated,
+        summing directly unless the :attr:`engine` is 'nufft'. With a
+        :class:`javelin.grid.SliceGrid` the in-plane phase factors are
+        shared by all the slices.
+
+        :getter: Returns the grid
+        :setter: Sets the grid
+        :type: :class:`javelin.grid.Grid`, :class:`javelin.grid.PointGrid`
+           or :class:`javelin.grid.SliceGrid`
+        """
+        return self._grid
+
+    @grid.setter
+    def grid(self, grid):
+        self._grid = grid
+        self._cache.clear()
+
+    @property
+    def cache_size(self):
+        """The maximum number of |Q| and form factor arrays kept in
+        the cache, the least recently used are discarded first. The
+        cache is cleared when the structure or grid is set, and entries
+        of a previous grid geometry or unit cell are never reused.
+
+        :getter: Returns the cache size
+        :setter: Sets the cache size
+        :type: int
+        """
+        return self._cache.maxsize
+
+    @cache_size.setter
+    def cache_size(self, value):
+        self._cache.maxsize = value
 
     @property
     def lots(self):
@@ -87,6 +139,263 @@ class Fourier(object):
     def number_of_lots(self, value):
         self._number_of_lots = value
 
+    @property
+    def seed(self):
+        """The seed used to draw the origin of the lots. With an int the
+        same lots are used for every calculation, a
+        :class:`numpy.random.Generator` or
+        :class:`numpy.random.RandomState` is used as is. None draws
+        different lots every time.
+
+        :getter: Returns the seed
+        :setter: Sets the seed
+        :type: int, :class:`numpy.random.Generator`,
+           :class:`numpy.random.RandomState` or None
+        """
+        return self._seed
+
+    @seed.setter
+    def seed(self, seed):
+        self._seed = seed
+
+    @property
+    def average(self):
+        """If True the amplitude of the average structure is subtracted
+        before the intensity is calculated, leaving only the diffuse
+        scattering. Only for javelin structures.
+
+        :getter: Returns if the average structure is subtracted
+        :setter: Sets if the average structure is subtracted
+        :type: bool
+        """
+        return self._average
+
+    @average.setter
+    def average(self, value):
+        self._average = bool(value)
+
+    @property
+    def max_memory(self):
+        """The maximum memory in bytes used by the temporary arrays of
+        each block of atoms. Atoms are summed over in blocks as large as
+        this allows, with :attr:`workers` blocks in memory at once.
+
+        :getter: Returns the maximum memory per block
+        :setter: Sets the maximum memory per block
+        :type: int
+        """
+        return self._max_memory
+
+    @max_memory.setter
+    def max_memory(self, value):
+        if value <= 0:
+            raise ValueError("max_memory must be positive")
+        self._max_memory = int(value)
+
+    @property
+    def precision(self):
+        """The precision of the calculation. With 'single' the phase
+        factors of each block of atoms are summed in single precision,
+        halving the memory of the temporary arrays and roughly doubling
+        the throughput, while the amplitudes and intensities are still
+        accumulated in double precision.
+
+        :getter: Returns the precision
+        :setter: Sets the precision
+        :type: str ('single' or 'double')
+        """
+        return self._precision
+
+    @precision.setter
+    def precision(self, precision):
+        if precision not in ('single', 'double'):
+            raise ValueError("precision must be 'single' or 'double'")
+        self._precision = precision
+
+    @property
+    def engine(self):
+        """The method used to sum the phase factors when fast. 'grid'
+        factorises the phase factor of every atom along the grid axes.
+        'cell' uses the (i, j, k, site) layout of a
+        :class:`javelin.structure.Structure`, the lattice sum over the
+        cells of each distinct position within the cells is contracted
+        one crystal axis at a time, which is much faster for supercells
+        with few distinct positions, see :func:`sum_cell_phase_factors`.
+        Other structure classes always use 'grid'.
+        'fft' spreads each atom type onto a fine grid which is fourier
+        transformed, see :mod:`javelin.nufft`, this is approximate to
+        within :attr:`tolerance` but the cost per atom does not depend on
+        the size of the grid. 'nufft' treats the grid points as an
+        arbitrary list of Q with a type-3 non-uniform FFT, also to within
+        :attr:`tolerance`.
+
+        :getter: Returns the engine
+        :setter: Sets the engine
+        :type: str ('grid', 'cell', 'fft' or 'nufft')
+        """
+        return self._engine
+
+    @engine.setter
+    def engine(self, engine):
+        if engine not in ('grid', 'cell', 'fft', 'nufft'):
+            raise ValueError("engine must be 'grid', 'cell', 'fft' or 'nufft'")
+        self._engine = engine
+
+    @property
+    def tolerance(self):
+        """The relative tolerance of the approximate 'fft' and 'nufft'
+        engines, smaller is more accurate but slower.
+
+        :getter: Returns the tolerance
+        :setter: Sets the tolerance
+        :type: float
+        """
+        return self._tolerance
+
+    @tolerance.setter
+    def tolerance(self, value):
+        if value <= 0:
+            raise ValueError("tolerance must be positive")
+        self._tolerance = float(value)
+
+    @property
+    def workers(self):
+        """The number of threads the atoms are split across. Each thread
+        works on its own block of atoms, see :attr:`max_memory`.
+
+        :getter: Returns the number of threads
+        :setter: Sets the number of threads
+        :type: int
+        """
+        return self._workers
+
+    @workers.setter
+    def workers(self, value):
+        if value < 1:
+            raise ValueError("Must have at least 1 worker")
+        self._workers = int(value)
+
+    @property
+    def deterministic(self):
+        """If True the partial sums from each block of atoms are reduced
+        in a fixed order so the result is bit-for-bit the same regardless
+        of the number of :attr:`workers`.
+
+        :getter: Returns if deterministic
+        :setter: Sets deterministic
+        :type: bool
+        """
+        return self._deterministic
+
+    @deterministic.setter
+    def deterministic(self, value):
+        self._deterministic = bool(value)
+
+    @property
+    def processes(self):
+        """The number of processes the lots are farmed out to. None
+        calculates the lots one after another in this process.
+
+        :getter: Returns the number of processes
+        :setter: Sets the number of processes
+        :type: int or None
+        """
+        return self._processes
+
+    @processes.setter
+    def processes(self, value):
+        if value is None:
+            self._processes = None
+        elif value < 1:
+            raise ValueError("Must have at least 1 process")
+        else:
+            self._processes = int(value)
+
+    @property
+    def output(self):
+        """The file the result is written to. When set, the grid is
+        calculated in slabs along Q1, as many rows as fit in
+        :attr:`max_memory`, and each finished slab is written to the file
+        so the whole result never has to fit in memory. Files ending in
+        .h5, .hdf5 or .nxs are written as a chunked HDF5 dataset, anything
+        else as a .npy file read back as a :class:`numpy.memmap`. The
+        returned DataArray is lazily loaded from the file, from HDF5 this
+        requires dask and the file stays open for reading until the
+        DataArray is deleted. None keeps the result in memory.
+
+        :getter: Returns the output filename
+        :setter: Sets the output filename
+        :type: str or None
+        """
+        return self._output
+
+    @output.setter
+    def output(self, filename):
+        self._output = filename
+
+    @property
+    def symmetry(self):
+        """The Laue symmetry of the model. Only the points of the grid
+        that are not related by symmetry are calculated and the rest are
+        filled in, if the grid is not closed under the operators the
+        whole grid is calculated. See :mod:`javelin.symmetry` for the
+        Laue class names.
+
+        :getter: Returns the symmetry
+        :setter: Sets the symmetry as a Laue class name or a list of
+           operators acting on hkl, the group they generate is used
+        :type: str, list of 3x3 matrices or None
+        """
+        return self._symmetry
+
+    @symmetry.setter
+    def symmetry(self, symmetry):
+        if symmetry is None:
+            self._operators = None
+        else:
+            from javelin.symmetry import get_operators
+            self._operators = get_operators(symmetry)
+        self._symmetry = symmetry
+
+    @property
+    def friedel(self):
+        """If True the non-magnetic intensity is taken to obey
+        Friedel's law, I(Q) = I(-Q), which holds for the real form factors
+        of :func:`get_ff`. On grids centred on Q = 0 only half of the grid
+        is then calculated, in a single pass, and mirrored into the other
+        half, together with any :attr:`symmetry`. Other grids are
+        calculated in full, they are recognised from the corners of the
+        grid alone. False by default, as anomalous scattering breaks
+        Friedel's law.
+
+        :getter: Returns if Friedel's law is used
+        :setter: Sets if Friedel's law is used
+        :type: bool
+        """
+        return self._friedel
+
+    @friedel.setter
+    def friedel(self, value):
+        self._friedel = bool(value)
+
+    @property
+    def g_factor(self):
+        """The Landé g-factor used for the magnetic form factor in the
+        dipole approximation, ``<j0> + (2/g - 1)<j2>``. With None only
+        ``<j0>`` is used.
+
+        :getter: Returns the g-factor
+        :setter: Sets the g-factor
+        :type: float or None
+        """
+        return self._g_factor
+
+    @g_factor.setter
+    def g_factor(self, value):
+        if value is not None and value <= 0:
+            raise ValueError("g-factor must be greater than 0")
+        self._g_factor = value
+
     def __get_unitcell(self):
         """Wrapper to get the unit cell from different structure classes"""
         from javelin.unitcell import UnitCell
@@ -104,13 +413,89 @@ class Fourier(object):
                     raise ValueError("Unable to get unit cell from structure")
 
     def __get_q(self):
+        """Returns |Q| over the grid, cached by grid and unit cell"""
+        unitcell = self.__get_unitcell()
+        return self._cache.get(('q', self.__get_grid_key(), unitcell.cell),
+                               lambda: self.__calculate_q(unitcell))
+
+    def __calculate_q(self, unitcell):
         qx, qy, qz = self.grid.get_q_meshgrid()
         q = np.linalg.norm(np.array([qx.ravel(),
                                      qy.ravel(),
-                                     qz.ravel()]).T * self.__get_unitcell().B, axis=1)
+                                     qz.ravel()]).T * unitcell.B, axis=1)
         q.shape = qx.shape
         return q*2*np.pi
 
+    def __get_grid_key(self):
+        """Returns a hashable description of the grid geometry"""
+        grid = self.grid
+        if isinstance(grid, PointGrid):
+            return ('points', grid.points.tobytes())
+        offsets = None
+        if isinstance(grid, SliceGrid):
+            grid, offsets = grid.grid, ('slices', grid.offsets.tobytes())
+        return (tuple(grid.ll), tuple(grid.lr), tuple(grid.ul),
+                tuple(grid.tl), tuple(grid.bins), offsets)
+
+    def _get_ff(self, atomic_number):
+        """Returns the form factor of atomic_number over the grid, cached
+        by grid, unit cell, radiation and atomic number"""
+        if self.radiation == 'neutron':  # independent of Q
+            return self._cache.get(('ff', self.radiation, atomic_number),
+                                   lambda: get_ff(atomic_number, self.radiation))
+        return self._cache.get(('ff', self.__get_grid_key(), self.__get_unitcell().cell,
+                                self.radiation, atomic_number),
+                               lambda: get_ff(atomic_number, self.radiation, self.__get_q()))
+
+    def _get_mag_ff(self, atomic_number, ion):
+        """Returns the magnetic form factor of atomic_number and ion over
+        the grid, cached by grid, unit cell, ion and g-factor"""
+        return self._cache.get(('mag_ff', self.__get_grid_key(), self.__get_unitcell().cell,
+                                atomic_number, ion, self.g_factor),
+                               lambda: get_mag_ff(atomic_number, self.__get_q(), ion,
+                                                  self.g_factor))
+
+    def _sum_phases(self, positions, fast, weights=None, cells=None):
+        """Sums the phase factors of the positions over the grid using
+        either the factorised or the direct kernel. If cells are given the
+        positions are within those cells."""
+        dtype = np.complex64 if self.precision == 'single' else np.complex128
+        if isinstance(self.grid, SliceGrid):
+            return self.__sum_slice_phases(positions, fast, weights, cells, dtype)
+        # points cannot be factorised
+        fast = fast and (self.engine == 'nufft' or not isinstance(self.grid, PointGrid))
+        if cells is not None:
+            if fast and self.engine == 'cell':
+                return sum_cell_phase_factors(cells, positions, self.grid, weights,
+                                              self.max_memory, self.workers,
+                                              self.deterministic, dtype)
+            positions = positions + cells
+        if fast and self.engine == 'fft':
+            from javelin.nufft import sum_phases_fft
+            return sum_phases_fft(positions, self.grid, weights, self.tolerance, self.max_memory)
+        if fast and self.engine == 'nufft':
+            from javelin.nufft import sum_phases_nufft
+            q = np.array([np.ravel(qi) for qi in self.grid.get_q_meshgrid()]).T
+            results = sum_phases_nufft(positions, q, weights, self.tolerance, self.max_memory)
+            return results.reshape(results.shape[:-1] + get_bins(self.grid))
+        if fast:
+            return sum_phase_factors(positions, self.grid, weights, self.max_memory,
+                                     self.workers, self.deterministic, dtype)
+        else:
+            return sum_phases(positions, self.grid, weights, self.max_memory,
+                              self.workers, self.deterministic, dtype)
+
+    def __sum_slice_phases(self, positions, fast, weights, cells, dtype):
+        """Sums the phase factors of the positions over the slices, see
+        :func:`sum_slice_phase_factors`"""
+        if cells is not None:
+            positions = positions + cells
+        if fast:
+            return sum_slice_phase_factors(positions, self.grid, weights, self.max_memory,
+                                           self.workers, self.deterministic, dtype)
+        return sum_phases(positions, self.grid, weights, self.max_memory,
+                          self.workers, self.deterministic, dtype)
+
     def __get_positions(self):
         """Wrapper to get the positions from different structure classes"""
         try:  # ASE structure
@@ -121,6 +506,25 @@ class Fourier(object):
             except AttributeError:
                 raise ValueError("Unable to get positions from structure")
 
+    def __get_cells(self):
+        """Returns the integer cell (i, j, k) of every atom of a javelin
+        structure or None for other structure classes"""
+        try:
+            return self.structure.get_cell_indices()[:, :3]
+        except AttributeError:
+            return None
+
+    def __get_magnetic_ions(self):
+        """Returns the ion charge of every atom for the magnetic form
+        factor, 3 if the structure has none"""
+        try:
+            ions = self.structure.get_magnetic_ions()
+        except AttributeError:
+            ions = None
+        if ions is None:
+            return np.full(len(self.__get_atomic_numbers()), 3, dtype=np.int64)
+        return np.asarray(ions, dtype=np.int64)
+
     def __get_atomic_numbers(self):
         """Wrapper to get the atomic numbers from different structure classes"""
         from javelin.utils import get_atomic_number_symbol
@@ -133,6 +537,49 @@ class Fourier(object):
             except AttributeError:
                 raise ValueError("Unable to get elements from structure")
 
+    def get_amplitude(self, fast=True):
+        """Calculates the amplitude of the whole structure and returns it
+        as an :class:`Amplitude` that can be updated as atoms are moved,
+        swapped or substituted.
+
+        :param fast: fast option
+        :type fast: bool
+        :return: Amplitude of the structure
+        :rtype: :class:`Amplitude`
+        """
+        return Amplitude(self, self.__get_atomic_numbers(), self.__get_positions(), fast)
+
+    def calc_slices(self, slices, normal=(0.0, 0.0, 1.0), mag=False, fast=True):
+        """Calculates a stack of parallel 2D slices at once, such as HK0,
+        HK0.5 and HK1. The in-plane phase factors of each atom are
+        calculated once for all the slices which then only differ by the
+        phase factor of their offset, see :class:`javelin.grid.SliceGrid`.
+
+        :param slices: the 2D grids of the slices, or the offsets of the
+           slices from the 2D :attr:`grid` as multiples of normal or
+           as vectors
+        :type slices: list of :class:`javelin.grid.Grid`, list of float
+           or :class:`numpy.ndarray` (N, 3)
+        :param normal: direction of offsets given as multiples
+        :type normal: list of 3 float
+        :param mag: select if calculating magnetic scattering
+        :type mag: bool
+        :param fast: fast option
+        :type fast: bool
+        :return: DataArray of the slices stacked along the last axis
+        :rtype: :class:`xarray.DataArray`
+        """
+        from copy import copy
+        if all(isinstance(s, Grid) for s in slices):
+            grid = get_slice_grid(slices)
+        else:
+            grid = SliceGrid(self.grid, slices, normal)
+        # A copy calculates the slices so the grid of this object is kept,
+        # the cache is shared as its keys include the grid geometry
+        fourier = copy(self)
+        fourier._grid = grid
+        return fourier.calc(mag, fast)
+
     def calc(self, mag=False, fast=True):
         """Calculates the fourier transform
 
@@ -144,189 +591,634 @@ class Fourier(object):
         :rtype: :class:`xarray.DataArray`
         """
 
-        if self._average:
+        if self.output is not None:
+            return self.__calculate_slabs(mag, fast)
+
+        symmetric = self.__calculate_symmetric(mag, fast)
+        if symmetric is not None:
+            return create_xarray_dataarray(symmetric, self.grid)
+
+        if self.average:
             aver = self._calculate_average(fast)
 
         if self.lots is None:
             atomic_numbers = self.__get_atomic_numbers()
-            positions = self.__get_positions()
+            cells = self.__get_cells() if fast and self.engine == 'cell' else None
+            if cells is None:
+                positions = self.__get_positions()
+            else:  # positions within the cells
+                positions = self.structure.xyz
             if mag:
                 magmons = self.structure.get_magnetic_moments()
+                ions = self.__get_magnetic_ions()
                 return create_xarray_dataarray(self._calculate_magnetic(atomic_numbers,
                                                                         positions,
                                                                         magmons,
-                                                                        fast=fast), self.grid)
+                                                                        fast=fast,
+                                                                        cells=cells,
+                                                                        ions=ions), self.grid)
             else:
                 results = self._calculate(atomic_numbers,
                                           positions,
-                                          fast=fast)
-                if self._average:
+                                          fast=fast,
+                                          cells=cells)
+                if self.average:
                     results -= aver
 
                 return create_xarray_dataarray(np.real(results*np.conj(results)), self.grid)
 
         else:  # needs to be Javelin structure, lots by unit cell
-            total = np.zeros(self.grid.bins)
-            levels = self.structure.atoms.index.levels
-            for lot in range(self.number_of_lots):
-                print(lot+1, 'out of', self.number_of_lots)
-                starti = randrange(len(levels[0]))
-                startj = randrange(len(levels[1]))
-                startk = randrange(len(levels[2]))
-                ri = np.roll(levels[0], starti)[:self.lots[0]]
-                rj = np.roll(levels[1], startj)[:self.lots[1]]
-                rk = np.roll(levels[2], startk)[:self.lots[2]]
-                atoms = self.structure.atoms.loc[ri, rj, rk, :]
-                atomic_numbers = atoms.Z.values
-                positions = (atoms[['x', 'y', 'z']].values +
-                             np.asarray([atoms.index.get_level_values(0).values,
-                                         atoms.index.get_level_values(1).values,
-                                         atoms.index.get_level_values(2).values]).T)
-                print(starti, startj, startk, ri, rj, rk)
-                print(len(atomic_numbers))
-                print(positions.shape)
-                if mag:
-                    magmons = self.structure.magmons.loc[ri, rj, rk, :].values
-                    total += self._calculate_magnetic(atomic_numbers, positions, magmons, fast=fast)
-                else:
-                    results = self._calculate(atomic_numbers, positions, fast=fast)
-                    if self._average:
-                        results -= aver
-                    total += np.real(results*np.conj(results))
-
-            return create_xarray_dataarray(total, self.grid)
+            return create_xarray_dataarray(self.__calculate_lots(mag, fast,
+                                                                 aver if self.average else None),
+                                           self.grid)
 
-    def _calculate_average(self, fast):
-        aver = np.zeros(self.grid.bins, dtype=np.complex)
-        levels = self.structure.atoms.index.levels
-        count = 0
-        for i in levels[0]:
-            for j in levels[1]:
-                for k in levels[2]:
-                    count += 1
-                    atoms = self.structure.atoms.loc[i, j, k, :]
-                    aver += self.calculate(atoms.Z.values,
-                                           atoms[['x', 'y', 'z']].values,
-                                           fast)
-
-        aver /= count
+    def __calculate_lots(self, mag, fast, aver):
+        """Returns the sum of the intensities of the lots"""
+        table = self.__get_lots_table(mag)
+        origins = self.__get_lot_origins(table['rows'].shape[:3])
+        if self.processes is not None:
+            return self.__calculate_lots_in_processes(table, origins, mag, fast, aver)
+        total = np.zeros(self.grid.bins, dtype=np.float64)
+        for lot, origin in enumerate(origins):
+            print(lot+1, 'out of', self.number_of_lots)
+            total += self._calculate_lot(table, origin, mag, fast, aver)
+        return total
 
-        if self.lots is None:
-            index = self.structure.atoms.index.droplevel(3).drop_duplicates()
+    def __calculate_slabs(self, mag, fast):
+        """Calculates the grid in slabs along Q1, writing each to the
+        output file, and returns the lazily loaded result"""
+        bins = tuple(int(n) for n in self.grid.bins)
+        rows = max(2, self.max_memory // (16*int(np.prod(bins[1:]))))
+        starts = list(range(0, bins[0], rows))
+        if len(starts) > 1 and bins[0] - starts[-1] < 2:  # merge a single last row
+            starts.pop()
+        fourier = self.__get_part_fourier()
+        hdf5 = self.output.lower().endswith(('.h5', '.hdf5', '.nxs'))
+        if hdf5:
+            import h5py
+            import dask.array as da
+            f = h5py.File(self.output, 'w')
+            chunks = (1,) + bins[1:] if len(bins) > 1 else (min(rows, bins[0]),)
+            data = f.create_dataset('Intensity', shape=bins, dtype=np.float64, chunks=chunks)
+        else:
+            data = np.lib.format.open_memmap(self.output, mode='w+',
+                                             dtype=np.float64, shape=bins)
+        try:
+            for start, stop in zip(starts, starts[1:] + [bins[0]]):
+                print('Q1 slab', start, 'to', stop-1, 'out of', bins[0]-1)
+                fourier.grid = self.grid.get_slab(start, stop)
+                data[start:stop] = fourier.calc(mag, fast).values
+        finally:
+            if hdf5:
+                f.close()
+            else:
+                data.flush()
+                del data
+        if hdf5:  # the file is closed once the dask array is deleted
+            data = h5py.File(self.output, 'r')['Intensity']
+            values = da.from_array(data, chunks=(rows,) + bins[1:])
         else:
-            index = self.structure.atoms.loc[range(self.lots[0]),
-                                             range(self.lots[1]),
-                                             range(self.lots[2]),
-                                             :].index.droplevel(3).drop_duplicates()
+            values = np.load(self.output, mmap_mode='r')
+        return create_xarray_dataarray(values, self.grid)
 
-        aver *= self.calculate(np.zeros(len(index)),
-                               np.asarray([index.get_level_values(0).values,
-                                           index.get_level_values(1).values,
-                                           index.get_level_values(2).values]).T,
-                               fast,
-                               use_ff=False)
+    def __get_part_fourier(self):
+        """Returns a copy to calculate parts of the grid with, writing
+        nothing to file, with its own cache and the same lots for every
+        part"""
+        from copy import copy
+        fourier = copy(self)
+        fourier._output = None
+        fourier._symmetry = None
+        fourier._operators = None
+        fourier._friedel = False
+        fourier._cache = LRUCache(self.cache_size)
+        if self.lots is not None and not isinstance(self.seed, (int, np.integer)):
+            fourier._seed = self.__get_lot_origins(np.iinfo(np.int32).max, 1)[0, 0]
+        return fourier
 
-        return aver
+    def __get_symmetry_maps(self, mag):
+        """Returns how the symmetry, with Friedel's law if it holds, maps
+        the indices of the grid points, see
+        :func:`javelin.symmetry.get_index_maps`, or None if there is no
+        symmetry or the grid is not closed under it"""
+        if not isinstance(self.grid, Grid):
+            return None
+        from javelin.symmetry import add_inversion, get_index_maps
+        if self.friedel and not mag:
+            maps = get_index_maps(self.grid, add_inversion(
+                [np.eye(3)] if self._operators is None else self._operators))
+            if maps:
+                return maps
+        if self._operators is None:
+            return None
+        maps = get_index_maps(self.grid, self._operators)
+        if maps is None:
+            print("The grid is not closed under the symmetry, calculating the full grid")
+        return maps if maps else None
 
-    def _calculate(self, atomic_numbers, positions, fast, use_ff=True):
-        if fast:
-            qx, qy, qz = self.grid.get_squashed_q_meshgrid()
+    def __get_symmetric_boxes(self, maps, rows):
+        """Returns the boxes of the grid containing the representative
+        points, found in slabs of rows along Q1. The phase factors in the
+        Q2 and Q3 ranges of a box are calculated once for all its rows,
+        so the slabs are merged into boxes at least a quarter of the grid
+        thick, and further while they need the same Q2 and Q3 ranges.
+        With Friedel's law the half grid is then a single box."""
+        from javelin.symmetry import map_representatives
+        bins = tuple(int(n) for n in self.grid.bins)
+        thickness = -(-bins[0] // 4)
+        boxes = []
+        for start in range(0, bins[0], rows):
+            representatives = map_representatives(bins, maps, start, min(start + rows, bins[0]))
+            points = (representatives.ravel() ==
+                      np.arange(representatives.size) + start*int(np.prod(bins[1:])))
+            if not points.any():
+                continue
+            index = np.unravel_index(np.flatnonzero(points), representatives.shape)
+            box = [[start + index[0].min(), start + index[0].max() + 1]]
+            box += [[i.min(), i.max() + 1] for i in index[1:]]
+            if boxes and boxes[-1][0][1] == box[0][0] and (
+                    boxes[-1][1:] == box[1:] or boxes[-1][0][1] - boxes[-1][0][0] < thickness):
+                boxes[-1] = [[min(a[0], b[0]), max(a[1], b[1])] for a, b in zip(boxes[-1], box)]
+            else:
+                boxes.append(box)
+        return [[_expand_range(b[0], b[1], n) for b, n in zip(box, bins)] for box in boxes]
+
+    def __calculate_symmetric(self, mag, fast):
+        """Calculates the representative points of the grid in boxes
+        along Q1 and fills the rest by symmetry, a slab at a time. Returns
+        None if there is no symmetry or the grid is not closed under it."""
+        from javelin.symmetry import map_representatives
+        maps = self.__get_symmetry_maps(mag)
+        if maps is None:
+            return None
+        bins = tuple(int(n) for n in self.grid.bins)
+        rows = -(-bins[0] // 16)
+        fourier = self.__get_part_fourier()
+        values = np.zeros(bins, dtype=np.float64)
+        calculated = 0
+        for box in self.__get_symmetric_boxes(maps, rows):
+            fourier.grid = self.grid.get_subgrid(*zip(*box))
+            values[tuple(slice(*b) for b in box)] = fourier.calc(mag, fast).values
+            calculated += np.prod(fourier.grid.bins)
+        print('Calculated', calculated, 'out of', np.prod(bins), 'points using symmetry')
+        flat = values.reshape(-1)
+        for start in range(0, bins[0], rows):
+            stop = min(start + rows, bins[0])
+            values[start:stop] = flat[map_representatives(bins, maps, start, stop)]
+        return values
+
+    def __get_lot_origins(self, ncells, number=None):
+        """Returns the starting cell of every lot drawn from seed. Each
+        axis is drawn separately so ncells may be a scalar or one value
+        per axis."""
+        size = self.number_of_lots if number is None else number
+        if hasattr(self.seed, 'integers'):  # numpy.random.Generator
+            draw = self.seed.integers
+        elif hasattr(self.seed, 'randint'):  # numpy.random.RandomState
+            draw = self.seed.randint
+        else:
+            draw = np.random.RandomState(self.seed).randint
+        return np.column_stack([draw(0, n, size=size)
+                                for n in np.broadcast_to(ncells, (3,))])
+
+    def __get_lots_table(self, mag):
+        """Returns the atom table needed to select lots as a dict of numpy
+        arrays. 'rows' is the integer cell index array, the row of the
+        atom in cell (i, j, k) and site or -1 if there is none."""
+        structure = self.structure
+        rows = np.full(structure.ncells, -1, dtype=np.int64)
+        rows[tuple(structure.get_cell_indices().T)] = np.arange(structure.number_of_atoms)
+        table = {'Z': np.asarray(structure.get_atomic_numbers(), dtype=np.int64),
+                 'xyz': np.asarray(structure.xyz, dtype=np.float64),
+                 'rows': rows}
+        if mag:
+            table['magmons'] = np.asarray(self.structure.get_magnetic_moments(), dtype=np.float64)
+            table['ions'] = self.__get_magnetic_ions()
+        return table
+
+    def _calculate_lot(self, table, origin, mag, fast, aver=None):
+        """Calculates the intensity of the lot starting at the cell origin
+        from the atom table. The lot is gathered from the integer cell
+        index array, wrapping around periodically, and its atoms are
+        placed in contiguous cells starting at (0, 0, 0)."""
+        rows = table['rows']
+        lot = rows[np.ix_(*[(origin[n] + np.arange(min(self.lots[n], rows.shape[n]))) %
+                            rows.shape[n] for n in range(3)])]
+        present = lot >= 0
+        index = lot[present]
+        atomic_numbers = table['Z'][index]
+        positions = table['xyz'][index]
+        cells = np.transpose(np.nonzero(present)[:3])
+        if mag:
+            return self._calculate_magnetic(atomic_numbers, positions, table['magmons'][index],
+                                            fast=fast, cells=cells, ions=table['ions'][index])
         else:
-            qx, qy, qz = self.grid.get_q_meshgrid()
-        qx *= (2*np.pi)
-        qy *= (2*np.pi)
-        qz *= (2*np.pi)
+            results = self._calculate(atomic_numbers, positions, fast=fast, cells=cells)
+            if aver is not None:
+                results -= aver
+            return np.real(results*np.conj(results))
 
+    def __calculate_lots_in_processes(self, table, origins, mag, fast, aver):
+        """Farms the lots out to a pool of processes. The atom table is
+        placed in shared memory so it is not copied to every process,
+        each process gets a copy of this Fourier object without the
+        structure, the cache or the memoised meshes of the grid."""
+        from copy import copy, deepcopy
+        from multiprocessing import Pool
+        from javelin.structure import Structure
+        fourier = copy(self)
+        fourier._structure = Structure(unitcell=self.structure.unitcell)
+        fourier._cache = LRUCache(self.cache_size)
+        fourier._grid = deepcopy(self.grid)
+        shared = dict((name, share_array(array)) for name, array in table.items())
+        pool = None
+        try:
+            pool = Pool(self.processes, initializer=_init_lots_process,
+                        initargs=(fourier, shared, aver))
+            intensities = (pool.imap if self.deterministic else pool.imap_unordered)(
+                _calculate_lot_in_process, [(origin, mag, fast) for origin in origins])
+            total = np.zeros(self.grid.bins, dtype=np.float64)
+            for lot, intensity in enumerate(intensities):
+                print(lot+1, 'out of', self.number_of_lots)
+                total += intensity
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            for array in shared.values():
+                free_shared_array(*array)
+        return total
+
+    def _calculate_average(self, fast):
+        """Returns the amplitude of the average structure, the average
+        unit cell amplitude times the lattice sum over the cells of the
+        structure, or of a lot.
+
+        The atoms are reduced to the distinct (Z, x, y, z) rows weighted
+        by their count per cell, so every distinct position is summed
+        once, and the lattice sum is calculated in closed form by
+        :func:`get_lattice_sum`."""
+        ncells = self.structure.ncells[:3]
+        rows, counts = np.unique(np.column_stack((self.structure.get_atomic_numbers(),
+                                                  self.structure.xyz)),
+                                 axis=0, return_counts=True)
+        aver = self._calculate(rows[:, 0].astype(np.int64), rows[:, 1:], fast,
+                               weights=counts/float(np.prod(ncells)))
+        # The cells of the structure and of the lots start at (0, 0, 0)
+        number = ncells if self.lots is None else np.minimum(self.lots, ncells)
+        return aver * get_lattice_sum([0, 0, 0], number, self.grid, fast)
+
+    def _calculate(self, atomic_numbers, positions, fast, use_ff=True, cells=None,
+                   weights=None):
         # Get unique list of atomic numbers
         unique_atomic_numbers = np.unique(atomic_numbers)
 
-        results = np.zeros(self.grid.bins, dtype=np.complex)
+        results = np.zeros(self.grid.bins, dtype=np.complex128)
         # Loop of atom types
         for atomic_number in unique_atomic_numbers:
             try:
-                ff = get_ff(atomic_number, self.radiation, self.__get_q()) if use_ff else 1
+                ff = self._get_ff(atomic_number) if use_ff else 1
             except KeyError as e:
                 print("Skipping fourier calculation for atom " + str(e) +
                       ", unable to get scattering factors.")
                 continue
 
-            atom_positions = positions[np.where(atomic_numbers == atomic_number)]
-            temp_array = np.zeros(self.grid.bins, dtype=np.complex)
+            index = np.where(atomic_numbers == atomic_number)
+            atom_positions = positions[index]
             print("Working on atom number", atomic_number, "Total atoms:", len(atom_positions))
 
-            # Loop over atom positions of type atomic_number
-            if fast:
-                for atom in atom_positions:
-                    dotx = np.exp(qx*atom[0]*1j)
-                    doty = np.exp(qy*atom[1]*1j)
-                    dotz = np.exp(qz*atom[2]*1j)
-                    temp_array += dotx * doty * dotz
-            else:
-                for atom in atom_positions:
-                    dot = qx*atom[0] + qy*atom[1] + qz*atom[2]
-                    temp_array += np.exp(dot*1j)
-
-            results += temp_array * ff  # scale by form factor
+            temp_array = self._sum_phases(atom_positions, fast,
+                                          weights=None if weights is None else weights[index],
+                                          cells=None if cells is None else cells[index])
+            results += temp_array.reshape(self.grid.bins) * ff  # scale by form factor
 
         return results
 
-    def _calculate_magnetic(self, atomic_numbers, positions, magmons, fast):
-        if fast:
-            qx, qy, qz = self.grid.get_squashed_q_meshgrid()
-        else:
-            qx, qy, qz = self.grid.get_q_meshgrid()
-        qx *= (2*np.pi)
-        qy *= (2*np.pi)
-        qz *= (2*np.pi)
-        q2 = self.__get_q()**2
+    def _calculate_magnetic(self, atomic_numbers, positions, magmons, fast, cells=None,
+                            ions=None):
+        """Returns the magnetic intensity. The three spin components of
+        each atom type and ion are summed in one blocked matrix product
+        with the moments of that type as weights and accumulated in
+        place, the component perpendicular to Q is then also found in
+        place. Without ions every atom is taken as a 3+ ion."""
+        magmons = np.asarray(magmons, dtype=np.float64)
+        atomic_numbers = np.asarray(atomic_numbers)
+        ions = np.full(len(atomic_numbers), 3) if ions is None else np.asarray(ions)
 
-        # Get unique list of atomic numbers
-        unique_atomic_numbers = np.unique(atomic_numbers)
+        # Get unique list of atomic numbers and ions
+        species = np.unique(np.column_stack((atomic_numbers, ions)).astype(np.int64), axis=0)
 
         # Loop of atom types
-        spinx = np.zeros(self.grid.bins, dtype=np.complex)
-        spiny = np.zeros(self.grid.bins, dtype=np.complex)
-        spinz = np.zeros(self.grid.bins, dtype=np.complex)
-        for atomic_number in unique_atomic_numbers:
+        spin = None
+        for atomic_number, ion in species:
             try:
-                ff = get_mag_ff(atomic_number, self.__get_q(), ion=3)
+                ff = self._get_mag_ff(atomic_number, ion)
             except (AttributeError, KeyError) as e:
                 print("Skipping fourier calculation for atom " + str(e) +
                       ", unable to get magnetic scattering factors.")
                 continue
 
-            atom_positions = positions[np.where(atomic_numbers == atomic_number)]
-            temp_spinx = np.zeros(self.grid.bins, dtype=np.complex)
-            temp_spiny = np.zeros(self.grid.bins, dtype=np.complex)
-            temp_spinz = np.zeros(self.grid.bins, dtype=np.complex)
-            print("Working on atom number", atomic_number, "Total atoms:", len(atom_positions))
-            # Loop over atom positions of type atomic_number
-            if fast:
-                for atom, spin in zip(atom_positions, magmons):
-                    dotx = np.exp(qx*atom[0]*1j)
-                    doty = np.exp(qy*atom[1]*1j)
-                    dotz = np.exp(qz*atom[2]*1j)
-                    exp_temp = dotx * doty * dotz
-                    temp_spinx += exp_temp*spin[0]
-                    temp_spiny += exp_temp*spin[1]
-                    temp_spinz += exp_temp*spin[2]
+            index = np.where((atomic_numbers == atomic_number) & (ions == ion))
+            atom_positions = positions[index]
+            print("Working on atom number", atomic_number, "ion", ion,
+                  "Total atoms:", len(atom_positions))
+
+            temp_spin = self._sum_phases(atom_positions, fast, weights=magmons[index],
+                                         cells=None if cells is None else cells[index])
+            temp_spin = temp_spin.reshape((3,) + tuple(self.grid.bins))
+            temp_spin *= ff
+            if spin is None:
+                spin = temp_spin
             else:
-                for atom, spin in zip(atom_positions, magmons):
-                    dot = qx*atom[0] + qy*atom[1] + qz*atom[2]
-                    exp_temp = np.exp(dot*1j)
-                    temp_spinx += exp_temp*spin[0]
-                    temp_spiny += exp_temp*spin[1]
-                    temp_spinz += exp_temp*spin[2]
-            spinx += temp_spinx * ff
-            spiny += temp_spiny * ff
-            spinz += temp_spinz * ff
-        # Caluculate vector rejection of spin onto q
-        # M - M.Q/|Q|^2 Q
-        scale = (spinx*qx + spiny*qy + spinz*qz)/q2
-        spinx = spinx - scale * qx
-        spiny = spiny - scale * qy
-        spinz = spinz - scale * qz
-        return np.real(spinx*np.conj(spinx) + spiny*np.conj(spiny) + spinz*np.conj(spinz))
+                spin += temp_spin
+            del temp_spin
+        if spin is None:
+            return np.zeros(self.grid.bins, dtype=np.float64)
+        return get_perpendicular_intensity(spin, self.grid, fast)
+
+
+class LRUCache(object):
+    """A cache holding at most maxsize items, the least recently used
+    item is discarded first. Cached numpy arrays are made read-only.
+
+    >>> cache = LRUCache(2)
+    >>> cache.get('a', lambda: 1)
+    1
+    >>> cache.get('b', lambda: 2)
+    2
+    >>> cache.get('a', lambda: 3)
+    1
+    >>> cache.get('c', lambda: 4)
+    4
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    """
+    def __init__(self, maxsize=16):
+        from collections import OrderedDict
+        self._items = OrderedDict()
+        self._maxsize = maxsize
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, value):
+        if value < 0:
+            raise ValueError("maxsize must not be negative")
+        self._maxsize = int(value)
+        self.__discard()
+
+    def keys(self):
+        return list(self._items.keys())
+
+    def get(self, key, function):
+        """Returns the item of key, if missing it is calculated with
+        function() and stored"""
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            value = function()
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        self._items[key] = value
+        self.__discard()
+        return value
+
+    def clear(self):
+        self._items.clear()
+
+    def __discard(self):
+        while len(self._items) > self._maxsize:
+            self._items.popitem(last=False)
+
+
+class Amplitude(object):
+    """The amplitude A(Q) of the fourier transform of a structure, for
+    reverse Monte Carlo and similar workflows where a few atoms change
+    at a time. Rather than recalculating everything each change only
+    adds f*(exp(2*pi*i*Q.r_new) - exp(2*pi*i*Q.r_old)) for the atoms
+    involved, so each step costs O(grid) rather than O(atoms * grid).
+
+    Changes are pending until :meth:`accept` is called, :meth:`reject`
+    undoes all pending changes. Use :meth:`Fourier.get_amplitude` to
+    create one.
+
+    :param fourier: Fourier object providing the grid, radiation and
+       form factors
+    :type fourier: :class:`Fourier`
+    :param atomic_numbers: atomic numbers of the atoms
+    :type atomic_numbers: :class:`numpy.ndarray`
+    :param positions: fractional positions of the atoms
+    :type positions: :class:`numpy.ndarray` (N, 3)
+    :param fast: fast option
+    :type fast: bool
+    """
+    def __init__(self, fourier, atomic_numbers, positions, fast=True):
+        from copy import copy, deepcopy
+        self._fourier = copy(fourier)
+        self._fourier._cache = LRUCache(fourier.cache_size)
+        self._fourier.grid = deepcopy(fourier.grid)
+        self._fast = fast
+        self._atomic_numbers = np.array(atomic_numbers, dtype=np.int64)
+        self._positions = np.array(positions, dtype=np.float64)
+        self._undo = []
+        self._pending = None
+        self.recalculate()
+
+    @property
+    def atomic_numbers(self):
+        """The current atomic numbers of the atoms"""
+        return self._atomic_numbers
+
+    @property
+    def positions(self):
+        """The current fractional positions of the atoms"""
+        return self._positions
+
+    @property
+    def amplitude(self):
+        """The current complex amplitude over the grid"""
+        return self._amplitude
+
+    def recalculate(self):
+        """Recalculates the amplitude of all atoms from scratch, removing
+        any accumulated rounding errors. Pending changes are accepted."""
+        self._amplitude = self._fourier._calculate(self._atomic_numbers, self._positions,
+                                                   self._fast)
+        self.accept()
+
+    def get_intensity(self):
+        """Returns the current intensity, abs(A(Q))**2
+
+        :return: DataArray containing calculated diffuse scattering
+        :rtype: :class:`xarray.DataArray`
+        """
+        return create_xarray_dataarray(np.real(self._amplitude*np.conj(self._amplitude)),
+                                       self._fourier.grid)
+
+    def move(self, indices, positions):
+        """Moves the atoms to new fractional positions
+
+        :param indices: indices of the atoms to move
+        :type indices: int or list of int
+        :param positions: new positions of the atoms
+        :type positions: :class:`numpy.ndarray` (3,) or (N, 3)
+        """
+        indices = np.atleast_1d(indices)
+        positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+        atomic_numbers = self._atomic_numbers[indices]
+        self.__change(indices,
+                      np.concatenate((atomic_numbers, atomic_numbers)),
+                      np.concatenate((self._positions[indices], positions)))
+        self._positions[indices] = positions
+
+    def swap(self, i, j):
+        """Swaps the species of two atoms, the positions are unchanged
+
+        :param i: index of the first atom
+        :type i: int
+        :param j: index of the second atom
+        :type j: int
+        """
+        indices = np.array([i, j])
+        atomic_numbers = self._atomic_numbers[indices]
+        positions = self._positions[indices]
+        self.__change(indices,
+                      np.concatenate((atomic_numbers, atomic_numbers[::-1])),
+                      np.concatenate((positions, positions)))
+        self._atomic_numbers[indices] = atomic_numbers[::-1]
+
+    def substitute(self, indices, atomic_numbers):
+        """Substitutes the atoms with other species
+
+        :param indices: indices of the atoms to substitute
+        :type indices: int or list of int
+        :param atomic_numbers: new atomic numbers of the atoms
+        :type atomic_numbers: int or list of int
+        """
+        indices = np.atleast_1d(indices)
+        atomic_numbers = np.broadcast_to(atomic_numbers, indices.shape)
+        positions = self._positions[indices]
+        self.__change(indices,
+                      np.concatenate((self._atomic_numbers[indices], atomic_numbers)),
+                      np.concatenate((positions, positions)))
+        self._atomic_numbers[indices] = atomic_numbers
+
+    def accept(self):
+        """Accepts all pending changes"""
+        self._undo = []
+        self._pending = None
+
+    def reject(self):
+        """Rejects all pending changes, restoring the amplitude, positions
+        and atomic numbers"""
+        for indices, atomic_numbers, positions in reversed(self._undo):
+            self._atomic_numbers[indices] = atomic_numbers
+            self._positions[indices] = positions
+        if self._pending is not None:
+            self._amplitude -= self._pending
+        self.accept()
+
+    def __change(self, indices, atomic_numbers, positions):
+        """Removes the first half of the atoms given and adds the second
+        half to the amplitude"""
+        self._undo.append((indices,
+                           self._atomic_numbers[indices].copy(),
+                           self._positions[indices].copy()))
+        weights = np.repeat([-1.0, 1.0], len(atomic_numbers)//2)
+        delta = np.zeros(self._amplitude.shape, dtype=np.complex128)
+        for atomic_number in np.unique(atomic_numbers):
+            try:
+                ff = self._fourier._get_ff(atomic_number)
+            except KeyError:  # skipped by _calculate as well
+                continue
+            index = np.where(atomic_numbers == atomic_number)
+            delta += ff * self._fourier._sum_phases(positions[index], self._fast,
+                                                    weights[index]).reshape(delta.shape)
+        self._amplitude += delta
+        if self._pending is None:
+            self._pending = delta
+        else:
+            self._pending += delta
+
+
+_lots_process = {}
+
+
+def _init_lots_process(fourier, shared, aver):
+    """Initializer of the lots process pool, the shared arrays are
+    wrapped as numpy arrays without copying"""
+    _lots_process['fourier'] = fourier
+    _lots_process['shared'] = shared  # keeps the shared memory attached
+    _lots_process['table'] = dict((name, get_shared_array(*array))
+                                  for name, array in shared.items())
+    _lots_process['aver'] = aver
+
+
+def _calculate_lot_in_process(args):
+    origin, mag, fast = args
+    return _lots_process['fourier']._calculate_lot(_lots_process['table'], origin, mag, fast,
+                                                   _lots_process['aver'])
+
+
+def share_array(array):
+    """Copies a numpy array into shared memory that can be passed to
+    :class:`multiprocessing.Pool` processes, see :func:`get_shared_array`.
+
+    The memory is a :class:`multiprocessing.shared_memory.SharedMemory`
+    block, or a :class:`multiprocessing.sharedctypes.RawArray` before
+    Python 3.8, and has to be released with :func:`free_shared_array`.
+
+    :param array: array to share
+    :type array: :class:`numpy.ndarray`
+    :return: shared memory, dtype and shape of the array
+    :rtype: tuple
+    """
+    array = np.ascontiguousarray(array)
+    try:
+        from multiprocessing.shared_memory import SharedMemory
+    except ImportError:  # Python < 3.8
+        from multiprocessing.sharedctypes import RawArray
+        shared = RawArray('b', max(array.nbytes, 1))
+        buffer = shared
+    else:
+        shared = SharedMemory(create=True, size=max(array.nbytes, 1))
+        buffer = shared.buf
+    view = np.frombuffer(buffer, dtype=np.int8, count=array.nbytes)
+    view[:] = array.view(np.int8).ravel()
+    del view  # the shared memory cannot be closed while viewed
+    return shared, array.dtype.str, array.shape
+
+
+def get_shared_array(shared, dtype, shape):
+    """Returns a numpy array viewing the shared memory from
+    :func:`share_array`"""
+    count = int(np.prod(shape))
+    buffer = shared.buf if hasattr(shared, 'buf') else shared
+    return np.frombuffer(buffer, dtype=dtype, count=count).reshape(shape)
+
+
+def free_shared_array(shared, dtype=None, shape=None):
+    """Releases the shared memory from :func:`share_array` once no
+    array views it"""
+    if hasattr(shared, 'unlink'):
+        shared.close()
+        shared.unlink()
+
+
+def _expand_range(start, stop, n):
+    """Returns the range start to stop expanded to at least 2 within 0
+    to n"""
+    if stop - start < 2:
+        if stop < n:
+            stop += 1
+        else:
+            start -= 1
+    return start, stop
 
 
 def create_xarray_dataarray(values, grid):
@@ -336,12 +1228,35 @@ def create_xarray_dataarray(values, grid):
     :param values: Input array containing the scattering intensities
     :type values: :class:`numpy.ndarray`
     :param numbers: Grid object describing the array properties
-    :type numbers: :class:`javelin.grid.Grid`
+    :type numbers: :class:`javelin.grid.Grid`, :class:`javelin.grid.PointGrid`
+       or :class:`javelin.grid.SliceGrid`
     :return: DataArray produced from the values and grid object
     :rtype: :class:`xarray.DataArray`
     """
     import xarray as xr
-    if grid.twoD:
+    if isinstance(grid, SliceGrid):
+        offsets = grid.grid.ll + grid.offsets
+        return xr.DataArray(data=values,
+                            name="Intensity",
+                            dims=("Q1", "Q2", "slice"),
+                            coords={"Q1": grid.grid.r1,
+                                    "Q2": grid.grid.r2,
+                                    "slice": np.arange(len(offsets)),
+                                    "h": ("slice", offsets[:, 0]),
+                                    "k": ("slice", offsets[:, 1]),
+                                    "l": ("slice", offsets[:, 2])},
+                            attrs=(("units", grid.units),))
+    elif isinstance(grid, PointGrid):
+        points = grid.points
+        return xr.DataArray(data=values,
+                            name="Intensity",
+                            dims=("point",),
+                            coords={"point": np.arange(len(points)),
+                                    "h": ("point", points[:, 0]),
+                                    "k": ("point", points[:, 1]),
+                                    "l": ("point", points[:, 2])},
+                            attrs=(("units", grid.units),))
+    elif grid.twoD:
         return xr.DataArray(data=values,
                             name="Intensity",
                             dims=("Q1", "Q2"),
@@ -355,6 +1270,451 @@ def create_xarray_dataarray(values, grid):
                             attrs=(("units", grid.units),))
 
 
+def get_bins(grid):
+    """Returns the number of bins along all three axes of the grid, the
+    missing axes being 1 for 2D grids and point grids.
+
+    :param grid: Grid object
+    :type grid: :class:`javelin.grid.Grid`
+    :return: number of bins along each axis
+    :rtype: tuple of 3 int
+    """
+    bins = tuple(grid.bins)
+    return bins + (1,)*(3 - len(bins))
+
+
+def get_phase_factors(positions, grid, dtype=np.complex128):
+    """Returns the phase factors of each position along each axis of the
+    grid.
+
+    Every grid point is ``ll + i*dx + j*dy + k*dz`` so the phase factor
+    exp(2*pi*i*Q.r) factorises into exp(2*pi*i*ll.r) *
+    exp(2*pi*i*dx.r)**i * exp(2*pi*i*dy.r)**j * exp(2*pi*i*dz.r)**k. The powers along each axis are
+    generated by recurrence, so only four exponentials are needed per
+    position for any grid, aligned with the reciprocal axes or not. The
+    phase factor at the grid point (i, j, k) is then ``p1[:, i] *
+    p2[:, j] * p3[:, k]``, the ll phase is included in p1.
+
+    :param positions: fractional positions of the atoms
+    :type positions: :class:`numpy.ndarray` (N, 3)
+    :param grid: Grid object
+    :type grid: :class:`javelin.grid.Grid`
+    :param dtype: dtype of the returned factors, they are always
+       calculated in double precision
+    :type dtype: :class:`numpy.complex128` or :class:`numpy.complex64`
+    :return: phase factors along each axis of the grid
+    :rtype: tuple of :class:`numpy.ndarray` (N, n1), (N, n2), (N, n3)
+
+    >>> grid = Grid(lr=[2, 2, 0], ul=[-1, 1, 0], bins=(3, 2))
+    >>> p1, p2, p3 = get_phase_factors([[0.25, 0, 0]], grid)
+    >>> np.round(p1, 6)
+    array([[ 1.+0.j,  0.+1.j, -1.+0.j]])
+    >>> np.round(p2, 6)
+    array([[ 1.+0.j,  0.-1.j]])
+    >>> p3
+    array([[ 1.+0.j]])
+    """
+    ll, dx, dy, dz = grid.get_q_vectors()
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    factors = []
+    for n, vector, start in zip(get_bins(grid), (dx, dy, dz), (ll, None, None)):
+        factor = np.empty((len(positions), n), dtype=np.complex128)
+        factor[:, 0] = 1 if start is None else np.exp(2j*np.pi*np.dot(positions, start))
+        factor[:, 1:] = np.exp(2j*np.pi*np.dot(positions, vector))[:, None]
+        factors.append(np.cumprod(factor, axis=1, out=factor).astype(dtype, copy=False))
+    return tuple(factors)
+
+
+def get_block_size(bytes_per_atom, max_memory):
+    """Returns the number of atoms that can be processed at once without
+    the temporary arrays exceeding max_memory bytes, at least 1."""
+    return max(1, int(max_memory // bytes_per_atom))
+
+
+def sum_blocks(function, number, block, workers=1, deterministic=False):
+    """Returns the sum of ``function(slice)`` over consecutive slices of
+    block items out of number.
+
+    With more than one worker the slices are processed in a thread
+    pool, numpy releases the GIL in the heavy operations so the blocks
+    run concurrently. If deterministic the partial sums are reduced in
+    slice order, which makes the result identical for any number of
+    workers, otherwise they are reduced as they finish.
+
+    :return: sum of the partial results or None if there are no items
+    """
+    slices = [slice(start, start+block) for start in range(0, number, block)]
+    if workers > 1 and len(slices) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(slices)))
+        try:
+            partials = (pool.imap if deterministic else pool.imap_unordered)(function, slices)
+            return _reduce(partials)
+        finally:
+            pool.terminate()
+    else:
+        return _reduce(function(s) for s in slices)
+
+
+def _reduce(partials):
+    """Sums the partial results, accumulating in double precision"""
+    total = None
+    for partial in partials:
+        if total is None:
+            total = partial.astype(np.promote_types(partial.dtype, np.complex128))
+        else:
+            total += partial
+    return total
+
+
+def sum_phase_factors(positions, grid, weights=None, max_memory=2**27,
+                      workers=1, deterministic=False, dtype=np.complex128):
+    """Returns the sum of the phase factors exp(2*pi*i*Q.r) of all
+    positions over the grid, optionally weighted.
+
+    Atoms are processed in blocks, for each block the phase factors
+    along the grid axes from :func:`get_phase_factors` are combined with
+    a single matrix product ``(n1, N) x (N, n2*n3)``. The block size is
+    limited so that the temporary arrays do not exceed max_memory
+    bytes, each worker holds one block at a time (see
+    :func:`sum_blocks`). With dtype complex64 the blocks are calculated
+    in single precision and summed in double precision.
+
+    :param positions: fractional positions of the atoms
+    :type positions: :class:`numpy.ndarray` (N, 3)
+    :param grid: Grid object
+    :type grid: :class:`javelin.grid.Grid`
+    :param weights: weights of each atom, (N, m) weights give m sums
+    :type weights: :class:`numpy.ndarray` (N,) or (N, m)
+    :param max_memory: maximum memory in bytes for the temporary arrays
+    :type max_memory: int
+    :param workers: number of threads
+    :type workers: int
+    :param deterministic: reduce the blocks in a fixed order
+    :type deterministic: bool
+    :param dtype: precision of the calculation of each block
+    :type dtype: :class:`numpy.complex128` or :class:`numpy.complex64`
+    :return: sum of phase factors
+    :rtype: :class:`numpy.ndarray` (n1, n2, n3) or (m, n1, n2, n3)
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    return _sum_factorised(lambda block: get_phase_factors(positions[block], grid, dtype),
+                           len(positions), grid, weights, max_memory, workers,
+                           deterministic, dtype)
+
+
+def get_lattice_phase_factors(first, number, grid):
+    """Returns the phase factors of the integer cell indices along each
+    axis of the grid.
+
+    For cell indices c the phase factor along a grid axis is
+    exp(2*pi*i*(start + t*step).c), it is generated by recurrence over
+    both the cell indices and the grid steps t so only a few
+    exponentials are needed for any number of cells. The phase factor
+    of the cell (i, j, k) along a grid axis is then ``l[0][i-first[0]] *
+    l[1][j-first[1]] * l[2][k-first[2]]``, the ll phase is included
+    along the first axis as in :func:`get_phase_factors`.
+
+    :param first: first cell index along each crystal axis
+    :type first: list of 3 int
+    :param number: number of cell indices along each crystal axis
+    :type number: list of 3 int
+    :param grid: Grid object
+    :type grid: :class:`javelin.grid.Grid`
+    :return: for each grid axis the factors along each crystal axis
+    :rtype: tuple of 3 tuples of :class:`numpy.ndarray` (number[n], bins)
+    """
+    ll, dx, dy, dz = grid.get_q_vectors()
+    factors = []
+    for n, vector, start in zip(get_bins(grid), (dx, dy, dz), (ll, np.zeros(3), np.zeros(3))):
+        axes = []
+        for d in range(3):
+            factor = np.empty((number[d], n), dtype=np.complex128)
+            factor[:, 0] = _get_powers(start[d], first[d], number[d])
+            factor[:, 1:] = _get_powers(vector[d], first[d], number[d])[:, None]
+            axes.append(np.cumprod(factor, axis=1, out=factor))
+        factors.append(tuple(axes))
+    return tuple(factors)
+
+
+def get_lattice_sum(first, number, grid, fast=True):
+    """Returns the sum of the phase factors exp(2*pi*i*Q.R) of the
+    block of integer cells R from first to first+number-1 along each
+    crystal axis over the grid.
+
+    The sum factorises over the crystal axes and each factor is the
+    Dirichlet kernel ``exp(pi*i*q*(2*first+number-1)) *
+    sin(pi*q*number)/sin(pi*q)``, which is number at integer q, so no
+    cells need to be summed over.
+
+    :param first: first cell index along each crystal axis
+    :type first: list of 3 int
+    :param number: number of cells along each crystal axis
+    :type number: list of 3 int
+    :param grid: Grid object
+    :type grid: :class:`javelin.grid.Grid`
+    :param fast: only calculate along the grid axes each component
+       changes, see :meth:`javelin.grid.Grid.get_squashed_q_meshgrid`
+    :type fast: bool
+    :return: the lattice sum, read-only
+    :rtype: :class:`numpy.ndarray` of the shape of the grid
+    """
+    total = 1
+    meshgrid = grid.get_squashed_q_meshgrid() if fast else grid.get_q_meshgrid()
+    for q, start, n in zip(meshgrid, first, number):
+        integer = np.round(q)
+        peak = np.isclose(q, integer, rtol=0, atol=1e-10)
+        kernel = np.sin(np.pi*q*n) / np.where(peak, 1, np.sin(np.pi*q))
+        kernel = np.where(peak, n*np.cos(np.pi*integer*(n-1)), kernel)
+        total = total * kernel * np.exp(1j*np.pi*q*(2*start + n - 1))
+    return np.broadcast_to(total, grid.bins)
+
+
+def _get_powers(value, first, number):
+    """Returns exp(2*pi*i*value*c) for c from first to first+number-1
+    by recurrence"""
+    powers = np.empty(number, dtype=np.complex128)
+    powers[0] = np.exp(2j*np.pi*value*first)
+    powers[1:] = np.exp(2j*np.pi*value)
+    return np.cumprod(powers, out=powers)
+
+
+def sum_cell_phase_factors(cells, positions, grid, weights=None, max_memory=2**27,
+                           workers=1, deterministic=False, dtype=np.complex128):
+    """Returns the sum of the phase factors exp(2*pi*i*Q.(R+r)) of all
+    atoms at positions r within the integer cells R over the grid,
+    optionally weighted.
+
+    The phase factor factorises into exp(2*pi*i*Q.R)*exp(2*pi*i*Q.r) so
+    for each distinct position r the weights are placed on the (i, j,
+    k) box of cells and the lattice sum is contracted one crystal axis
+    at a time with the factors of :func:`get_lattice_phase_factors`.
+    When a crystal axis only changes along one grid axis, as for grids
+    along the reciprocal axes, this is much cheaper than summing every
+    atom. Otherwise, or when most positions are distinct, the atoms at
+    R+r are summed with :func:`sum_phase_factors`, the other parameters
+    and the returned array are the same.
+
+    :param cells: integer cells of the atoms
+    :type cells: :class:`numpy.ndarray` (N, 3)
+    :param positions: fractional positions of the atoms within the cells
+    :type positions: :class:`numpy.ndarray` (N, 3)
+    """
+    cells = np.asarray(cells, dtype=np.int64).reshape((-1, 3))
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    weights = np.ones(len(cells)) if weights is None else np.asarray(weights)
+    shape = weights.shape[1:]
+    m = int(np.prod(shape))
+    weights = weights.reshape((len(cells), m))
+    plan = _get_cell_plan(cells, positions, grid, m, max_memory)
+    if plan is None:
+        return sum_phase_factors(cells + positions, grid, weights.reshape((-1,) + shape),
+                                 max_memory, workers, deterministic, dtype)
+    unique, inverse, first, number, order = plan
+    lattice = get_lattice_phase_factors(first, number, grid)
+    bins = get_bins(grid)
+    index = np.ravel_multi_index(tuple((cells - first).T), number)
+
+    def calculate_site(site):
+        site = site.start
+        atoms = inverse == site
+        box = np.array([np.bincount(index[atoms], w, int(np.prod(number)))
+                        for w in weights[atoms].T])
+        total = _contract_cells(box.reshape((-1,) + tuple(number)), lattice, grid, order)
+        p1, p2, p3 = get_phase_factors(unique[site:site+1], grid)
+        return total * (p1[0][:, None, None] * p2[0][None, :, None] * p3[0][None, None, :])
+
+    results = sum_blocks(calculate_site, len(unique), 1, workers, deterministic)
+    return results.reshape(shape + bins)
+
+
+def _get_cell_axes(grid):
+    """Returns for each crystal axis the grid axes along which its
+    component of Q changes"""
+    bins = get_bins(grid)
+    vectors = grid.get_q_vectors()[1:]
+    return [tuple(g for g in range(3) if bins[g] > 1 and vectors[g][d] != 0)
+            for d in range(3)]
+
+
+def _get_cell_plan(cells, positions, grid, m, max_memory):
+    """Returns the distinct positions, the index of each atom into them,
+    the box of cells and the cheapest order to contract the crystal
+    axes for :func:`sum_cell_phase_factors`, or None if summing the
+    atoms is cheaper or the contraction needs more than max_memory"""
+    if len(cells) == 0:
+        return None
+    unique, inverse = np.unique(positions, axis=0, return_inverse=True)
+    first = cells.min(axis=0)
+    number = cells.max(axis=0) - first + 1
+    bins = get_bins(grid)
+    axes = _get_cell_axes(grid)
+    best = None
+    for order in permutations(range(3)):
+        present, remaining = set(), list(number)
+        cost, size = 0, np.prod(number)
+        for d in order:
+            present.update(axes[d])
+            cost += np.prod(remaining) * np.prod([bins[g] for g in present])
+            remaining[d] = 1
+            size = max(size, np.prod(remaining) * np.prod([bins[g] for g in present]))
+        if best is None or cost < best[0]:
+            best = (cost, size, order)
+    cost, size, order = best
+    points = np.prod(bins)
+    if (len(unique) * (cost + points) >= len(cells) * points or
+            16 * m * size > max(max_memory, 16 * m * points)):
+        return None
+    return unique, inverse.ravel(), first, number, order
+
+
+def _contract_cells(box, lattice, grid, order):
+    """Returns the lattice sum of the weights on the box of cells (m,
+    i, j, k) over the grid as (m, n1, n2, n3), contracting the crystal
+    axes in order"""
+    letters = 'ijk'
+    axes = _get_cell_axes(grid)
+    subscripts = 'm' + letters
+    for d in order:
+        factor = lattice[0][d][:, 0] if 0 not in axes[d] else np.ones(len(lattice[0][d]))
+        for g in axes[d]:
+            factor = factor[..., None] * lattice[g][d].reshape(
+                (len(factor),) + (1,)*(factor.ndim - 1) + (-1,))
+        grid_letters = ''.join('abc'[g] for g in axes[d])
+        output = subscripts.replace(letters[d], '')
+        output += ''.join(g for g in grid_letters if g not in output)
+        box = np.einsum(subscripts + ',' + letters[d] + grid_letters + '->' + output,
+                        box, factor, optimize=True)
+        subscripts = output
+    present = sorted(subscripts[1:])
+    box = np.transpose(box, [0] + [subscripts.index(g) for g in present])
+    bins = get_bins(grid)
+    return box.reshape((len(box),) + tuple(bins[g] if 'abc'[g] in present else 1
+                                           for g in range(3)))
+
+
+def sum_slice_phase_factors(positions, grid, weights=None, max_memory=2**27,
+                            workers=1, deterministic=False, dtype=np.complex128):
+    """Returns the sum of the phase factors exp(2*pi*i*Q.r) of all
+    positions over a stack of parallel slices, optionally weighted.
+
+    The phase factors within the plane come from
+    :func:`get_phase_factors` of the 2D grid and are shared by all the
+    slices, the third factor is exp(2*pi*i*offset.r) of each slice
+    offset. The blocks are then summed as in :func:`sum_phase_factors`,
+    the other parameters and the returned array are the same.
+
+    :param grid: SliceGrid object
+    :type grid: :class:`javelin.grid.SliceGrid`
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    offsets = grid.offsets
+
+    def get_block_factors(block):
+        p1, p2, _ = get_phase_factors(positions[block], grid.grid, dtype)
+        p3 = np.exp(2j*np.pi*np.dot(positions[block], offsets.T)).astype(dtype, copy=False)
+        return p1, p2, p3
+
+    return _sum_factorised(get_block_factors, len(positions), grid, weights,
+                           max_memory, workers, deterministic, dtype)
+
+
+def _sum_factorised(get_block_factors, number, grid, weights, max_memory,
+                    workers, deterministic, dtype):
+    """Sums the phase factors along the grid axes returned by
+    get_block_factors(slice) over blocks of the number atoms, see
+    :func:`sum_phase_factors`"""
+    weights = np.ones(number) if weights is None else np.asarray(weights)
+    shape = weights.shape[1:]
+    m = int(np.prod(shape))
+    weights = weights.reshape((number, m))
+    n1, n2, n3 = get_bins(grid)
+    itemsize = np.dtype(dtype).itemsize
+
+    def calculate_block(block):
+        p1, p2, p3 = get_block_factors(block)
+        p23 = (p2[:, :, None] * p3[:, None, :]).reshape((len(p1), n2*n3))
+        p1 = (weights[block, :, None].astype(dtype) *
+              p1[:, None, :]).reshape((len(p1), m*n1))
+        return np.dot(p1.T, p23)
+
+    results = sum_blocks(calculate_block, number,
+                         get_block_size(itemsize*(n1 + n2 + n3 + n2*n3 + m*n1), max_memory),
+                         workers, deterministic)
+    if results is None:
+        return np.zeros(shape + (n1, n2, n3), dtype=np.complex128)
+    return results.reshape(shape + (n1, n2, n3))
+
+
+def sum_phases(positions, grid, weights=None, max_memory=2**27,
+               workers=1, deterministic=False, dtype=np.complex128):
+    """Returns the sum of the phase factors exp(2*pi*i*Q.r) of all
+    positions over the grid, optionally weighted, calculating the
+    exponential directly at every grid point.
+
+    This is the reference for :func:`sum_phase_factors`, the parameters
+    and the returned array are the same.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    q = np.array([np.ravel(qi) for qi in grid.get_q_meshgrid()]).T * (2*np.pi)
+    weights = np.ones(len(positions)) if weights is None else np.asarray(weights)
+    shape = weights.shape[1:]
+    weights = weights.reshape((len(positions), -1)).astype(dtype)
+    real = np.float32 if dtype == np.complex64 else np.float64
+
+    def calculate_block(block):
+        dot = np.dot(q, positions[block].T)
+        if real == np.float32:  # reduce the phase before losing precision
+            dot = np.remainder(dot, 2*np.pi, out=dot).astype(real)
+        return np.dot(np.exp(1j*dot).astype(dtype, copy=False), weights[block])
+
+    results = sum_blocks(calculate_block, len(positions),
+                         get_block_size(np.dtype(dtype).itemsize*len(q), max_memory),
+                         workers, deterministic)
+    if results is None:
+        return np.zeros(shape + get_bins(grid), dtype=np.complex128)
+    return results.T.reshape(shape + get_bins(grid))
+
+
+def get_perpendicular_intensity(spin, grid, fast=True):
+    """Returns the intensity of the component of spin perpendicular to
+    Q, :math:`|M - (M.Q/|Q|^2) Q|^2`, with M and Q both in the
+    components of the grid. The spin is overwritten by its
+    perpendicular component so only one more grid sized array is used.
+    The intensity is NaN at Q = 0, where it is undefined, also where Q
+    only differs from 0 by rounding as in the slabs of a grid.
+
+    :param spin: the three spin components over the grid
+    :type spin: :class:`numpy.ndarray` (3, bins)
+    :param grid: Grid object
+    :type grid: :class:`javelin.grid.Grid`
+    :param fast: use the squashed Q components
+    :type fast: bool
+    :return: the intensity
+    :rtype: :class:`numpy.ndarray` of the shape of the grid
+    """
+    if fast:
+        q = grid.get_squashed_q_meshgrid()
+    else:
+        q = grid.get_q_meshgrid()
+    zero = (np.abs(q[0]) < 1e-10) & (np.abs(q[1]) < 1e-10) & (np.abs(q[2]) < 1e-10)
+    q = [qn * (2*np.pi) for qn in q]
+    # Caluculate vector rejection of spin onto q
+    # M - M.Q/|Q|^2 Q
+    scale = spin[0] * q[0]
+    scale += spin[1] * q[1]
+    scale += spin[2] * q[2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale /= q[0]**2 + q[1]**2 + q[2]**2
+    for n in range(3):
+        spin[n] -= scale * q[n]
+    del scale
+    intensity = (np.einsum('i...,i...->...', spin.real, spin.real) +
+                 np.einsum('i...,i...->...', spin.imag, spin.imag))
+    intensity[np.broadcast_to(zero, intensity.shape)] = np.nan
+    return intensity
+
+
 def get_ff(atomic_number, radiation, q=None):
     """Returns the form factor for a given atomic number, radiation and q
     values
@@ -389,9 +1749,10 @@ def get_ff(atomic_number, radiation, q=None):
         raise ValueError("Unknown radition: " + radiation)
 
 
-def get_mag_ff(atomic_number, q, ion=0):
+def get_mag_ff(atomic_number, q, ion=0, g=None):
     """Returns the j0 magnetic form factor for a given atomic number,
-    radiation and q values
+    radiation and q values, or with a g-factor the dipole approximation
+    ``<j0> + (2/g - 1)<j2>``
 
     :param atomic_number: atomic number
     :type atomic_number: int
@@ -399,6 +1760,8 @@ def get_mag_ff(atomic_number, q, ion=0):
     :type q: float, list, :class:`numpy.ndarray`
     :param ion: charge of selected atom
     :type ion: int
+    :param g: Landé g-factor, None for j0 only
+    :type g: float
     :return: magnetic form factor for given q
     :rtype: float, :class:`numpy.ndarray`
 
@@ -414,4 +1777,7 @@ def get_mag_ff(atomic_number, q, ion=0):
     array([ 0.9997    ,  0.58273549,  0.13948496])
     """
     import periodictable
-    return periodictable.elements[atomic_number].magnetic_ff[ion].j0_Q(q)
+    ff = periodictable.elements[atomic_number].magnetic_ff[ion]
+    if g is None:
+        return ff.j0_Q(q)
+    return ff.j0_Q(q) + (2./g - 1) * ff.j2_Q(q)
@@ -33,6 +33,12 @@ class Grid(object):
         self._unitcell = None
         self.units = 'r.l.u'
 
+    def __getstate__(self):
+        """The memoised meshes are not copied or pickled"""
+        state = self.__dict__.copy()
+        state['_memo'] = {}
+        return state
+
     @property
     def bins(self):
         if self._2D:
@@ -151,6 +157,7 @@ class Grid(object):
 
     def __vertices_to_vectors(self):
         self.__validate_vectors()
+        self._memo = {}  # Invalidate memoised meshes
         self._origin = self._vertices['ll']
         self._v1 = norm(self._vertices['lr']-self._vertices['ll'])
         self._v2 = norm(self._vertices['ul']-self._vertices['ll'])
@@ -173,61 +180,313 @@ class Grid(object):
                 str(self._origin) + str(' + y') + str(self.v2),
                 str(self._origin) + str(' + z') + str(self.v3))
 
+    def get_q_vectors(self):
+        """Returns the origin and the step vectors between neighbouring
+        grid points, every grid point is then ``ll + i*dx + j*dy + k*dz``.
+
+        :return: ll, dx, dy and dz, dz is zero for 2D grids
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        return self.__memoise('vectors', self.__calculate_q_vectors)
+
     def get_q_meshgrid(self):
-        self.__validate_vectors()
-        dx = (self.lr - self.ll)/(self._n1-1)
-        dy = (self.ul - self.ll)/(self._n2-1)
-        x = np.arange(self._n1).reshape((self._n1, 1))
-        y = np.arange(self._n2).reshape((1, self._n2))
-        if self._2D:
-            qx = self.ll[0] + x*dx[0] + y*dy[0]
-            qy = self.ll[1] + x*dx[1] + y*dy[1]
-            qz = self.ll[2] + x*dx[2] + y*dy[2]
-        else:  # assume _dims == 3
-            x.shape = (self._n1, 1, 1)
-            y.shape = (1, self._n2, 1)
-            z = np.arange(self._n3).reshape((1, 1, self._n3))
-            dz = (self.tl - self.ll)/(self._n3-1)
-            qx = self.ll[0] + x*dx[0] + y*dy[0] + z*dz[0]
-            qy = self.ll[1] + x*dx[1] + y*dy[1] + z*dz[1]
-            qz = self.ll[2] + x*dx[2] + y*dy[2] + z*dz[2]
-        return qx, qy, qz
+        """Returns the qx, qy and qz components of every grid point.
+
+        The arrays are read-only and have the shape of the grid, but any
+        component that is constant along an axis is a broadcast view of
+        :meth:`get_squashed_q_meshgrid`, so for grids aligned with the
+        reciprocal axes each component only takes the memory of one
+        axis.
+
+        :return: qx, qy and qz
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        return self.__memoise('meshgrid',
+                              lambda: tuple(np.broadcast_to(q, self.bins)
+                                            for q in self.get_squashed_q_meshgrid()))
 
     def get_squashed_q_meshgrid(self):
+        """Returns the qx, qy and qz components of every grid point,
+        squashed to length 1 along the axes the component is constant,
+        ready for broadcasting. The arrays are read-only.
+
+        :return: qx, qy and qz
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        return self.__memoise('squashed', self.__calculate_squashed_q_meshgrid)
+
+    def get_slab(self, start, stop):
+        """Returns a new grid of the points start to stop-1 along the
+        first axis, with the same points as this grid.
+
+        :param start: first index along the first axis
+        :type start: int
+        :param stop: one past the last index along the first axis
+        :type stop: int
+        :return: Grid of the slab
+        :rtype: :class:`javelin.grid.Grid`
+        """
+        return self.get_subgrid((start,) + (0,)*(len(self.bins)-1),
+                                (stop,) + tuple(self.bins[1:]))
+
+    def get_subgrid(self, start, stop):
+        """Returns a new grid of the points start to stop-1 along each
+        axis, with the same points as this grid.
+
+        :param start: first index along each axis
+        :type start: list of int
+        :param stop: one past the last index along each axis
+        :type stop: list of int
+        :return: Grid of the points
+        :rtype: :class:`javelin.grid.Grid`
+        """
+        bins = self.bins
+        if (len(start) != len(bins) or len(stop) != len(bins) or
+                not all(0 <= a < b - 1 < n for a, b, n in zip(start, stop, bins))):
+            raise ValueError("Subgrid must contain at least 2 points along each axis "
+                             "within the grid")
+        ll, dx, dy, dz = self.get_q_vectors()
+        steps = (dx, dy, dz)[:len(bins)]
+        origin = ll + sum(a*step for a, step in zip(start, steps))
+        vertices = [origin + (b-a-1)*step for a, b, step in zip(start, stop, steps)]
+        subgrid = Grid(ll=origin,
+                       lr=vertices[0],
+                       ul=vertices[1],
+                       tl=vertices[2] if len(bins) == 3 else self.tl + origin - ll,
+                       bins=tuple(b-a for a, b in zip(start, stop)))
+        subgrid.units = self.units
+        return subgrid
+
+    def __memoise(self, name, function):
+        """Returns the result of function, calculating it only the first
+        time until a vertex or the bins change, also when changed in
+        place"""
+        key = (tuple(self.bins),) + tuple(tuple(self._vertices[vertex])
+                                          for vertex in ('ll', 'lr', 'ul', 'tl'))
+        if self._memo.get('key') != key:
+            self._memo = {'key': key}
+        if name not in self._memo:
+            value = function()
+            for array in value:
+                array.flags.writeable = False
+            self._memo[name] = value
+        return self._memo[name]
+
+    def __calculate_q_vectors(self):
         self.__validate_vectors()
         dx = (self.lr - self.ll)/(self._n1-1)
         dy = (self.ul - self.ll)/(self._n2-1)
-        qx_bins = get_bin_number(self.v1, self.v2, self.v3, self.bins, 0)
-        qy_bins = get_bin_number(self.v1, self.v2, self.v3, self.bins, 1)
-        qz_bins = get_bin_number(self.v1, self.v2, self.v3, self.bins, 2)
-        qx = np.zeros(qx_bins)
-        qy = np.zeros(qy_bins)
-        qz = np.zeros(qz_bins)
-        if self._2D:
-            x = np.arange(qx_bins[0]).reshape((qx_bins[0], 1))
-            y = np.arange(qx_bins[1]).reshape((1, qx_bins[1]))
-            qx = self.ll[0] + x*dx[0] + y*dy[0]
-            x = np.arange(qy_bins[0]).reshape((qy_bins[0], 1))
-            y = np.arange(qy_bins[1]).reshape((1, qy_bins[1]))
-            qy = self.ll[1] + x*dx[1] + y*dy[1]
-            x = np.arange(qz_bins[0]).reshape((qz_bins[0], 1))
-            y = np.arange(qz_bins[1]).reshape((1, qz_bins[1]))
-            qz = self.ll[2] + x*dx[2] + y*dy[2]
-        else:
-            dz = (self.tl - self.ll)/(self._n3-1)
-            x = np.arange(qx_bins[0]).reshape((qx_bins[0], 1, 1))
-            y = np.arange(qx_bins[1]).reshape((1, qx_bins[1], 1))
-            z = np.arange(qx_bins[2]).reshape((1, 1, qx_bins[2]))
-            qx = self.ll[0] + x*dx[0] + y*dy[0] + z*dz[0]
-            x = np.arange(qy_bins[0]).reshape((qy_bins[0], 1, 1))
-            y = np.arange(qy_bins[1]).reshape((1, qy_bins[1], 1))
-            z = np.arange(qy_bins[2]).reshape((1, 1, qy_bins[2]))
-            qy = self.ll[1] + x*dx[1] + y*dy[1] + z*dz[1]
-            x = np.arange(qz_bins[0]).reshape((qz_bins[0], 1, 1))
-            y = np.arange(qz_bins[1]).reshape((1, qz_bins[1], 1))
-            z = np.arange(qz_bins[2]).reshape((1, 1, qz_bins[2]))
-            qz = self.ll[2] + x*dx[2] + y*dy[2] + z*dz[2]
-        return qx, qy, qz
+        dz = np.zeros(3) if self._2D else (self.tl - self.ll)/(self._n3-1)
+        return np.array(self.ll), dx, dy, dz
+
+    def __calculate_squashed_q_meshgrid(self):
+        ll, dx, dy, dz = self.get_q_vectors()
+        bins = (self._n1, self._n2) if self._2D else (self._n1, self._n2, self._n3)
+        q = []
+        for n in range(3):
+            qn = np.full((1,)*len(bins), ll[n], dtype=np.float64)
+            for axis, step in enumerate((dx, dy, dz)[:len(bins)]):
+                if step[n] != 0:  # Only expand axes the component changes along
+                    shape = [1]*len(bins)
+                    shape[axis] = bins[axis]
+                    qn = qn + np.arange(bins[axis]).reshape(shape)*step[n]
+            q.append(qn)
+        return tuple(q)
+
+
+class PointGrid(object):
+    """A list of arbitrary Q points, such as a powder line, detector
+    pixels or superlattice positions, to use in place of a
+    :class:`Grid` when only those points are needed.
+
+    :param points: hkl of each point
+    :type points: :class:`numpy.ndarray` (N, 3)
+    """
+    def __init__(self, points=((0.0, 0.0, 0.0),)):
+        self.points = points
+        self.units = 'r.l.u'
+
+    @property
+    def points(self):
+        """The points
+
+        :getter: Returns the points, read-only
+        :setter: Sets the points
+        :type: :class:`numpy.ndarray` (N, 3)
+        """
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        points = np.array(points, dtype=np.float64)
+        if points.ndim != 2 or points.shape[1] != 3 or len(points) == 0:
+            raise ValueError("Must provide a list of points of length 3")
+        points.flags.writeable = False
+        self._points = points
+
+    @property
+    def bins(self):
+        return (len(self._points),)
+
+    def get_q_meshgrid(self):
+        """Returns the qx, qy and qz components of every point.
+
+        :return: qx, qy and qz
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        return tuple(self._points.T)
+
+    def get_squashed_q_meshgrid(self):
+        """Returns the qx, qy and qz components of every point, the same
+        as :meth:`get_q_meshgrid`.
+
+        :return: qx, qy and qz
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        return self.get_q_meshgrid()
+
+    def get_slab(self, start, stop):
+        """Returns a new point grid of the points start to stop-1.
+
+        :param start: index of the first point
+        :type start: int
+        :param stop: one past the index of the last point
+        :type stop: int
+        :return: PointGrid of the slab
+        :rtype: :class:`javelin.grid.PointGrid`
+        """
+        if not 0 <= start < stop <= len(self._points):
+            raise ValueError("Slab must contain at least 1 point within the grid")
+        slab = PointGrid(self._points[start:stop])
+        slab.units = self.units
+        return slab
+
+
+class SliceGrid(object):
+    """A stack of parallel 2D slices, such as HK0, HK0.5 and HK1, each
+    being the 2D grid moved by an offset. The phase factors within the
+    plane are then shared by all the slices.
+
+    :param grid: the 2D grid of the plane
+    :type grid: :class:`Grid`
+    :param offsets: offset of each slice in r.l.u., either as vectors
+       or as multiples of normal
+    :type offsets: list of float or :class:`numpy.ndarray` (N, 3)
+    :param normal: direction of the offsets given as multiples
+    :type normal: list of 3 float
+    """
+    def __init__(self, grid=None, offsets=(0.0,), normal=(0.0, 0.0, 1.0)):
+        self.grid = Grid() if grid is None else grid
+        self.set_offsets(offsets, normal)
+        self.units = self.grid.units
+
+    @property
+    def grid(self):
+        """The 2D grid of the plane
+
+        :getter: Returns the grid
+        :setter: Sets the grid
+        :type: :class:`Grid`
+        """
+        return self._grid
+
+    @grid.setter
+    def grid(self, grid):
+        if not grid.twoD:
+            raise ValueError("Slices must be 2D grids")
+        self._grid = grid
+
+    @property
+    def offsets(self):
+        """The offset of each slice
+
+        :getter: Returns the offsets, read-only
+        :type: :class:`numpy.ndarray` (N, 3)
+        """
+        return self._offsets
+
+    def set_offsets(self, offsets, normal=(0.0, 0.0, 1.0)):
+        """Sets the offset of each slice
+
+        :param offsets: offsets as vectors or as multiples of normal
+        :type offsets: list of float or :class:`numpy.ndarray` (N, 3)
+        :param normal: direction of the offsets given as multiples
+        :type normal: list of 3 float
+        """
+        offsets = np.array(offsets, dtype=np.float64)
+        if offsets.ndim == 1:
+            offsets = offsets[:, None] * np.asarray(normal, dtype=np.float64)
+        if offsets.ndim != 2 or offsets.shape[1] != 3 or len(offsets) == 0:
+            raise ValueError("Must provide a list of offsets or offset vectors of length 3")
+        offsets.flags.writeable = False
+        self._offsets = offsets
+
+    @property
+    def bins(self):
+        return tuple(self.grid.bins) + (len(self._offsets),)
+
+    @property
+    def twoD(self):
+        return False
+
+    def get_q_meshgrid(self):
+        """Returns the qx, qy and qz components of every point of every
+        slice.
+
+        :return: qx, qy and qz
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        return tuple(np.broadcast_to(q, self.bins) for q in self.get_squashed_q_meshgrid())
+
+    def get_squashed_q_meshgrid(self):
+        """Returns the qx, qy and qz components of every point of every
+        slice, squashed to length 1 along the axes the component is
+        constant, see :meth:`Grid.get_squashed_q_meshgrid`.
+
+        :return: qx, qy and qz
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        q = []
+        for plane, offset in zip(self.grid.get_squashed_q_meshgrid(), self._offsets.T):
+            if (offset == offset[0]).all():
+                offset = offset[:1]
+            qn = plane[:, :, None] + offset
+            qn.flags.writeable = False
+            q.append(qn)
+        return tuple(q)
+
+    def get_slab(self, start, stop):
+        """Returns a new slice grid of the points start to stop-1 along
+        the first axis of every slice.
+
+        :param start: first index along the first axis
+        :type start: int
+        :param stop: one past the last index along the first axis
+        :type stop: int
+        :return: SliceGrid of the slab
+        :rtype: :class:`javelin.grid.SliceGrid`
+        """
+        slab = SliceGrid(self.grid.get_slab(start, stop), self._offsets)
+        slab.units = self.units
+        return slab
+
+
+def get_slice_grid(grids):
+    """Returns the :class:`SliceGrid` of a list of parallel 2D grids
+    with the same bins, each slice being a grid moved by an offset.
+
+    :param grids: the 2D grids
+    :type grids: list of :class:`Grid`
+    :return: SliceGrid of the grids
+    :rtype: :class:`SliceGrid`
+    """
+    first = grids[0]
+    for grid in grids:
+        if not (grid.twoD and tuple(grid.bins) == tuple(first.bins) and
+                np.allclose(grid.lr - grid.ll, first.lr - first.ll) and
+                np.allclose(grid.ul - grid.ll, first.ul - first.ll)):
+            raise ValueError("Slices must be parallel 2D grids with the same bins")
+    return SliceGrid(first, [grid.ll - first.ll for grid in grids])
 
 
 def get_bin_number(vabs, vord, vapp, bins, index):
@@ -0,0 +1,324 @@
+"""
+============
+neighborlist
+============
+
+Cell list to find all the pairs of atoms within a distance of each
+other, in a periodic box of unit cells or around a finite cluster.
+
+The box is divided into bins at least as wide as the largest distance,
+so the neighbours of an atom can only be in its own or the adjacent
+bins and the pairs are found in linear time in the number of atoms.
+The bins can also be blocks of the (i, j, k) unit cells the atoms are
+in, as in :class:`javelin.structure.Structure`.
+"""
+from __future__ import absolute_import
+import numpy as np
+
+
+class NeighborList(object):
+    """Cell list of positions for finding pairs within rmax
+
+    :param positions: fractional positions in units of the unit cell,
+       including the cell index
+    :type positions: :class:`numpy.ndarray` (N, 3)
+    :param unitcell: unit cell of the positions
+    :type unitcell: :class:`javelin.unitcell.UnitCell`
+    :param rmax: largest distance between pairs, in Angstrom
+    :type rmax: float
+    :param ncells: number of unit cells along each axis of the periodic
+       box starting at the origin, or None if not periodic
+    :type ncells: list of 3 int
+    :param cells: the integer unit cell of each position, if given the
+       bins are blocks of whole unit cells
+    :type cells: :class:`numpy.ndarray` (N, 3)
+    """
+    def __init__(self, positions, unitcell, rmax, ncells=None, cells=None):
+        positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+        if rmax <= 0:
+            raise ValueError("rmax must be greater than 0")
+        self._rmax = float(rmax)
+        self._metric = np.asarray(unitcell.G, dtype=np.float64)
+        widths = 1/np.array(unitcell.reciprocalCell[:3])  # between opposite faces
+        if ncells is None:
+            self._box = None
+        else:
+            self._box = np.asarray(ncells, dtype=np.float64)
+            if self._rmax > (self._box*widths).min()/2:
+                raise ValueError("rmax must be at most half the width of the periodic box")
+        if cells is None:
+            bins, shape = self.__get_bins(positions, widths)
+        else:
+            bins, shape = self.__get_cell_bins(positions, np.asarray(cells, dtype=np.int64),
+                                               widths)
+        if self._box is not None:
+            positions = np.remainder(positions, self._box)
+        flat = np.ravel_multi_index(bins.T, shape)
+        self._order = np.argsort(flat, kind='mergesort')
+        self._positions = positions[self._order]
+        self._bins = bins[self._order]
+        self._shape = shape
+        self._counts = np.bincount(flat, minlength=int(np.prod(shape)))
+        self._starts = np.cumsum(self._counts) - self._counts
+
+    def __get_bins(self, positions, widths):
+        """Returns the bin of each position and the number of bins"""
+        if self._box is None:
+            origin = positions.min(axis=0) if len(positions) else np.zeros(3)
+            extent = np.ptp(positions, axis=0) if len(positions) else np.zeros(3)
+            shape = np.maximum(1, np.floor(extent*widths/self._rmax)).astype(np.int64)
+            scaled = (positions - origin) / np.where(extent > 0, extent, 1)
+        else:
+            shape = np.floor(self._box*widths/self._rmax).astype(np.int64)
+            scaled = np.remainder(positions, self._box) / self._box
+        return np.minimum(np.floor(scaled*shape).astype(np.int64), shape - 1), shape
+
+    def __get_cell_bins(self, positions, cells, widths):
+        """Returns the bin of each position as blocks of unit cells wide
+        enough for rmax plus twice the furthest any atom is outside its
+        cell, and the number of bins"""
+        cells = cells.reshape((-1, 3))
+        overhang = np.zeros(3)
+        if len(cells):
+            within = positions - cells
+            overhang = np.maximum(0, np.maximum(-within.min(axis=0), within.max(axis=0) - 1))
+        group = np.maximum(1, np.ceil(self._rmax/widths + 2*overhang)).astype(np.int64)
+        if self._box is None:
+            first = cells.min(axis=0) if len(cells) else np.zeros(3, dtype=np.int64)
+            number = np.ptp(cells, axis=0) + 1 if len(cells) else np.ones(3, dtype=np.int64)
+        else:
+            number = self._box.astype(np.int64)
+            first = np.zeros(3, dtype=np.int64)
+            cells = np.remainder(cells, number)
+        shape = np.maximum(1, number // group)
+        return np.minimum((cells - first) // group, shape - 1), shape
+
+    @property
+    def rmax(self):
+        """The largest distance between pairs
+
+        :getter: Returns rmax
+        :type: float
+        """
+        return self._rmax
+
+    @property
+    def periodic(self):
+        """If the box is periodic
+
+        :getter: Returns if periodic
+        :type: bool
+        """
+        return self._box is not None
+
+    def __len__(self):
+        return len(self._order)
+
+    def __get_offsets(self):
+        """Returns the offsets to the neighbouring bins. In periodic
+        boxes with fewer than 3 bins each neighbour is only included
+        once."""
+        offsets = []
+        for n in self._shape:
+            if self._box is None or n >= 3:
+                offsets.append((-1, 0, 1))
+            else:
+                offsets.append(tuple(range(n)))
+        return np.array(np.meshgrid(*offsets, indexing='ij')).reshape((3, -1)).T
+
+    def get_chunks(self, max_memory=2**27):
+        """Returns chunks of atoms, neighbouring in space, so that the
+        candidate pairs of each chunk take at most about max_memory
+        bytes. The chunks can be processed independently with
+        :meth:`get_chunk_pairs`.
+
+        :param max_memory: memory for the candidate pairs of each chunk
+        :type max_memory: int
+        :return: the start and stop of each chunk
+        :rtype: list of tuples of 2 int
+        """
+        candidates = np.zeros(len(self), dtype=np.int64)
+        for offset in self.__get_offsets():
+            flat = self.__get_neighbour_bins(self._bins, offset)
+            candidates += np.where(flat >= 0, self._counts[flat], 0)
+        # i, j, the displacement and distance take 56 bytes per pair
+        limit = max(1, max_memory // 56)
+        cumulative = np.cumsum(candidates)
+        chunks = []
+        start = 0
+        while start < len(self):
+            done = cumulative[start-1] if start else 0
+            stop = max(start + 1, np.searchsorted(cumulative, done + limit, side='right'))
+            chunks.append((start, int(stop)))
+            start = stop
+        return chunks
+
+    def get_chunk_pairs(self, start, stop):
+        """Returns the pairs within rmax of the atoms of a chunk from
+        :meth:`get_chunks`, every pair is in exactly one chunk.
+
+        :param start: start of the chunk
+        :type start: int
+        :param stop: stop of the chunk
+        :type stop: int
+        :return: indices i and j of the positions and their distances
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        i, j, distances = self.__get_chunk_pairs(start, stop, self.__get_offsets())
+        return self._order[i], self._order[j], distances
+
+    def iter_pairs(self, max_memory=2**27):
+        """Yields all the pairs of atoms within rmax, each pair once, in
+        the chunks of :meth:`get_chunks`.
+
+        :param max_memory: memory for the candidate pairs of each chunk
+        :type max_memory: int
+        :return: indices i and j of the positions and their distances
+        :rtype: generator of tuples of :class:`numpy.ndarray`
+        """
+        for start, stop in self.get_chunks(max_memory):
+            i, j, distances = self.get_chunk_pairs(start, stop)
+            if len(i):
+                yield i, j, distances
+
+    def get_pairs(self, r=None, max_memory=2**27):
+        """Returns all the pairs of atoms within r, each pair once, see
+        :meth:`iter_pairs`.
+
+        :param r: largest distance, at most rmax, defaults to rmax
+        :type r: float
+        :param max_memory: memory for the candidate pairs of each chunk
+        :type max_memory: int
+        :return: indices i and j of the positions and their distances
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        if r is not None and r > self._rmax:
+            raise ValueError("r must be at most rmax")
+        chunks = []
+        for i, j, distances in self.iter_pairs(max_memory):
+            if r is not None and r < self._rmax:
+                within = distances <= r
+                i, j, distances = i[within], j[within], distances[within]
+            chunks.append((i, j, distances))
+        if not chunks:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                    np.zeros(0, dtype=np.float64))
+        return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+
+    def get_nearest(self, k, max_memory=2**27):
+        """Returns the k nearest neighbours of every atom within rmax,
+        sorted by distance. Atoms with fewer than k neighbours within
+        rmax are padded with index -1 and an infinite distance.
+
+        :param k: number of neighbours
+        :type k: int
+        :param max_memory: memory for the candidate pairs of each chunk
+        :type max_memory: int
+        :return: indices and distances of the neighbours of each atom
+        :rtype: tuple of :class:`numpy.ndarray` (N, k)
+        """
+        i, j, distances = self.get_pairs(max_memory=max_memory)
+        first = np.concatenate((i, j))
+        second = np.concatenate((j, i))
+        distances = np.concatenate((distances, distances))
+        order = np.lexsort((second, distances, first))
+        first, second, distances = first[order], second[order], distances[order]
+        rank = np.arange(len(first)) - np.searchsorted(first, first)
+        nearest = rank < k
+        indices = np.full((len(self), k), -1, dtype=np.int64)
+        indices[first[nearest], rank[nearest]] = second[nearest]
+        neighbour_distances = np.full((len(self), k), np.inf)
+        neighbour_distances[first[nearest], rank[nearest]] = distances[nearest]
+        return indices, neighbour_distances
+
+    def __get_neighbour_bins(self, bins, offset):
+        """Returns the flat index of the bins at offset, or -1 outside a
+        box that is not periodic"""
+        neighbours = bins + offset
+        if self._box is not None:
+            return np.ravel_multi_index(np.remainder(neighbours, self._shape).T, self._shape)
+        inside = ((neighbours >= 0) & (neighbours < self._shape)).all(axis=1)
+        flat = np.full(len(bins), -1, dtype=np.int64)
+        flat[inside] = np.ravel_multi_index(neighbours[inside].T, self._shape)
+        return flat
+
+    def __get_chunk_pairs(self, start, stop, offsets):
+        """Returns the pairs of the sorted atoms start to stop-1 with
+        all atoms in the neighbouring bins"""
+        pairs_i, pairs_j, pairs_d = [], [], []
+        atoms = np.arange(start, stop)
+        for offset in offsets:
+            flat = self.__get_neighbour_bins(self._bins[start:stop], offset)
+            counts = np.where(flat >= 0, self._counts[flat], 0)
+            total = counts.sum()
+            if total == 0:
+                continue
+            i = np.repeat(atoms, counts)
+            # j runs over the atoms of the neighbouring bin of each i
+            first = self._starts[flat] - np.cumsum(counts) + counts
+            j = np.arange(total) + np.repeat(first, counts)
+            keep = i < j
+            i, j = i[keep], j[keep]
+            displacement = self._positions[j] - self._positions[i]
+            if self._box is not None:  # minimum image
+                displacement -= np.round(displacement / self._box) * self._box
+            distances = np.sqrt(np.einsum('ij,jk,ik->i', displacement, self._metric,
+                                          displacement))
+            within = distances <= self._rmax
+            pairs_i.append(i[within])
+            pairs_j.append(j[within])
+            pairs_d.append(distances[within])
+        if not pairs_i:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_d)
+
+
+def get_ncells(structure):
+    """Returns the number of unit cells along each axis of a structure
+
+    :param structure: the structure
+    :type structure: :class:`javelin.structure.Structure`
+    :return: number of unit cells
+    :rtype: :class:`numpy.ndarray` of 3 int
+    """
+    return structure.ncells[:3]
+
+
+def get_rmax(structure, periodic=True):
+    """Returns the largest distance that can be used, half the width of
+    the periodic box, or the longest diagonal of the box around the
+    atoms if not periodic.
+
+    :param structure: the structure
+    :type structure: :class:`javelin.structure.Structure`
+    :param periodic: if the structure is periodic
+    :type periodic: bool
+    :return: rmax in Angstrom
+    :rtype: float
+    """
+    unitcell = structure.unitcell
+    if periodic:
+        return (get_ncells(structure) / np.array(unitcell.reciprocalCell[:3])).min()/2
+    positions = structure.get_scaled_positions()
+    extent = np.ptp(positions, axis=0) if len(positions) else np.zeros(3)
+    diagonals = extent * np.array([[1, 1, 1], [-1, 1, 1], [1, -1, 1], [1, 1, -1]])
+    lengths = np.einsum('ij,jk,ik->i', diagonals, np.asarray(unitcell.G), diagonals)
+    return max(np.sqrt(lengths.max()) * (1 + 1e-9), 1e-9)
+
+
+def get_neighbor_list(structure, rmax, periodic=True):
+    """Returns the :class:`javelin.neighborlist.NeighborList` of a
+    structure using blocks of its (i, j, k) unit cells as bins
+
+    :param structure: the structure
+    :type structure: :class:`javelin.structure.Structure`
+    :param rmax: largest distance
+    :type rmax: float
+    :param periodic: if the structure is periodic
+    :type periodic: bool
+    :return: the neighbour list
+    :rtype: :class:`javelin.neighborlist.NeighborList`
+    """
+    cells = structure.get_cell_indices()[:, :3]
+    return NeighborList(structure.get_scaled_positions(), structure.unitcell, rmax,
+                        get_ncells(structure) if periodic else None, cells)
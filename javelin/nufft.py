@@ -0,0 +1,272 @@
+"""
+=====
+nufft
+=====
+
+Approximate sums of phase factors using non-uniform fast fourier
+transforms with Gaussian gridding (Greengard and Lee, SIAM Review 46,
+443, 2004).
+
+Every grid point is ``ll + a*dx + b*dy + c*dz`` so the sum over atoms
+of exp(2*pi*i*Q.r) is a sum of exp(2*pi*i*(a*u + b*v + c*w)) with u =
+dx.r, v = dy.r and w = dz.r. As a, b and c are integers only u, v and
+w modulo 1 matter, the atoms are spread with a Gaussian onto an
+oversampled periodic grid over them, which is fourier transformed with
+:func:`numpy.fft.ifftn` and the Gaussian deconvolved. The grid points
+are exactly the integer modes of the transform so no interpolation is
+needed. The cost is independent of the number of grid points per atom.
+"""
+from __future__ import absolute_import
+import numpy as np
+from javelin.fourier import get_bins, get_block_size
+
+
+def get_spreading_width(tolerance):
+    """Returns the number of points either side of each atom the
+    Gaussian is spread over to reach the relative tolerance with an
+    oversampling of 2.
+
+    :param tolerance: relative tolerance
+    :type tolerance: float
+    :return: spreading width
+    :rtype: int
+
+    >>> get_spreading_width(1e-6)
+    7
+    """
+    if tolerance <= 0:
+        raise ValueError("tolerance must be positive")
+    return int(np.clip(np.ceil(-np.log10(tolerance)) + 1, 2, 16))
+
+
+def get_spreading_parameters(n, width):
+    """Returns the size of the oversampled grid and the Gaussian
+    parameter tau for n modes, both are trivial for a single mode.
+
+    :return: size and tau
+    :rtype: tuple of int and float
+    """
+    if n == 1:
+        return 1, 0.0
+    return 2*n, np.pi*width/(3.0*n**2)
+
+
+def spread(coordinates, weights, sizes, taus, width, max_memory=2**27):
+    """Spreads the weights at the coordinates onto the periodic grid of
+    sizes with the Gaussian exp(-x**2/(4*tau)) along each axis, the
+    coordinates are in units of the period. Axes of size 1 are not
+    spread.
+
+    :param coordinates: coordinates of the points
+    :type coordinates: :class:`numpy.ndarray` (N, 3)
+    :param weights: weights of the points
+    :type weights: :class:`numpy.ndarray` (N, m)
+    :param sizes: size of the grid along each axis
+    :type sizes: list of 3 int
+    :param taus: Gaussian parameter along each axis
+    :type taus: list of 3 float
+    :param width: number of points spread over either side
+    :type width: int
+    :param max_memory: maximum memory in bytes for the temporary arrays
+    :type max_memory: int
+    :return: spread weights
+    :rtype: :class:`numpy.ndarray` (m,) + sizes
+    """
+    m = weights.shape[1]
+    length = int(np.prod(sizes))
+    density = np.zeros((m, length), dtype=np.complex128)
+    block = get_block_size(8*(4 + 2*m)*_get_kernel_size(sizes, width), max_memory)
+    for start in range(0, len(coordinates), block):
+        kernel, index = _get_kernel(coordinates[start:start+block], sizes, taus, width)
+        kernel = kernel.reshape((len(kernel), -1))
+        index = index.ravel()
+        for n in range(m):
+            values = (kernel * weights[start:start+block, n, None]).ravel()
+            density[n] += np.bincount(index, values.real, length)
+            density[n] += 1j*np.bincount(index, values.imag, length)
+    return density.reshape((m,) + tuple(sizes))
+
+
+def interpolate(coordinates, values, taus, width, max_memory=2**27):
+    """Interpolates the periodic grid values at the coordinates with the
+    Gaussian exp(-x**2/(4*tau)) along each axis, the adjoint of
+    :func:`spread`, the coordinates are in units of the period.
+
+    :param coordinates: coordinates of the points
+    :type coordinates: :class:`numpy.ndarray` (N, 3)
+    :param values: values on the grid
+    :type values: :class:`numpy.ndarray` (m,) + sizes
+    :param taus: Gaussian parameter along each axis
+    :type taus: list of 3 float
+    :param width: number of points interpolated over either side
+    :type width: int
+    :param max_memory: maximum memory in bytes for the temporary arrays
+    :type max_memory: int
+    :return: interpolated values
+    :rtype: :class:`numpy.ndarray` (m, N)
+    """
+    sizes = values.shape[1:]
+    values = values.reshape((len(values), -1))
+    results = np.empty((len(values), len(coordinates)), dtype=np.complex128)
+    block = get_block_size(8*(4 + 2*len(values))*_get_kernel_size(sizes, width), max_memory)
+    for start in range(0, len(coordinates), block):
+        kernel, index = _get_kernel(coordinates[start:start+block], sizes, taus, width)
+        kernel = kernel.reshape((len(kernel), -1))
+        index = index.reshape((len(kernel), -1))
+        for n in range(len(values)):
+            results[n, start:start+block] = np.sum(kernel * values[n][index], axis=1)
+    return results
+
+
+def _get_kernel_size(sizes, width):
+    """Returns the number of grid points each point is spread over"""
+    return int(np.prod([2*width if size > 1 else 1 for size in sizes]))
+
+
+def _get_kernel(coordinates, sizes, taus, width):
+    """Returns the Gaussian kernel of each point over its nearest grid
+    points and the flat index of those grid points"""
+    offsets = np.arange(1-width, width+1)
+    kernel = np.ones((1, 1, 1, 1))
+    index = np.zeros((1, 1, 1, 1), dtype=np.int64)
+    for axis, (size, tau) in enumerate(zip(sizes, taus)):
+        shape = [-1, 1, 1, 1]
+        if size > 1:
+            h = 2*np.pi/size
+            x = 2*np.pi*np.remainder(coordinates[:, axis], 1)
+            nearest = np.floor(x/h).astype(np.int64)[:, None] + offsets
+            shape[axis+1] = len(offsets)
+            kernel = kernel * np.exp(-(nearest*h - x[:, None])**2/(4*tau)).reshape(shape)
+            index = index*size + np.remainder(nearest, size).reshape(shape)
+        else:
+            index = index*size
+    kernel = kernel * np.ones((len(coordinates), 1, 1, 1))
+    return kernel, np.broadcast_to(index, kernel.shape)
+
+
+def sum_phases_fft(positions, grid, weights=None, tolerance=1e-6, max_memory=2**27):
+    """Returns the sum of the phase factors exp(2*pi*i*Q.r) of all
+    positions over the grid, optionally weighted, to within the relative
+    tolerance.
+
+    This is an approximation of :func:`javelin.fourier.sum_phase_factors`,
+    the positions, weights and returned array are the same.
+
+    :param positions: fractional positions of the atoms
+    :type positions: :class:`numpy.ndarray` (N, 3)
+    :param grid: Grid object
+    :type grid: :class:`javelin.grid.Grid`
+    :param weights: weights of each atom, (N, m) weights give m sums
+    :type weights: :class:`numpy.ndarray` (N,) or (N, m)
+    :param tolerance: relative tolerance
+    :type tolerance: float
+    :param max_memory: maximum memory in bytes for the temporary arrays
+       used to spread the atoms
+    :type max_memory: int
+    :return: sum of phase factors
+    :rtype: :class:`numpy.ndarray` (n1, n2, n3) or (m, n1, n2, n3)
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    weights = np.ones(len(positions)) if weights is None else np.asarray(weights)
+    shape = weights.shape[1:]
+    weights = weights.reshape((len(positions), int(np.prod(shape))))
+    ll, dx, dy, dz = grid.get_q_vectors()
+    bins = get_bins(grid)
+    width = get_spreading_width(tolerance)
+    sizes, taus = zip(*[get_spreading_parameters(n, width) for n in bins])
+    centres = np.array(bins) // 2  # the modes are centred on 0
+    coordinates = np.dot(positions, np.array([dx, dy, dz]).T)
+    phases = np.exp(2j*np.pi*(np.dot(positions, ll) + np.dot(coordinates, centres)))
+    density = spread(coordinates, weights * phases[:, None], sizes, taus, width, max_memory)
+    results = np.fft.ifftn(density, axes=(1, 2, 3))
+    results = results[np.ix_(np.arange(len(density)),
+                             *[np.remainder(np.arange(n) - centre, size)
+                               for n, centre, size in zip(bins, centres, sizes)])]
+    for axis, (n, centre, tau) in enumerate(zip(bins, centres, taus)):
+        if n > 1:
+            k = np.arange(n) - centre
+            scale = np.sqrt(np.pi/tau) * np.exp(k**2*tau)
+            results *= scale.reshape([-1 if a == axis else 1 for a in range(3)])
+    return results.reshape(shape + bins)
+
+
+def sum_phases_nufft(positions, q, weights=None, tolerance=1e-6, max_memory=2**27):
+    """Returns the sum of the phase factors exp(2*pi*i*q.r) of all
+    positions at an arbitrary list of q points, optionally weighted, to
+    within the relative tolerance.
+
+    This is a type-3 non-uniform fourier transform. The positions are
+    spread with a Gaussian onto a uniform grid covering them, the
+    transform of that grid at the q points is evaluated with a type-2
+    transform (an oversampled FFT followed by :func:`interpolate`) and
+    divided by the transform of the Gaussian. The cost grows with the
+    number of atoms and q points plus the FFT, whose size grows with the
+    product of the extent of the positions and of q along each axis, see
+    :func:`javelin.fourier.sum_phases` for the direct sum.
+
+    :param positions: fractional positions of the atoms
+    :type positions: :class:`numpy.ndarray` (N, 3)
+    :param q: q points in reciprocal lattice units
+    :type q: :class:`numpy.ndarray` (M, 3)
+    :param weights: weights of each atom, (N, m) weights give m sums
+    :type weights: :class:`numpy.ndarray` (N,) or (N, m)
+    :param tolerance: relative tolerance
+    :type tolerance: float
+    :param max_memory: maximum memory in bytes for the temporary arrays
+       used to spread the atoms and interpolate the q points
+    :type max_memory: int
+    :return: sum of phase factors
+    :rtype: :class:`numpy.ndarray` (M,) or (m, M)
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape((-1, 3))
+    s = 2*np.pi*np.asarray(q, dtype=np.float64).reshape((-1, 3))
+    weights = np.ones(len(positions)) if weights is None else np.asarray(weights)
+    shape = weights.shape[1:]
+    weights = weights.reshape((len(positions), int(np.prod(shape))))
+    if len(positions) == 0 or len(s) == 0:
+        return np.zeros(shape + (len(s),), dtype=np.complex128)
+    width = get_spreading_width(tolerance)
+
+    # Centre both the positions and q on 0
+    x0 = (positions.max(axis=0) + positions.min(axis=0))/2
+    s0 = (s.max(axis=0) + s.min(axis=0))/2
+    x = positions - x0
+    s = s - s0
+    sizes, steps, taus = [], [], []
+    for extent, bandwidth in zip(np.abs(x).max(axis=0), np.abs(s).max(axis=0)):
+        if extent*bandwidth < 1e-12:  # the phase is constant along this axis
+            sizes.append(1)
+            steps.append(1.0)
+            taus.append(0.0)
+        else:
+            steps.append(np.pi/(2*bandwidth))
+            sizes.append(2*(int(np.ceil(extent/steps[-1])) + width + 1))
+            taus.append(np.pi*width/(8*np.sqrt(2)*bandwidth**2))
+    periods = np.multiply(sizes, steps)
+
+    # Spread the positions onto the uniform grid
+    density = spread(x/periods, weights * np.exp(1j*np.dot(x, s0))[:, None], sizes,
+                     [tau*(2*np.pi/period)**2 for tau, period in zip(taus, periods)],
+                     width, max_memory)
+
+    # Type-2 transform of the uniform grid at s
+    modes = [np.round(np.fft.fftfreq(size, 1.0/size)).astype(np.int64) for size in sizes]
+    oversampled = [2*size if size > 1 else 1 for size in sizes]
+    type2_taus = [np.pi*width/(3.0*size**2) for size in sizes]
+    for axis, (mode, tau) in enumerate(zip(modes, type2_taus)):
+        if sizes[axis] > 1:
+            scale = np.sqrt(np.pi/tau) * np.exp(mode**2*tau)
+            density *= scale.reshape([1] + [-1 if a == axis else 1 for a in range(3)])
+    values = np.zeros((len(density),) + tuple(oversampled), dtype=np.complex128)
+    values[np.ix_(np.arange(len(density)),
+                  *[np.remainder(mode, size) for mode, size in zip(modes, oversampled)])] = density
+    del density
+    values = np.fft.ifftn(values, axes=(1, 2, 3))
+    results = interpolate(s*steps/(2*np.pi), values, type2_taus, width, max_memory)
+
+    # Deconvolve the spreading Gaussian and undo the centring
+    scale = np.exp(1j*np.dot(s + s0, x0))
+    for axis in range(3):
+        if sizes[axis] > 1:
+            scale *= steps[axis] * np.exp(s[:, axis]**2*taus[axis]) / np.sqrt(4*np.pi*taus[axis])
+    return (results * scale).reshape(shape + (len(s),))
@@ -0,0 +1,112 @@
+"""
+===
+pdf
+===
+
+Pair distribution functions of a periodic
+:class:`javelin.structure.Structure`,
+
+.. math::
+
+    G(r) = 4 \\pi r \\rho_0 (g(r) - 1)
+
+with the partial :math:`g_{ab}(r)` of each pair of elements and the
+total :math:`g(r) = \\sum_{ab} c_a c_b b_a b_b g_{ab}(r) / \\langle b\\rangle^2`.
+
+The pairs are found with blocks of the (i, j, k) unit cells of the
+structure as a cell list, see :func:`javelin.neighborlist.get_neighbor_list`,
+so the time is linear in the number of atoms, and the blocks can be
+histogrammed in parallel.
+"""
+from __future__ import absolute_import
+import numpy as np
+from javelin.debye import get_pair_histograms
+from javelin.neighborlist import get_ncells, get_rmax
+
+
+def get_partial_rdfs(structure, rmax=None, dr=0.01, max_memory=2**27, workers=1):
+    """Returns the partial radial distribution functions
+    :math:`g_{ab}(r)` of each pair of elements, normalised to 1 at
+    large r.
+
+    :param structure: the structure
+    :type structure: :class:`javelin.structure.Structure`
+    :param rmax: largest r, at most half the width of the structure,
+       defaults to :func:`javelin.neighborlist.get_rmax`
+    :type rmax: float
+    :param dr: width of the r bins in Angstrom
+    :type dr: float
+    :param max_memory: memory for each chunk of pairs
+    :type max_memory: int
+    :param workers: number of threads
+    :type workers: int
+    :return: the atomic numbers, the number of atoms of each, the
+       centres of the r bins and :math:`g_{ab}(r)`
+    :rtype: tuple of :class:`numpy.ndarray` (M,), (M,), (nbins,), (M, M, nbins)
+    """
+    if rmax is None:
+        rmax = get_rmax(structure)
+    atomic_numbers, r, histograms = get_pair_histograms(structure, rmax, dr, True,
+                                                        max_memory, workers)
+    nbins = int(np.floor(rmax / dr + 1e-9))  # only whole bins within rmax
+    r, histograms = r[:nbins], histograms[:, :, :nbins]
+    counts = np.array([np.count_nonzero(structure.get_atomic_numbers() == Z)
+                       for Z in atomic_numbers])
+    density = counts.sum() / (structure.unitcell.volume * np.prod(get_ncells(structure)))
+    shells = 4*np.pi/3 * ((r + dr/2)**3 - (r - dr/2)**3)
+    # b atoms around each a atom, the histograms only have a <= b
+    neighbours = histograms + np.transpose(histograms, (1, 0, 2))
+    rdfs = neighbours / (counts[:, None, None] * counts[None, :, None] / counts.sum() *
+                         density * shells)
+    return atomic_numbers, counts, r, rdfs
+
+
+def calc_partial_pdfs(structure, rmax=None, dr=0.01, max_memory=2**27, workers=1):
+    """Calculates the partial pair distribution functions
+    :math:`G_{ab}(r) = 4 \\pi r \\rho_0 (g_{ab}(r) - 1)` of each pair of
+    elements, see :func:`get_partial_rdfs` for the parameters.
+
+    :return: DataArray of the partial PDFs labelled by the pairs of
+       elements
+    :rtype: :class:`xarray.DataArray`
+    """
+    import xarray as xr
+    from javelin.utils import get_atomic_number_symbol
+    atomic_numbers, counts, r, rdfs = get_partial_rdfs(structure, rmax, dr, max_memory,
+                                                       workers)
+    density = counts.sum() / (structure.unitcell.volume * np.prod(get_ncells(structure)))
+    a, b = np.triu_indices(len(atomic_numbers))
+    symbols = get_atomic_number_symbol(Z=atomic_numbers)[1] if len(atomic_numbers) else []
+    return xr.DataArray(data=4*np.pi*r*density*(rdfs[a, b] - 1),
+                        name="G(r)",
+                        dims=("pair", "r"),
+                        coords={"pair": [symbols[n] + '-' + symbols[m] for n, m in zip(a, b)],
+                                "r": r},
+                        attrs=(("units", "A^-2"),))
+
+
+def calc_pdf(structure, rmax=None, dr=0.01, radiation='neutron', max_memory=2**27,
+             workers=1):
+    """Calculates the total pair distribution function G(r), the
+    partials weighted by the concentrations and scattering lengths, see
+    :func:`get_partial_rdfs` for the other parameters.
+
+    :param radiation: 'neutron' or 'xray', using the form factor at
+       Q = 0 for x-rays
+    :type radiation: str
+    :return: DataArray of G(r)
+    :rtype: :class:`xarray.DataArray`
+    """
+    import xarray as xr
+    from javelin.fourier import get_ff
+    atomic_numbers, counts, r, rdfs = get_partial_rdfs(structure, rmax, dr, max_memory,
+                                                       workers)
+    density = counts.sum() / (structure.unitcell.volume * np.prod(get_ncells(structure)))
+    lengths = np.array([get_ff(Z, radiation, 0.0) for Z in atomic_numbers], dtype=np.float64)
+    weights = counts * lengths / counts.sum()
+    rdf = np.einsum('a,b,abr->r', weights, weights, rdfs) / weights.sum()**2
+    return xr.DataArray(data=4*np.pi*r*density*(rdf - 1),
+                        name="G(r)",
+                        dims=("r",),
+                        coords=(r,),
+                        attrs=(("units", "A^-2"),))
@@ -6,7 +6,7 @@ structure
 
 
 import numpy as np
-from pandas import DataFrame
+from pandas import DataFrame, Series
 from javelin.unitcell import UnitCell
 from javelin.utils import get_atomic_number_symbol
 
@@ -39,104 +39,331 @@ class Structure(object):
         else:
             self.unitcell = UnitCell(unitcell)
 
-        miindex = get_miindex(numberOfAtoms, ncells)
-
-        self.atoms = DataFrame(index=miindex,
-                               columns=['Z', 'symbol',
-                                        'x', 'y', 'z',
-                                        'cartn_x', 'cartn_y', 'cartn_z'])
+        # The atoms are stored as typed arrays in (i, j, k, site) order,
+        # the cell indices follow from ncells unless _cells is set
+        self._ncells = (np.array([1, 1, 1, numberOfAtoms]) if ncells is None
+                        else ncells.astype(np.int64))
+        self._cells = None
 
+        self._numbers = np.zeros(numberOfAtoms, dtype=np.int64)
         if numbers is not None or symbols is not None:
-            self.atoms.Z, self.atoms.symbol = get_atomic_number_symbol(Z=numbers, symbol=symbols)
+            self._numbers[:] = get_atomic_number_symbol(Z=numbers, symbol=symbols)[0]
 
-        positions = np.asarray(positions)
-        self.atoms[['x', 'y', 'z']] = positions
+        self._positions = (np.zeros((0, 3)) if positions is None else
+                           np.array(positions, dtype=np.float64).reshape((-1, 3)))
 
+        # The (i, j, k, site) index is only built for the optional tables
         if rotations:
-            self.rotations = DataFrame(index=miindex.droplevel(3),
+            self.rotations = DataFrame(index=self._get_index().droplevel(3),
                                        columns=['w', 'x', 'y', 'z'])
         else:
             self.rotations = None
 
         if translations:
-            self.translations = DataFrame(index=miindex.droplevel(3),
+            self.translations = DataFrame(index=self._get_index().droplevel(3),
                                           columns=['x', 'y', 'z'])
         else:
             self.translations = None
 
-        if magnetic_moments:
-            self.magmons = DataFrame(index=miindex,
-                                     columns=['spinx', 'spiny', 'spinz'])
+        self._magmons = np.zeros((numberOfAtoms, 3)) if magnetic_moments else None
+
+        self.ions = None
+
+        self._neighbor_list = None
+
+        self._cartn = None
+
+    @property
+    def atoms(self):
+        """DataFrame of the atoms indexed by (i, j, k, site)
+
+        :getter: Returns a copy of the atoms built from the atom arrays
+           on every access. Changes to the copy are only applied to the
+           structure once it is set again, like *atoms =
+           structure.atoms; atoms.x += 0.1; structure.atoms = atoms*.
+        :setter: Sets the atoms from the Z, or else symbol, and x, y
+           and z columns and the (i, j, k, site) index. The cartesian
+           columns are recalculated.
+        :type: :class:`pandas.DataFrame`
+        """
+        cartn = self.xyz_cartn
+        return DataFrame({'Z': self._numbers,
+                          'symbol': self.get_chemical_symbols(),
+                          'x': self.x, 'y': self.y, 'z': self.z,
+                          'cartn_x': cartn[:, 0],
+                          'cartn_y': cartn[:, 1],
+                          'cartn_z': cartn[:, 2]},
+                         index=self._get_index(),
+                         columns=['Z', 'symbol',
+                                  'x', 'y', 'z',
+                                  'cartn_x', 'cartn_y', 'cartn_z'],
+                         copy=True)
+
+    @atoms.setter
+    def atoms(self, atoms):
+        from pandas import MultiIndex
+        Z = atoms['Z'].values if 'Z' in atoms else None
+        symbol = None if 'Z' in atoms else atoms['symbol'].values
+        numbers = (get_atomic_number_symbol(Z=Z, symbol=symbol)[0] if len(atoms)
+                   else np.zeros(0))
+        if len(atoms) != self.number_of_atoms:
+            self.ions = None
+            if self._magmons is not None:
+                self._magmons = np.zeros((len(atoms), 3))
+        self._numbers = np.array(numbers, dtype=np.int64)
+        self._positions = np.array(atoms[['x', 'y', 'z']].values, dtype=np.float64)
+        if isinstance(atoms.index, MultiIndex) and atoms.index.nlevels == 4 and len(atoms):
+            self._set_cell_indices(np.array(atoms.index.tolist(), dtype=np.int64))
         else:
-            self.magmons = None
+            self._ncells = np.array([1, 1, 1, len(atoms)])
+            self._cells = None
+        self._cartn = None
+
+    def _get_index(self):
+        """Returns the (i, j, k, site) MultiIndex of the atoms"""
+        from pandas import MultiIndex
+        cells = self.get_cell_indices()
+        return MultiIndex.from_arrays([cells[:, n] for n in range(4)],
+                                      names=['i', 'j', 'k', 'site'])
 
-        self._recalculate_cartn()
+    @property
+    def ncells(self):
+        """Number of unit cells along each axis and of sites in each cell
+
+        :getter: Returns the (i, j, k, site) extent of the atoms
+        :type: :class:`numpy.ndarray` of 4 int
+        """
+        return self._ncells.copy()
 
     @property
     def number_of_atoms(self):
-        return len(self.atoms)
+        return len(self._numbers)
 
     @property
     def element(self):
-        return self.atoms.symbol.values
+        return self.get_chemical_symbols()
 
     @property
     def xyz(self):
-        return self.atoms[['x', 'y', 'z']].values
+        """Fractional positions of the atoms within their cells
+
+        :getter: Returns a read-only view of the positions, like
+           :attr:`x`, :attr:`y` and :attr:`z`. Set them instead of
+           changing them in place, like *structure.x = structure.x +
+           0.1*, so that :attr:`xyz_cartn` is recalculated.
+        :setter: Sets the positions
+        :type: :class:`numpy.ndarray` (N, 3)
+        """
+        return _read_only(self._positions)
+
+    @xyz.setter
+    def xyz(self, xyz):
+        self._positions[:] = xyz
+        self._cartn = None
 
     @property
     def x(self):
-        return self.atoms.x.values
+        return _read_only(self._positions[:, 0])
+
+    @x.setter
+    def x(self, x):
+        self._positions[:, 0] = x
+        self._cartn = None
 
     @property
     def y(self):
-        return self.atoms.y.values
+        return _read_only(self._positions[:, 1])
+
+    @y.setter
+    def y(self, y):
+        self._positions[:, 1] = y
+        self._cartn = None
 
     @property
     def z(self):
-        return self.atoms.z.values
+        return _read_only(self._positions[:, 2])
+
+    @z.setter
+    def z(self, z):
+        self._positions[:, 2] = z
+        self._cartn = None
 
     @property
     def xyz_cartn(self):
-        return self.atoms[['cartn_x', 'cartn_y', 'cartn_z']].values
+        """Cartesian positions of the atoms
+
+        :getter: Returns the positions in Angstrom, calculated when first
+           needed and kept until the positions, cells or unit cell change.
+        :type: :class:`numpy.ndarray` (N, 3)
+        """
+        unitcell = self.unitcell
+        if (self._cartn is None or self._cartn[0] is not unitcell or
+                self._cartn[1] != unitcell.cell):
+            self._cartn = (unitcell, unitcell.cell,
+                           unitcell.cartesian(self.get_scaled_positions()).reshape((-1, 3)))
+        return self._cartn[2]
+
+    def get_cell_indices(self):
+        """Returns the (i, j, k, site) index of every atom, calculated
+        from ncells when the atoms fill every cell in order"""
+        if self._cells is not None:
+            return self._cells
+        return np.transpose(np.unravel_index(np.arange(self.number_of_atoms),
+                                             self._ncells)).reshape((-1, 4))
 
     def get_atom_symbols(self):
-        return self.atoms.symbol.unique()
+        symbols = self.get_chemical_symbols()
+        return symbols[np.sort(np.unique(symbols, return_index=True)[1])]
 
     def get_atom_Zs(self):
-        return self.atoms.Z.unique()
+        return self._numbers[np.sort(np.unique(self._numbers, return_index=True)[1])]
 
     def get_atom_count(self):
-        return self.atoms.symbol.value_counts()
+        return Series(self.get_chemical_symbols()).value_counts()
 
     def get_atomic_numbers(self):
-        return self.atoms.Z.values
+        return self._numbers
+
+    def set_atomic_numbers(self, numbers):
+        """Sets the atomic number of every atom"""
+        self._numbers[:] = numbers
 
     def get_chemical_symbols(self):
-        return self.atoms.symbol.values
+        from periodictable import elements
+        numbers, inverse = np.unique(self._numbers, return_inverse=True)
+        symbols = np.array([elements[Z].symbol if Z else '' for Z in numbers], dtype=object)
+        return symbols[inverse.ravel()]
 
     def get_scaled_positions(self):
-        return (self.atoms[['x', 'y', 'z']].values +
-                np.asarray([self.atoms.index.get_level_values(0).values,
-                            self.atoms.index.get_level_values(1).values,
-                            self.atoms.index.get_level_values(2).values]).T)
+        if self._cells is None:  # add the cells without building the indices
+            return (self._positions.reshape(tuple(self._ncells) + (3,)) +
+                    np.moveaxis(np.indices(self._ncells[:3]), 0, -1)[:, :, :, None]
+                    ).reshape((-1, 3))
+        return self._positions + self._cells[:, :3]
 
     def get_positions(self):
         return self.xyz_cartn
 
+    @property
+    def magmons(self):
+        """Magnetic moments of the atoms
+
+        :getter: Returns the spin components of every atom in the order
+           of the atoms, zero until set, or None if the structure has no
+           magnetic moments. The array can be changed in place.
+        :setter: Sets the moments from an array or from a DataFrame with
+           the (i, j, k, site) index of :attr:`atoms`, which is matched
+           to the atoms by its index. None removes the moments.
+        :type: :class:`numpy.ndarray` (N, 3)
+        """
+        return self._magmons
+
+    @magmons.setter
+    def magmons(self, magmons):
+        from pandas import MultiIndex
+        if magmons is None:
+            self._magmons = None
+            return
+        if isinstance(getattr(magmons, 'index', None), MultiIndex):
+            magmons = magmons.reindex(self._get_index()).values
+        self._magmons = np.broadcast_to(np.asarray(magmons, dtype=np.float64),
+                                        (self.number_of_atoms, 3)).copy()
+
     def get_magnetic_moments(self):
-        return self.magmons.values
+        return self._magmons
+
+    def get_magnetic_ions(self):
+        """Returns the ion charge of every atom used for the magnetic form
+        factor or None if not set"""
+        return self.ions
+
+    def set_magnetic_ions(self, ions):
+        """Sets the ion charge of every atom used for the magnetic form
+        factor, such as 2 and 3 for the Fe2+ and Fe3+ of a mixed-valence
+        compound.
+
+        *ions* can be a single charge for every atom, a dict of charges
+        by symbol or atomic number like *{'Fe': 2, 'Mn': 4}*, or a
+        charge for each atom. Atoms missing from a dict keep their
+        charge, 3 if not set before."""
+        if isinstance(ions, dict):
+            charges = np.full(self.number_of_atoms, 3, dtype=np.int64)
+            if self.ions is not None:
+                charges[:] = self.ions
+            for key, ion in ions.items():
+                if isinstance(key, (int, np.integer)):
+                    charges[self.get_atomic_numbers() == key] = ion
+                else:
+                    charges[self.get_chemical_symbols() == key] = ion
+        else:
+            charges = np.broadcast_to(np.asarray(ions, dtype=np.int64),
+                                      (self.number_of_atoms,)).copy()
+        self.ions = charges
+
+    def get_neighbor_list(self, rmax, periodic=True):
+        """Returns the :class:`javelin.neighborlist.NeighborList` of the
+        atoms for pairs within at least rmax, periodic over the cells of
+        the structure or not.
+
+        The neighbour list is cached and reused, also for any smaller
+        rmax, until the positions, cells or unit cell change."""
+        from javelin.neighborlist import get_ncells, get_neighbor_list
+        positions = np.asarray(self.get_scaled_positions(), dtype=np.float64)
+        key = (periodic, self.unitcell.cell, tuple(get_ncells(self)), positions.shape,
+               hash(positions.tobytes()))
+        if (self._neighbor_list is None or self._neighbor_list[0] != key or
+                self._neighbor_list[1].rmax < rmax):
+            self._neighbor_list = (key, get_neighbor_list(self, rmax, periodic))
+        return self._neighbor_list[1]
+
+    def get_pairs(self, r, periodic=True):
+        """Returns all the pairs of atoms within r of each other, each
+        pair once, as the indices i and j of the atoms and their
+        distances, see :meth:`get_neighbor_list`."""
+        return self.get_neighbor_list(r, periodic).get_pairs(r)
+
+    def get_nearest_neighbors(self, k, rmax=None, periodic=True):
+        """Returns the indices and distances of the k nearest neighbours
+        of every atom, sorted by distance, as arrays of shape (N, k).
+
+        Without rmax the search radius starts from the average density
+        and grows until every atom has k neighbours or the largest
+        distance allowed is reached, atoms with fewer neighbours are
+        padded with index -1 and an infinite distance."""
+        from javelin.neighborlist import get_ncells, get_rmax
+        limit = get_rmax(self, periodic)
+        if rmax is not None:
+            indices, distances = self.get_neighbor_list(rmax, periodic).get_nearest(k)
+            indices[distances > rmax] = -1  # the cached list can be longer
+            distances[distances > rmax] = np.inf
+            return indices, distances
+        volume = self.unitcell.volume * np.prod(get_ncells(self))
+        rmax = 1.5 * (3 * (k + 1) * volume / (4 * np.pi * max(1, self.number_of_atoms)))**(1/3.)
+        while True:
+            rmax = min(rmax, limit)
+            indices, distances = self.get_neighbor_list(rmax, periodic).get_nearest(k)
+            if (indices >= 0).all() or rmax >= limit:
+                return indices, distances
+            rmax *= 1.5
 
     def add_atom(self, i=0, j=0, k=0, site=0, Z=None, symbol=None, position=None):
         Z, symbol = get_atomic_number_symbol([Z], [symbol])
         if position is None:
             raise ValueError("position not provided")
 
-        cartn = self.unitcell.cartesian(position)[0]
-
-        self.atoms.loc[i, j, k, site] = [Z[0], symbol[0],
-                                         position[0], position[1], position[2],
-                                         cartn[0], cartn[1], cartn[2]]
+        cells = self.get_cell_indices()
+        existing = np.flatnonzero((cells == [i, j, k, site]).all(axis=1))
+        if len(existing):
+            self._numbers[existing[0]] = Z[0]
+            self._positions[existing[0]] = position
+        else:
+            self._numbers = np.append(self._numbers, Z[0])
+            self._positions = np.vstack((self._positions, np.reshape(position, (1, 3))))
+            if self.ions is not None:
+                self.ions = np.append(self.ions, 3)
+            if self._magmons is not None:
+                self._magmons = np.vstack((self._magmons, np.zeros((1, 3))))
+            self._set_cell_indices(np.vstack((cells, [[i, j, k, site]])))
 
         if self.rotations is not None:
             self.rotations[i, j, k] = [1, 0, 0, 0]
@@ -144,6 +371,8 @@ class Structure(object):
         if self.translations is not None:
             self.translations[i, j, k] = [0, 0, 0]
 
+        self._cartn = None
+
     def repeat(self, rep):
         """Repeat the cells a number of time along each dimension
 
@@ -155,38 +384,46 @@ class Structure(object):
         else:
             rep = np.append(rep, 1)
 
-        ncells = np.array(self.atoms.index.max()) + 1
-
-        x = np.tile(np.reshape(self.x, ncells), rep).flatten()
-        y = np.tile(np.reshape(self.y, ncells), rep).flatten()
-        z = np.tile(np.reshape(self.z, ncells), rep).flatten()
-        Z = np.tile(np.reshape(self.get_atomic_numbers(), ncells), rep).flatten()
-
-        miindex = get_miindex(0, ncells * rep)
+        ncells = self._ncells
 
-        self.atoms = DataFrame(index=miindex,
-                               columns=['Z', 'symbol',
-                                        'x', 'y', 'z',
-                                        'cartn_x', 'cartn_y', 'cartn_z'])
+        self._positions = np.tile(np.reshape(self._positions, tuple(ncells) + (3,)),
+                                  tuple(rep) + (1,)).reshape((-1, 3))
+        self._numbers = np.tile(np.reshape(self._numbers, ncells), rep).flatten()
+        if self.ions is not None:
+            self.ions = np.tile(np.reshape(self.ions, ncells), rep).flatten()
+        if self._magmons is not None:
+            self._magmons = np.tile(np.reshape(self._magmons, tuple(ncells) + (3,)),
+                                    tuple(rep) + (1,)).reshape((-1, 3))
 
-        self.atoms.Z, self.atoms.symbol = get_atomic_number_symbol(Z=Z)
+        self._ncells = ncells * rep
+        self._cells = None
 
-        self.atoms.x = x
-        self.atoms.y = y
-        self.atoms.z = z
-
-        self._recalculate_cartn()
+        self._cartn = None
 
     def reindex(self, ncells):
-        self.atoms.set_index(get_miindex(ncells=ncells), inplace=True)
-        self._recalculate_cartn()
-
-    def _recalculate_cartn(self):
-        self.atoms[['cartn_x', 'cartn_y', 'cartn_z']] = self.unitcell.cartesian(
-            self.atoms[['x', 'y', 'z']].values +
-            np.asarray([self.atoms.index.get_level_values(0).values,
-                        self.atoms.index.get_level_values(1).values,
-                        self.atoms.index.get_level_values(2).values]).T)
+        ncells = np.asarray(ncells, dtype=np.int64)
+        if ncells.prod() != self.number_of_atoms:
+            raise ValueError("Product of ncells values doesn't equal number of atoms")
+        self._ncells = ncells
+        self._cells = None
+        self._cartn = None
+
+    def _set_cell_indices(self, cells):
+        """Sets ncells to the extent of the cell indices, which are only
+        stored when the atoms do not fill every cell in order"""
+        self._ncells = cells.max(axis=0) + 1
+        self._cells = cells
+        if (len(cells) == self._ncells.prod() and (cells >= 0).all() and
+                (np.ravel_multi_index(tuple(cells.T), self._ncells) ==
+                 np.arange(len(cells))).all()):
+            self._cells = None
+
+
+def _read_only(array):
+    """Returns a read-only view of array"""
+    view = array.view()
+    view.flags.writeable = False
+    return view
 
 
 def axisAngle2Versor(x, y, z, angle, unit='degrees'):
@@ -215,24 +452,3 @@ def get_rotation_matrix_from_versor(w, x, y, z):
     return np.matrix([[1-2*y**2-2*z**2, 2*(x*y-z*w), 2*(x*z+y*w)],
                       [2*(x*y+z*w), 1-2*x**2-2*z**2, 2*(y*z-x*w)],
                       [2*(x*z-y*w), 2*(y*z+x*w), 1-2*x**2-2*y**2]]).T.A
-
-
-def get_miindex(l=0, ncells=None):
-    from pandas import MultiIndex
-
-    if ncells is None:
-        if l == 0:
-            miindex = MultiIndex(levels=[[], [], [], []],
-                                 labels=[[], [], [], []],
-                                 names=['i', 'j', 'k', 'site'])
-        else:
-            miindex = MultiIndex.from_product([[0], [0], [0], range(l)],
-                                              names=['i', 'j', 'k', 'site'])
-    else:
-        miindex = MultiIndex.from_product([range(ncells[0]),
-                                           range(ncells[1]),
-                                           range(ncells[2]),
-                                           range(ncells[3])],
-                                          names=['i', 'j', 'k', 'site'])
-
-    return miindex
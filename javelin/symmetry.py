@@ -0,0 +1,215 @@
+"""
+========
+symmetry
+========
+
+Laue symmetry operators in reciprocal space and their action on the
+points of a :class:`javelin.grid.Grid`.
+
+Operators act on hkl column vectors, ``q' = R q``. Hexagonal and
+trigonal classes use hexagonal axes.
+"""
+from __future__ import absolute_import
+import numpy as np
+
+# Generators of the Laue classes as real space rotations on fractional
+# coordinates, -1 is always added
+_INVERSION = -np.eye(3, dtype=int)
+_GENERATORS = {'-1': [],
+               '2/m': [[[-1, 0, 0], [0, 1, 0], [0, 0, -1]]],
+               'mmm': [[[-1, 0, 0], [0, -1, 0], [0, 0, 1]],
+                       [[-1, 0, 0], [0, 1, 0], [0, 0, -1]]],
+               '4/m': [[[0, -1, 0], [1, 0, 0], [0, 0, 1]]],
+               '4/mmm': [[[0, -1, 0], [1, 0, 0], [0, 0, 1]],
+                         [[1, 0, 0], [0, -1, 0], [0, 0, -1]]],
+               '-3': [[[0, -1, 0], [1, -1, 0], [0, 0, 1]]],
+               '-3m1': [[[0, -1, 0], [1, -1, 0], [0, 0, 1]],
+                        [[1, -1, 0], [0, -1, 0], [0, 0, -1]]],
+               '-31m': [[[0, -1, 0], [1, -1, 0], [0, 0, 1]],
+                        [[0, 1, 0], [1, 0, 0], [0, 0, -1]]],
+               '6/m': [[[1, -1, 0], [1, 0, 0], [0, 0, 1]]],
+               '6/mmm': [[[1, -1, 0], [1, 0, 0], [0, 0, 1]],
+                         [[1, -1, 0], [0, -1, 0], [0, 0, -1]]],
+               'm-3': [[[-1, 0, 0], [0, -1, 0], [0, 0, 1]],
+                       [[-1, 0, 0], [0, 1, 0], [0, 0, -1]],
+                       [[0, 0, 1], [1, 0, 0], [0, 1, 0]]],
+               'm-3m': [[[0, -1, 0], [1, 0, 0], [0, 0, 1]],
+                        [[0, 0, 1], [1, 0, 0], [0, 1, 0]]]}
+_GENERATORS['-3m'] = _GENERATORS['-3m1']
+
+
+def get_laue_classes():
+    """Returns the names of the Laue classes
+
+    :return: Laue class names
+    :rtype: list of str
+    """
+    return sorted(_GENERATORS)
+
+
+def get_operators(symmetry):
+    """Returns all the operators of a Laue class or of the group
+    generated by a list of operators.
+
+    :param symmetry: Laue class name or operators acting on hkl
+    :type symmetry: str or list of 3x3 matrices
+    :return: operators acting on hkl
+    :rtype: list of :class:`numpy.ndarray` (3, 3)
+
+    >>> len(get_operators('m-3m'))
+    48
+    >>> len(get_operators([[[-1, 0, 0], [0, -1, 0], [0, 0, -1]]]))
+    2
+    """
+    if isinstance(symmetry, str):
+        if symmetry not in _GENERATORS:
+            raise ValueError("Unknown Laue class " + symmetry + ", must be one of " +
+                             ", ".join(get_laue_classes()))
+        # Real space rotations W act on hkl as inverse(W).T
+        generators = [np.round(np.linalg.inv(w).T).astype(int)
+                      for w in _GENERATORS[symmetry]] + [_INVERSION]
+    else:
+        generators = np.asarray(symmetry)
+        if generators.ndim != 3 or generators.shape[1:] != (3, 3):
+            raise ValueError("Operators must be a list of 3x3 matrices")
+    return get_group(generators)
+
+
+def get_group(generators, max_order=192):
+    """Returns all the products of the generators, including the
+    identity.
+
+    :param generators: generating matrices
+    :type generators: list of 3x3 matrices
+    :param max_order: largest group allowed
+    :type max_order: int
+    :return: elements of the group
+    :rtype: list of :class:`numpy.ndarray` (3, 3)
+    """
+    generators = [np.asarray(g, dtype=np.float64) for g in generators]
+    group = [np.eye(3)]
+    new = list(group)
+    while new:
+        products = []
+        for element in new:
+            for generator in generators:
+                product = np.dot(generator, element)
+                if not any(np.allclose(product, g) for g in group + products):
+                    products.append(product)
+        group.extend(products)
+        new = products
+        if len(group) > max_order:
+            raise ValueError("Operators do not form a finite group")
+    return group
+
+
+def add_inversion(operators):
+    """Returns the operators together with their product with the
+    inversion, -1 commutes with every operator so this is again a group.
+
+    :param operators: operators acting on hkl
+    :type operators: list of :class:`numpy.ndarray` (3, 3)
+    :return: operators with the inversion
+    :rtype: list of :class:`numpy.ndarray` (3, 3)
+
+    >>> len(add_inversion([np.eye(3)]))
+    2
+    >>> len(add_inversion(get_operators('m-3m')))
+    48
+    """
+    operators = [np.asarray(operator, dtype=np.float64) for operator in operators]
+    if any(np.allclose(operator, -np.eye(3)) for operator in operators):
+        return operators
+    return operators + [-operator for operator in operators]
+
+
+def get_index_maps(grid, operators):
+    """Returns how the operators map the indices of the grid points,
+    ``n' = rotation.n + translation``, leaving out the identity. Only
+    the corners of the grid are mapped to check that the grid is closed
+    under the operators, so no array the size of the grid is made.
+
+    :param grid: Grid object
+    :type grid: :class:`javelin.grid.Grid`
+    :param operators: operators acting on hkl
+    :type operators: list of :class:`numpy.ndarray` (3, 3)
+    :return: rotation and translation of the index of every operator
+       but the identity, or None if the grid is not closed under the
+       operators
+    :rtype: list of tuple of :class:`numpy.ndarray`
+    """
+    bins = np.array(grid.bins)
+    ll, dx, dy, dz = grid.get_q_vectors()
+    steps = np.transpose([dx, dy, dz][:len(bins)])
+    corners = np.transpose([np.ravel(c) for c in np.indices((2,)*len(bins))]) * (bins - 1)
+    maps = []
+    for operator in operators:
+        rotation = np.linalg.lstsq(steps, np.dot(operator, steps), rcond=-1)[0]
+        translation = np.linalg.lstsq(steps, np.dot(operator, ll) - ll, rcond=-1)[0]
+        if not (np.allclose(np.dot(steps, rotation), np.dot(operator, steps)) and
+                np.allclose(np.dot(steps, translation), np.dot(operator, ll) - ll) and
+                np.allclose(rotation, np.round(rotation)) and
+                np.allclose(translation, np.round(translation))):
+            return None
+        rotation = np.round(rotation).astype(np.int64)
+        translation = np.round(translation).astype(np.int64)
+        images = np.dot(corners, rotation.T) + translation
+        if (images < 0).any() or (images >= bins).any():
+            return None
+        if not ((rotation == np.eye(len(bins))).all() and (translation == 0).all()):
+            maps.append((rotation, translation))
+    return maps
+
+
+def get_representatives(grid, operators, start=0, stop=None):
+    """Returns, for every point of the grid in the rows start to stop
+    along the first axis, the flat index in the whole grid of the point
+    representing its orbit under the operators, the orbit member with
+    the largest flat index. Only the representatives need to be
+    calculated, the rest follow from ``values.flat[representatives]``.
+    Only the rows asked for are held in memory.
+
+    :param grid: Grid object
+    :type grid: :class:`javelin.grid.Grid`
+    :param operators: operators acting on hkl
+    :type operators: list of :class:`numpy.ndarray` (3, 3)
+    :param start: first row along the first axis
+    :type start: int
+    :param stop: row after the last, defaults to the whole grid
+    :type stop: int
+    :return: flat index of the representative of every point of the
+       rows, or None if the grid is not closed under the operators
+    :rtype: :class:`numpy.ndarray` of the shape of the rows of the grid
+    """
+    maps = get_index_maps(grid, operators)
+    if maps is None:
+        return None
+    return map_representatives(grid.bins, maps, start, stop)
+
+
+def map_representatives(bins, maps, start=0, stop=None):
+    """Returns the representatives of the rows start to stop of a grid
+    of shape bins from the index maps of :func:`get_index_maps`, see
+    :func:`get_representatives`.
+
+    The flat index of the image of a point is linear in the index of
+    the point, so the images of each operator are a broadcast sum of
+    one term along each axis.
+    """
+    bins = tuple(int(n) for n in bins)
+    shape = (bins[0] - start if stop is None else stop - start,) + bins[1:]
+    strides = np.cumprod((1,) + bins[:0:-1])[::-1]
+    axes = [np.arange(n).reshape((-1,) + (1,)*(len(bins) - 1 - d)) for d, n in enumerate(shape)]
+    axes[0] = axes[0] + start
+
+    def get_images(rotation, translation):
+        coefficients = np.dot(strides, rotation)
+        images = np.dot(strides, translation) + coefficients[0]*axes[0]
+        for coefficient, axis in zip(coefficients[1:], axes[1:]):
+            images = images + coefficient*axis
+        return images
+
+    representatives = get_images(np.eye(len(bins), dtype=np.int64), np.zeros(len(bins), np.int64))
+    for rotation, translation in maps:
+        np.maximum(representatives, get_images(rotation, translation), out=representatives)
+    return representatives
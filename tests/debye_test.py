@@ -0,0 +1,32 @@
+import numpy as np
+from numpy.testing import assert_array_equal, assert_allclose
+from javelin.structure import Structure
+from javelin.debye import calc_debye, get_pair_histograms, get_ncells, get_rmax
+
+
+def test_get_pair_histograms():
+    structure = Structure(symbols=['Fe'], positions=[[0, 0, 0]], unitcell=3)
+    structure.repeat(6)
+    assert_array_equal(get_ncells(structure), [6, 6, 6])
+    assert get_rmax(structure) == 9
+    atomic_numbers, r, histograms = get_pair_histograms(structure, rmax=4.3, dr=0.1)
+    assert_array_equal(atomic_numbers, [26])
+    assert histograms.shape == (1, 1, len(r))
+    # 3 nearest and 6 next nearest neighbours per atom
+    assert_array_equal(histograms[0, 0][histograms[0, 0] > 0], [216*3, 216*6])
+    assert_allclose(r[histograms[0, 0] > 0], [3.05, 4.25])
+
+
+def test_calc_debye():
+    from javelin.fourier import get_ff
+    structure = Structure(symbols=['C', 'O']*20, unitcell=(3, 4, 5),
+                          positions=np.random.RandomState(0).rand(40, 3))
+    q = np.linspace(0, 10, 11)
+    results = calc_debye(structure, q, dr=1e-4, radiation='xray', periodic=False)
+    assert results.dims == ('Q',)
+    positions = structure.unitcell.cartesian(structure.get_scaled_positions())
+    distances = np.linalg.norm(positions[:, None] - positions[None], axis=2)
+    ff = np.array([get_ff(Z, 'xray', q) for Z in structure.get_atomic_numbers()])
+    expected = np.einsum('iq,jq,ijq->q', ff, ff,
+                         np.sinc(q[None, None, :]*distances[:, :, None]/np.pi)) / 40
+    assert_allclose(results, expected, rtol=1e-4)
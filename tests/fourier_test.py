@@ -1,4 +1,6 @@
+import mmap
 import pytest
+import numpy as np
 from javelin.fourier import Fourier
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 
@@ -86,3 +88,641 @@ def test_Foutier_ASE_C_Ring():
     assert_array_almost_equal(results, expected_result, 5)
     results = four.calc(fast=False)
     assert_array_almost_equal(results, expected_result, 5)
+
+
+def test_Fourier_oblique_grid():
+    from javelin.structure import Structure
+    structure = Structure(symbols=['Au', 'Ag', 'Pt'],
+                          positions=[[0, 0, 0], [0.5, 0.25, 0.1], [0.3, 0.7, 0.9]],
+                          unitcell=4)
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [11, 12]
+    four.grid.ll = [-0.5, -0.2, 0.1]
+    four.grid.lr = [2.0, 1.0, 0.3]
+    four.grid.ul = [-1.0, 2.0, 0.5]
+    assert_array_almost_equal(four.calc(), four.calc(fast=False))
+    four.grid.bins = [5, 6, 7]
+    four.grid.tl = [0.1, 0.3, 2.0]
+    assert_array_almost_equal(four.calc(), four.calc(fast=False))
+
+
+def test_sum_phase_factors():
+    from javelin.grid import Grid
+    from javelin.fourier import sum_phase_factors, sum_phases
+    grid = Grid(ll=[-1, 0, 0.5], lr=[2, 1, 0], ul=[0, 2, 1], tl=[1, 0, 3], bins=(4, 5, 6))
+    rng = np.random.RandomState(0)
+    positions = rng.rand(10, 3) * 5
+    weights = rng.rand(10, 3)
+    expected = sum_phases(positions, grid)
+    assert expected.shape == (4, 5, 6)
+    assert_array_almost_equal(sum_phase_factors(positions, grid), expected)
+    assert_array_almost_equal(sum_phase_factors(positions, grid, max_memory=1), expected)
+    expected = sum_phases(positions, grid, weights, max_memory=1)
+    assert expected.shape == (3, 4, 5, 6)
+    assert_array_almost_equal(sum_phase_factors(positions, grid, weights), expected)
+    assert_array_almost_equal(sum_phase_factors(positions, grid, weights, max_memory=1), expected)
+    assert_array_almost_equal(sum_phase_factors(positions, grid, weights, max_memory=1,
+                                                workers=3), expected)
+
+
+def test_sum_phase_factors_deterministic():
+    from javelin.grid import Grid
+    from javelin.fourier import sum_phase_factors
+    grid = Grid(ll=[-1, 0, 0.5], lr=[2, 1, 0], ul=[0, 2, 1], bins=(7, 8))
+    positions = np.random.RandomState(0).rand(50, 3) * 5
+    expected = sum_phase_factors(positions, grid, max_memory=2000, deterministic=True)
+    for workers in (2, 3, 8):
+        assert_array_equal(sum_phase_factors(positions, grid, max_memory=2000, workers=workers,
+                                             deterministic=True), expected)
+
+
+def test_Fourier_max_memory():
+    four = Fourier()
+    assert four.max_memory == 2**27
+    four.max_memory = 1e6
+    assert four.max_memory == 1000000
+    with pytest.raises(ValueError):
+        four.max_memory = 0
+
+
+def test_Fourier_workers():
+    four = Fourier()
+    assert four.workers == 1
+    assert not four.deterministic
+    four.workers = 4
+    four.deterministic = True
+    assert four.workers == 4
+    assert four.deterministic
+    with pytest.raises(ValueError):
+        four.workers = 0
+
+
+def test_Fourier_lots_processes():
+    from javelin.structure import Structure
+    structure = Structure(symbols=['Au', 'Ag'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4)
+    structure.repeat((4, 5, 3))
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [11, 12]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    four.lots = [2, 3, 2]
+    four.number_of_lots = 3
+    four.seed = 0
+    assert four.processes is None
+    expected = four.calc()
+    four.processes = 2
+    assert_array_almost_equal(four.calc(), expected)
+    with pytest.raises(ValueError):
+        four.processes = 0
+
+
+def test_Fourier_lots_seed():
+    from javelin.structure import Structure
+    from javelin.fourier import get_ff, sum_phases
+    structure = Structure(symbols=['Au', 'Ag'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4)
+    structure.repeat((4, 5, 3))
+    structure.x = structure.x + np.linspace(0, 0.1, 120)
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [11, 12]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    four.lots = [3, 4, 2]
+    four.number_of_lots = 2
+    assert four.seed is None
+    four.seed = 42
+    results = four.calc()
+    assert_array_equal(four.calc(), results)
+    four.seed = np.random.RandomState(42)
+    assert_array_equal(four.calc(), results)
+
+    # Lots wrap around periodically and are placed in contiguous cells
+    expected = np.zeros((11, 12))
+    xyz = structure.xyz.reshape((4, 5, 3, 2, 3))
+    rng = np.random.RandomState(42)
+    origins = np.column_stack([rng.randint(0, n, size=2) for n in (4, 5, 3)])
+    for origin in origins:
+        lot = np.ix_(*[(origin[n] + np.arange(four.lots[n])) % [4, 5, 3][n] for n in range(3)])
+        positions = xyz[lot] + np.indices((3, 4, 2)).transpose((1, 2, 3, 0))[:, :, :, None]
+        amplitude = (sum_phases(positions[:, :, :, 0], four.grid) * get_ff(79, 'neutron') +
+                     sum_phases(positions[:, :, :, 1], four.grid) * get_ff(47, 'neutron'))
+        expected += np.abs(amplitude[:, :, 0])**2
+    assert_array_almost_equal(results, expected)
+
+    # An explicit seed is passed through to every lot of the calculation
+    four.seed = 7
+    results = four.calc()
+    four.seed = np.random.RandomState(7)
+    assert_array_equal(four.calc(), results)
+    if hasattr(np.random, 'default_rng'):
+        four.seed = np.random.default_rng(7)
+        assert four.calc().shape == (11, 12)
+
+
+def test_share_array():
+    from javelin.fourier import share_array, get_shared_array, free_shared_array
+    for array in (np.arange(12).reshape((4, 3)), np.random.rand(5, 3), np.empty((0, 3))):
+        shared = share_array(array)
+        view = get_shared_array(*shared)
+        assert_array_equal(view, array)
+        assert view.dtype == array.dtype
+        del view
+        free_shared_array(*shared)
+
+
+def test_Amplitude():
+    from javelin.structure import Structure
+    structure = Structure(symbols=['Au', 'Ag', 'Pt', 'Ag'],
+                          positions=[[0, 0, 0], [0.5, 0.25, 0.1], [0.3, 0.7, 0.9], [1, 1, 0]],
+                          unitcell=4)
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [6, 7, 3]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    four.grid.tl = [0.0, 0.5, 1.0]
+    amplitude = four.get_amplitude()
+    initial = amplitude.amplitude.copy()
+    assert_array_almost_equal(amplitude.get_intensity(), four.calc())
+
+    amplitude.move(1, [0.2, 0.4, 0.6])
+    amplitude.swap(0, 2)
+    amplitude.substitute([3], 26)
+    assert_array_equal(amplitude.atomic_numbers, [78, 47, 79, 26])
+    assert_array_equal(amplitude.positions[1], [0.2, 0.4, 0.6])
+    amplitude.reject()
+    assert_array_equal(amplitude.atomic_numbers, [79, 47, 78, 47])
+    assert_array_equal(amplitude.positions, structure.get_scaled_positions())
+    assert_array_almost_equal(amplitude.amplitude, initial)
+
+    amplitude.move([1], [[0.2, 0.4, 0.6]])
+    amplitude.swap(0, 2)
+    amplitude.substitute(3, 26)
+    amplitude.accept()
+    amplitude.reject()
+    moved = Structure(symbols=['Pt', 'Ag', 'Au', 'Fe'],
+                      positions=[[0, 0, 0], [0.2, 0.4, 0.6], [0.3, 0.7, 0.9], [1, 1, 0]],
+                      unitcell=4)
+    four.structure = moved
+    assert_array_almost_equal(amplitude.get_intensity(), four.calc())
+
+    # The amplitude has its own cache, the one of four is kept
+    keys = four._cache.keys()
+    assert len(keys) > 0
+    four.get_amplitude()
+    assert four._cache.keys() == keys
+
+    # Species without form factors are skipped, as in calc
+    from javelin.fourier import Amplitude
+    amplitude = Amplitude(four, [79, 120], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    amplitude.move(1, [0.1, 0.2, 0.3])
+    amplitude.substitute(0, 120)
+    assert_array_almost_equal(amplitude.amplitude, 0)
+
+
+def test_Fourier_cache():
+    from javelin.structure import Structure
+    structure = Structure(symbols=['Au', 'Ag'], positions=[[0, 0, 0], [0.5, 0.25, 0.1]],
+                          unitcell=4)
+    four = Fourier()
+    four.structure = structure
+    four.radiation = 'xray'
+    four.grid.bins = [6, 7]
+    assert four.cache_size == 16
+    first = four.calc()
+    assert_array_equal(four.calc(), first)
+
+    # Changes to the grid and unit cell are not served from the cache
+    four.grid.bins = [5, 7]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    structure.unitcell.cell = 5
+    fresh = Fourier()
+    fresh.structure = structure
+    fresh.radiation = 'xray'
+    fresh.grid = four.grid
+    assert_array_almost_equal(four.calc(), fresh.calc())
+
+    four.cache_size = 0
+    assert_array_almost_equal(four.calc(), fresh.calc())
+    with pytest.raises(ValueError):
+        four.cache_size = -1
+
+
+def test_Fourier_magnetic():
+    from javelin.structure import Structure
+    from javelin.fourier import get_mag_ff
+    structure = Structure(symbols=['Fe', 'Mn', 'Fe', 'Mn'],
+                          positions=[[0, 0, 0], [0.5, 0.25, 0.1], [3.3, 2.7, 0.9], [1, 2, 1]],
+                          unitcell=4, magnetic_moments=True)
+    structure.magmons[:] = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0]]
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [6, 7]
+    four.grid.ll = [0.1, 0.1, 0.1]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    q = np.array([np.ravel(qi) for qi in four.grid.get_q_meshgrid()]).T * 2*np.pi
+    q_length = np.linalg.norm(q / 4, axis=1)
+    spin = 0
+    for Z, position, moment in zip(structure.get_atomic_numbers(),
+                                   structure.get_scaled_positions(),
+                                   structure.get_magnetic_moments()):
+        ff = get_mag_ff(Z, q_length, ion=3)
+        spin = spin + (ff * np.exp(1j*np.dot(q, position)))[:, None] * moment
+    spin -= (np.sum(spin * q, axis=1) / np.sum(q**2, axis=1))[:, None] * q
+    expected = np.sum(np.abs(spin)**2, axis=1).reshape((6, 7))
+    assert_array_almost_equal(four.calc(mag=True, fast=False), expected)
+    assert_array_almost_equal(four.calc(mag=True), expected)
+
+    # Mixed valence with the dipole approximation
+    structure.set_magnetic_ions([2, 4, 3, 4])
+    four.g_factor = 1.9
+    spin = 0
+    for Z, ion, position, moment in zip(structure.get_atomic_numbers(),
+                                        structure.get_magnetic_ions(),
+                                        structure.get_scaled_positions(),
+                                        structure.get_magnetic_moments()):
+        ff = get_mag_ff(Z, q_length, ion=ion, g=1.9)
+        spin = spin + (ff * np.exp(1j*np.dot(q, position)))[:, None] * moment
+    spin -= (np.sum(spin * q, axis=1) / np.sum(q**2, axis=1))[:, None] * q
+    expected = np.sum(np.abs(spin)**2, axis=1).reshape((6, 7))
+    assert_array_almost_equal(four.calc(mag=True), expected)
+    assert len([key for key in four._cache.keys() if key[0] == 'mag_ff']) == 5
+    with pytest.raises(ValueError):
+        four.g_factor = 0
+
+
+def test_Fourier_precision():
+    from javelin.structure import Structure
+    structure = Structure(symbols=['Fe', 'Mn', 'Fe'],
+                          positions=[[0, 0, 0], [0.5, 0.25, 0.1], [3.3, 2.7, 0.9]],
+                          unitcell=4, magnetic_moments=True)
+    structure.magmons[:] = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [6, 7]
+    four.grid.ll = [0.1, 0.1, 0.1]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    assert four.precision == 'double'
+    expected = four.calc()
+    expected_mag = four.calc(mag=True, fast=False)
+    four.precision = 'single'
+    for fast in (True, False):
+        results = four.calc(fast=fast)
+        assert results.dtype == np.float64
+        assert_array_almost_equal(results / expected, 1, 4)
+    assert_array_almost_equal(four.calc(mag=True) / expected_mag, 1, 4)
+    with pytest.raises(ValueError):
+        four.precision = 'half'
+
+
+def test_Fourier_output(tmpdir):
+    from javelin.structure import Structure
+    structure = Structure(symbols=['Au', 'Ag'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4)
+    structure.repeat((4, 5, 3))
+    structure.x = structure.x + np.linspace(0, 0.1, 120)
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [11, 6, 5]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    expected = four.calc()
+    assert four.output is None
+    four.max_memory = 16*6*5*3  # 3 rows per slab, the last 2
+    four.output = str(tmpdir.join('output.npy'))
+    results = four.calc()
+    base = results.values  # xarray may unwrap the memmap, its buffer is still the file
+    while isinstance(base, np.ndarray):
+        base = base.base
+    assert isinstance(base, mmap.mmap)
+    assert_array_almost_equal(results, expected)
+    assert_array_equal(results.Q1, expected.Q1)
+    assert_array_almost_equal(np.load(four.output), expected)
+
+    # The same lots are used for every slab
+    four.lots = [3, 4, 2]
+    four.number_of_lots = 2
+    four.seed = np.random.RandomState(42)
+    results = four.calc()
+    four.output = None
+    four.seed = np.random.RandomState(42)
+    four.seed = four.seed.randint(np.iinfo(np.int32).max, size=(1, 3))[0, 0]
+    assert_array_almost_equal(results, four.calc())
+
+    # A single last row is merged into the previous slab
+    four.lots = None
+    four.grid.bins = [5, 4]
+    four.grid.lr = [2.0, 0.0, 0.0]
+    expected = four.calc()
+    four.max_memory = 16*4*2  # 2 rows per slab
+    four.output = str(tmpdir.join('output_odd.npy'))
+    assert_array_almost_equal(four.calc(), expected)
+
+    # The magnetic intensity is undefined at Q = 0 in every slab
+    structure = Structure(symbols=['Fe', 'Mn'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4, magnetic_moments=True)
+    structure.magmons = [[1, 0, 0], [0, 1, 1]]
+    four.structure = structure
+    four.grid.ll = [-0.2, -0.4, 0]
+    four.grid.lr = [0.6, -0.4, 0]
+    four.grid.ul = [-0.2, 0.8, 0]
+    four.output = None
+    expected = four.calc(mag=True)
+    assert np.isnan(expected.values).sum() == 1
+    four.output = str(tmpdir.join('output_mag.npy'))
+    assert_array_almost_equal(four.calc(mag=True), expected)
+
+
+def test_Fourier_output_hdf5(tmpdir):
+    pytest.importorskip("h5py")
+    pytest.importorskip("dask")
+    from javelin.structure import Structure
+    structure = Structure(symbols=['Au', 'Ag'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4)
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [10, 6]
+    expected = four.calc()
+    four.max_memory = 16*6*4
+    four.output = str(tmpdir.join('output.h5'))
+    results = four.calc()
+    assert results.chunks == ((4, 4, 2), (6,))
+    assert_array_almost_equal(results, expected)
+
+
+def test_sum_cell_phase_factors():
+    from javelin.grid import Grid
+    from javelin.fourier import sum_phase_factors, sum_cell_phase_factors
+    grid = Grid(ll=[0.1, -0.2, 0.3], lr=[2.1, 0.3, 0.3], ul=[0.1, 1.3, 0.4], tl=[0.5, -0.2, 1.3],
+                bins=[7, 6, 5])
+    rng = np.random.RandomState(0)
+    cells = rng.randint(-3, 4, size=(50, 3))
+    positions = rng.rand(4, 3)[rng.randint(4, size=50)]
+    weights = rng.rand(50, 3)
+    assert_array_almost_equal(sum_cell_phase_factors(cells, positions, grid, max_memory=2**12),
+                              sum_phase_factors(cells + positions, grid))
+    assert_array_almost_equal(sum_cell_phase_factors(cells, positions, grid, weights),
+                              sum_phase_factors(cells + positions, grid, weights))
+    assert sum_cell_phase_factors(cells[:0], positions[:0], grid).shape == (7, 6, 5)
+
+    # A box of cells with a few sites is contracted one crystal axis at a time
+    cells = np.repeat(np.indices((6, 5, 4)).reshape((3, -1)).T - [2, 0, 1], 2, axis=0)
+    positions = np.tile([[0, 0, 0], [0.5, 0.25, 0.1]], (120, 1))
+    weights = rng.rand(240, 3)
+    for grid in [Grid(ll=[0.1, -0.2, 0.3], lr=[2.1, -0.2, 0.3], ul=[0.1, 1.3, 0.3],
+                      tl=[0.1, -0.2, 1.3], bins=[7, 6, 5]),
+                 Grid(ll=[0.1, -0.2, 0.3], lr=[0.1, -0.2, 2.3], ul=[0.1, 1.3, 0.3], bins=[7, 6]),
+                 Grid(ll=[0.1, -0.2, 0.3], lr=[2.1, 0.3, 0.3], ul=[0.1, 1.3, 0.4], bins=[7, 6])]:
+        assert_array_almost_equal(sum_cell_phase_factors(cells, positions, grid),
+                                  sum_phase_factors(cells + positions, grid))
+        assert_array_almost_equal(sum_cell_phase_factors(cells, positions, grid, weights,
+                                                         workers=2),
+                                  sum_phase_factors(cells + positions, grid, weights))
+
+
+def test_get_lattice_sum():
+    from javelin.grid import Grid
+    from javelin.fourier import get_lattice_sum, sum_phases
+    grid = Grid(ll=[-1, -0.2, 0.3], lr=[2, 0.3, 0.3], ul=[-1, 1.3, 0.4], tl=[-1, -0.2, 1.3],
+                bins=[13, 6, 5])
+    cells = np.indices((4, 5, 3)).reshape((3, -1)).T + [-1, 2, 0]
+    expected = sum_phases(cells, grid)
+    assert_array_almost_equal(get_lattice_sum([-1, 2, 0], [4, 5, 3], grid), expected)
+    assert_array_almost_equal(get_lattice_sum([-1, 2, 0], [4, 5, 3], grid, fast=False),
+                              expected)
+    assert_array_almost_equal(get_lattice_sum([0, 0, 0], [4, 5, 3], Grid(bins=[3, 3]))[0, 0], 60)
+
+
+def test_Fourier_average():
+    from javelin.structure import Structure
+    from javelin.fourier import get_ff, sum_phases
+    structure = Structure(symbols=['Au', 'Ag'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4)
+    structure.repeat((4, 5, 3))
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [11, 12]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    assert not four.average
+    four.average = True
+    # Without disorder there is no diffuse scattering
+    assert_array_almost_equal(four.calc(), 0)
+
+    structure.x = structure.x + np.linspace(0, 0.1, 120)
+    numbers = structure.get_atomic_numbers().copy()
+    numbers[6] = 47
+    structure.set_atomic_numbers(numbers)
+    four.average = False
+    total = four.calc()
+    four.average = True
+    results = four.calc()
+    assert results.sum() < total.sum()
+
+    # Average of the cell amplitudes times the lattice
+    ff = {79: get_ff(79, 'neutron'), 47: get_ff(47, 'neutron')}
+    aver = 0
+    for z, xyz in zip(structure.get_atomic_numbers(), structure.xyz):
+        aver = aver + ff[z] * sum_phases(xyz, four.grid)[:, :, 0] / 60.
+    aver = aver * sum_phases(np.indices((4, 5, 3)).reshape((3, -1)).T, four.grid)[:, :, 0]
+    amplitude = sum(ff[z] * sum_phases(xyz, four.grid)[:, :, 0]
+                    for z, xyz in zip(structure.get_atomic_numbers(),
+                                      structure.get_scaled_positions()))
+    assert_array_almost_equal(results, np.abs(amplitude - aver)**2)
+
+    # Lots subtract the average over the lot shape
+    four.lots = [2, 3, 2]
+    four.number_of_lots = 2
+    four.seed = 0
+    four.average = False
+    total = four.calc()
+    four.average = True
+    assert four.calc().sum() < total.sum()
+
+
+def test_Fourier_engine():
+    from javelin.structure import Structure
+    from pandas import DataFrame
+    structure = Structure(symbols=['Fe', 'Mn'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4)
+    structure.repeat((4, 5, 3))
+    structure.x = structure.x + np.tile([0, 0.1], 60)
+    structure.magmons = DataFrame(np.tile([[1, 0, 0], [0, 1, 1]], (60, 1)),
+                                  index=structure.atoms.index,
+                                  columns=['spinx', 'spiny', 'spinz'])
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [11, 12]
+    four.grid.ll = [0.1, 0.1, 0.1]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    assert four.engine == 'grid'
+    expected = four.calc()
+    expected_mag = four.calc(mag=True)
+    four.engine = 'cell'
+    assert_array_almost_equal(four.calc(), expected)
+    assert_array_almost_equal(four.calc(mag=True), expected_mag)
+    four.lots = [3, 4, 2]
+    four.number_of_lots = 2
+    four.seed = 42
+    results = four.calc()
+    four.engine = 'grid'
+    assert_array_almost_equal(results, four.calc())
+    with pytest.raises(ValueError):
+        four.engine = 'cells'
+
+
+def test_Fourier_fft_engine():
+    from javelin.structure import Structure
+    structure = Structure(symbols=['Au', 'Ag'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4)
+    structure.repeat((4, 5, 3))
+    structure.x = structure.x + np.linspace(0, 0.1, 120)
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [21, 12]
+    four.grid.ll = [0.1, 0.1, 0.1]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    expected = four.calc()
+    assert four.tolerance == 1e-6
+    four.engine = 'fft'
+    assert_array_almost_equal(four.calc() / expected.max(), expected / expected.max(), 5)
+    four.engine = 'nufft'
+    assert_array_almost_equal(four.calc() / expected.max(), expected / expected.max(), 5)
+    four.tolerance = 1e-3
+    assert_array_almost_equal(four.calc() / expected.max(), expected / expected.max(), 2)
+    four.engine = 'fft'
+    assert_array_almost_equal(four.calc() / expected.max(), expected / expected.max(), 2)
+    with pytest.raises(ValueError):
+        four.tolerance = 0
+
+
+def test_Fourier_calc_slices():
+    from javelin.grid import Grid
+    from javelin.structure import Structure
+    structure = Structure(symbols=['Fe', 'Mn'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4, magnetic_moments=True)
+    structure.magmons[:] = [[1, 0, 0], [0, 1, 1]]
+    structure.x = structure.x + [0.1, 0.05]
+    four = Fourier()
+    four.radiation = 'xray'
+    four.structure = structure
+    grids = [Grid(ll=[-1, -1, level], lr=[1, -1.2, level], ul=[-1, 1, level+0.1], bins=[5, 4])
+             for level in (0.2, 0.5, 1.25)]
+    for mag in (False, True):
+        expected = []
+        for grid in grids:
+            four.grid = grid
+            expected.append(four.calc(mag=mag).values)
+        expected = np.stack(expected, axis=-1)
+        for fast in (True, False):
+            results = four.calc_slices(grids, mag=mag, fast=fast)
+            assert results.dims == ('Q1', 'Q2', 'slice')
+            assert_array_almost_equal(results, expected)
+    assert_array_almost_equal(results.l, [0.2, 0.5, 1.25])
+    assert four.grid is grids[-1]
+    four.grid = grids[0]
+    four.calc(mag=True)
+    keys = list(four._cache.keys())
+    assert_array_almost_equal(four.calc_slices([0, 0.3, 1.05], normal=[0, 0, 1], mag=True),
+                              expected)
+    # The grid and its cached arrays are kept
+    assert four.grid is grids[0]
+    assert all(key in four._cache.keys() for key in keys)
+
+
+def test_Fourier_PointGrid(tmpdir):
+    from javelin.structure import Structure
+    from javelin.grid import PointGrid
+    structure = Structure(symbols=['Fe', 'Mn'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=4, magnetic_moments=True)
+    structure.magmons[:] = [[1, 0, 0], [0, 1, 1]]
+    structure.x = structure.x + [0.1, 0]
+    four = Fourier()
+    four.structure = structure
+    four.grid.bins = [5, 4]
+    four.grid.ll = [0.1, 0.1, 0.1]
+    four.grid.lr = [2.0, 1.0, 0.0]
+    expected = four.calc().values.ravel()
+    expected_mag = four.calc(mag=True).values.ravel()
+    four.grid = PointGrid(np.array([q.ravel() for q in four.grid.get_q_meshgrid()]).T)
+    results = four.calc()
+    assert results.dims == ('point',)
+    assert_array_equal(results.point, np.arange(20))
+    assert_array_almost_equal(results.h, four.grid.points[:, 0])
+    assert_array_almost_equal(results, expected)
+    assert_array_almost_equal(four.calc(mag=True), expected_mag)
+    assert_array_almost_equal(four.calc(fast=False), expected)
+    four.engine = 'nufft'
+    assert_array_almost_equal(four.calc() / expected.max(), expected / expected.max(), 5)
+    four.engine = 'grid'
+    four.output = str(tmpdir.join('points.npy'))
+    assert_array_almost_equal(four.calc(), expected)
+
+
+def test_Fourier_symmetry():
+    from javelin.structure import Structure
+    from javelin.grid import Grid
+    from javelin.symmetry import get_operators
+    positions = np.random.RandomState(0).rand(2, 3)*4
+    positions = np.concatenate([np.dot(positions, operator.T)
+                                for operator in get_operators('m-3m')])
+    structure = Structure(symbols=['C', 'O']*48, positions=positions, unitcell=5)
+    four = Fourier()
+    four.structure = structure
+    four.grid = Grid(ll=[-2, -2, -2], lr=[2, -2, -2], ul=[-2, 2, -2], tl=[-2, -2, 2],
+                     bins=[9, 9, 9])
+    assert four.symmetry is None
+    expected = four.calc()
+    four.symmetry = 'm-3m'
+    assert_array_almost_equal(four.calc() / expected.max(), expected / expected.max())
+    four.symmetry = [np.diag([-1, 1, 1]), np.diag([1, -1, 1])]
+    assert_array_almost_equal(four.calc() / expected.max(), expected / expected.max())
+    four.grid.bins = [9, 9, 8]  # not closed
+    four.symmetry = None
+    expected = four.calc()
+    four.symmetry = 'm-3m'
+    assert_array_almost_equal(four.calc(), expected)
+    with pytest.raises(ValueError):
+        four.symmetry = 'cubic'
+
+
+def test_Fourier_friedel(capsys, monkeypatch):
+    from javelin.structure import Structure
+    from javelin.grid import Grid
+    import javelin.symmetry
+    structure = Structure(symbols=['C', 'O', 'O'], unitcell=5,
+                          positions=[[0, 0, 0], [0.1, 0.2, 0.3], [0.7, 0.4, 0.1]])
+    four = Fourier()
+    four.structure = structure
+    four.radiation = 'xray'
+    four.grid = Grid(ll=[-2, -2, 0], lr=[2, -2, 0], ul=[-2, 2, 0], bins=[9, 11])
+    assert not four.friedel
+    expected = four.calc()
+    assert 'Calculated' not in capsys.readouterr().out
+    four.friedel = True
+    results = four.calc()
+    assert 'Calculated 55 out of 99 points' in capsys.readouterr().out
+    four.friedel = False
+    assert_array_almost_equal(four.calc(), expected)
+    assert 'Calculated' not in capsys.readouterr().out
+    assert_array_almost_equal(results, expected)
+
+    four.friedel = True
+    four.grid = Grid(ll=[-2, -2, -1], lr=[2, -2, -1], ul=[-2, 2, -1], tl=[-2, -2, 1],
+                     bins=[9, 9, 5])
+    subgrids = []
+    get_subgrid = Grid.get_subgrid
+    monkeypatch.setattr(Grid, 'get_subgrid',
+                        lambda self, *args: subgrids.append(args) or get_subgrid(self, *args))
+    results = four.calc()
+    assert 'Calculated 225 out of 405 points' in capsys.readouterr().out
+    assert len(subgrids) == 1  # the half grid in one pass
+    monkeypatch.undo()
+    four.friedel = False
+    assert_array_almost_equal(results, four.calc())
+
+    # Not centred on Q = 0 or magnetic, found without mapping the grid
+    four.friedel = True
+    four.grid.ll = [-2, -2, 0]
+    monkeypatch.setattr(javelin.symmetry, 'map_representatives', None)
+    four.calc()
+    assert 'Calculated' not in capsys.readouterr().out
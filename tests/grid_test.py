@@ -83,6 +83,11 @@ def test_complete():
                             [1.,  0., -1., -2.],
                             [2.,  1.,  0., -1.]])
     assert_array_equal(qz, np.zeros((3, 4)))
+    ll, dx, dy, dz = grid.get_q_vectors()
+    assert_array_equal(ll, [0, 0, 0])
+    assert_array_equal(dx, [1, 1, 0])
+    assert_array_equal(dy, [1, -1, 0])
+    assert_array_equal(dz, [0, 0, 0])
     qx, qy, qz = grid.get_squashed_q_meshgrid()
     assert_array_equal(qx, [[0.,  1.,  2.,  3.],
                             [1.,  2.,  3.,  4.],
@@ -121,6 +126,11 @@ def test_complete_3D():
     assert_array_equal(qx, np.transpose(np.tile([-2, 0, 2], (5, 4, 1))))
     assert_array_equal(qy, np.transpose(np.tile([-3, -1, 1, 3], (3, 5, 1)), axes=(0, 2, 1)))
     assert_array_almost_equal(qz, np.tile([-4, -2, 0, 2, 4], (3, 4, 1)))
+    ll, dx, dy, dz = grid.get_q_vectors()
+    assert_array_equal(ll, [-2, -3, -4])
+    assert_array_equal(dx, [2, 0, 0])
+    assert_array_equal(dy, [0, 2, 0])
+    assert_array_equal(dz, [0, 0, 2])
     qx, qy, qz = grid.get_squashed_q_meshgrid()
     assert_array_equal(qx, [[[-2.]], [[0.]], [[2.]]])
     assert_array_equal(qy, [[[-3.], [-1.], [1.], [3.]]])
@@ -215,3 +225,124 @@ def test_norm():
     assert_array_equal(norm([0.1, 0, 0]), [1, 0, 0])
     assert_array_equal(norm([1, 1, 0]), [1/np.sqrt(2), 1/np.sqrt(2), 0])
     assert_array_almost_equal(norm([1, 2, 3]), [0.26726124,  0.53452248,  0.80178373])
+
+
+def test_memoised_meshgrid():
+    grid = Grid()
+    grid.bins = 11, 12, 13
+
+    qx, qy, qz = grid.get_q_meshgrid()
+    assert qx is grid.get_q_meshgrid()[0]
+    assert grid.get_squashed_q_meshgrid()[0] is grid.get_squashed_q_meshgrid()[0]
+    assert not qx.flags.writeable
+    with pytest.raises(ValueError):
+        qx[0, 0, 0] = 1
+
+    # Aligned grid, components are broadcast along the other axes
+    assert qx.shape == (11, 12, 13)
+    assert qx.strides[1:] == (0, 0)
+    assert qy.strides[0] == qy.strides[2] == 0
+    assert qz.strides[:2] == (0, 0)
+
+    # Setting a vertex or bins invalidates the meshes
+    grid.lr = 2, 1, 0
+    qx, qy, qz = grid.get_q_meshgrid()
+    assert_array_almost_equal(qx[:, 0, 0], np.linspace(0, 2, 11))
+    assert_array_almost_equal(qy[:, 0, 0], np.linspace(0, 1, 11))
+    assert qy.strides[2] == 0
+    grid.bins = 3, 4
+    qx, qy, qz = grid.get_q_meshgrid()
+    assert qx.shape == (3, 4)
+    assert_array_almost_equal(qx[:, 0], [0, 1, 2])
+
+    # Copies and pickles do not carry the meshes
+    from copy import deepcopy
+    import pickle
+    grid.get_q_meshgrid()
+    assert deepcopy(grid)._memo == {}
+    assert pickle.loads(pickle.dumps(grid))._memo == {}
+    assert_array_almost_equal(deepcopy(grid).get_q_meshgrid()[0], grid.get_q_meshgrid()[0])
+    assert grid._memo != {}
+
+    # Vertices changed in place are also picked up
+    grid.lr[0] = 4
+    qx, qy, qz = grid.get_q_meshgrid()
+    assert_array_almost_equal(qx[:, 0], [0, 2, 4])
+    assert_array_almost_equal(grid.get_q_vectors()[1], [2, 0.5, 0])
+
+
+def test_get_slab():
+    grid = Grid(ll=[0.5, 0, 0], lr=[2, 1, 0], ul=[0, 1, 0], tl=[0, 0, 2], bins=[7, 5, 4])
+    slab = grid.get_slab(2, 5)
+    assert_array_equal(slab.bins, [3, 5, 4])
+    for q, expected in zip(slab.get_q_meshgrid(), grid.get_q_meshgrid()):
+        assert_array_almost_equal(q, expected[2:5])
+    with pytest.raises(ValueError):
+        grid.get_slab(6, 7)
+    with pytest.raises(ValueError):
+        grid.get_slab(5, 8)
+
+
+def test_PointGrid():
+    from javelin.grid import PointGrid
+    grid = PointGrid([[0, 0, 0], [1, 0.5, 0], [0.25, 0, 2]])
+    assert grid.bins == (3,)
+    assert grid.units == 'r.l.u'
+    qx, qy, qz = grid.get_q_meshgrid()
+    assert_array_equal(qx, [0, 1, 0.25])
+    assert_array_equal(qy, [0, 0.5, 0])
+    assert_array_equal(qz, [0, 0, 2])
+    with pytest.raises(ValueError):
+        grid.points[0, 0] = 1
+    slab = grid.get_slab(1, 3)
+    assert_array_equal(slab.points, [[1, 0.5, 0], [0.25, 0, 2]])
+    with pytest.raises(ValueError):
+        grid.get_slab(2, 4)
+    with pytest.raises(ValueError):
+        PointGrid([1, 2, 3])
+    with pytest.raises(ValueError):
+        PointGrid([[1, 2]])
+
+
+def test_get_subgrid():
+    grid = Grid(ll=[0.5, 0, 0], lr=[2, 1, 0], ul=[0, 1, 0], tl=[0, 0, 2], bins=[7, 5, 4])
+    subgrid = grid.get_subgrid((1, 2, 0), (4, 5, 2))
+    assert_array_equal(subgrid.bins, [3, 3, 2])
+    for q, expected in zip(subgrid.get_q_meshgrid(), grid.get_q_meshgrid()):
+        assert_array_almost_equal(q, expected[1:4, 2:5, 0:2])
+    grid = Grid(ll=[0.5, 0, 0], lr=[2, 1, 0], ul=[0, 1, 0], bins=[7, 5])
+    subgrid = grid.get_subgrid((1, 2), (4, 5))
+    assert subgrid.twoD
+    for q, expected in zip(subgrid.get_q_meshgrid(), grid.get_q_meshgrid()):
+        assert_array_almost_equal(q, expected[1:4, 2:5])
+    with pytest.raises(ValueError):
+        grid.get_subgrid((1, 2, 0), (4, 5, 2))
+    with pytest.raises(ValueError):
+        grid.get_subgrid((1, 4), (4, 5))
+
+
+def test_SliceGrid():
+    from javelin.grid import SliceGrid, get_slice_grid
+    plane = Grid(ll=[-1, -1, 0], lr=[1, -1, 0], ul=[-1, 1, 0], bins=[5, 4])
+    grid = SliceGrid(plane, [0, 0.5, 1.25])
+    assert grid.bins == (5, 4, 3)
+    assert not grid.twoD
+    assert_array_equal(grid.offsets, [[0, 0, 0], [0, 0, 0.5], [0, 0, 1.25]])
+    shapes = [q.shape for q in grid.get_squashed_q_meshgrid()]
+    assert shapes == [(5, 1, 1), (1, 4, 1), (1, 1, 3)]
+    grids = [Grid(ll=[-1, -1, level], lr=[1, -1, level], ul=[-1, 1, level], bins=[5, 4])
+             for level in (0, 0.5, 1.25)]
+    for n, slice_grid in enumerate(grids):
+        for q, expected in zip(grid.get_q_meshgrid(), slice_grid.get_q_meshgrid()):
+            assert_array_almost_equal(q[:, :, n], expected)
+    assert_array_almost_equal(get_slice_grid(grids).offsets, grid.offsets)
+    slab = grid.get_slab(1, 3)
+    assert slab.bins == (2, 4, 3)
+    for q, expected in zip(slab.get_q_meshgrid(), grid.get_q_meshgrid()):
+        assert_array_almost_equal(q, expected[1:3])
+    with pytest.raises(ValueError):
+        grid.offsets[0, 0] = 1
+    with pytest.raises(ValueError):
+        SliceGrid(Grid(bins=[3, 3, 3]))
+    with pytest.raises(ValueError):
+        get_slice_grid([plane, Grid(bins=[5, 4])])
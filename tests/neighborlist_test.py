@@ -0,0 +1,49 @@
+import pytest
+import numpy as np
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+from javelin.neighborlist import NeighborList
+from javelin.unitcell import UnitCell
+
+
+def brute_force_pairs(positions, unitcell, rmax, ncells=None):
+    displacement = positions[None, :, :] - positions[:, None, :]
+    if ncells is not None:
+        displacement -= np.round(displacement / ncells) * ncells
+    distances = np.sqrt(np.einsum('abi,ij,abj->ab', displacement, np.asarray(unitcell.G),
+                                  displacement))
+    i, j = np.nonzero(np.triu(distances <= rmax, 1))
+    return i, j, distances[i, j]
+
+
+@pytest.mark.parametrize("ncells,rmax", [([5, 4, 3], 4.0), ([5, 4, 3], 1.5),
+                                         (None, 4.0), (None, 100.0)])
+@pytest.mark.parametrize("use_cells", [False, True])
+def test_NeighborList(ncells, rmax, use_cells):
+    unitcell = UnitCell(3, 4, 5, 90, 95, 90)
+    rng = np.random.RandomState(0)
+    positions = rng.rand(200, 3) * [5, 4, 3]
+    cells = np.floor(positions).astype(int)
+    positions += rng.normal(0, 0.05, size=(200, 3))  # some atoms outside their cells
+    nlist = NeighborList(positions, unitcell, rmax, ncells, cells if use_cells else None)
+    assert len(nlist) == 200
+    assert nlist.rmax == rmax
+    assert nlist.periodic == (ncells is not None)
+    i, j, distances = nlist.get_pairs(max_memory=2**12)
+    expected_i, expected_j, expected_distances = brute_force_pairs(
+        positions, unitcell, rmax, None if ncells is None else np.array(ncells))
+    pairs = np.sort(np.transpose([i, j]), axis=1)
+    order = np.lexsort(pairs.T[::-1])
+    assert_array_equal(pairs[order], np.transpose([expected_i, expected_j]))
+    assert_array_almost_equal(distances[order], expected_distances)
+    assert sum(len(nlist.get_chunk_pairs(*chunk)[0])
+               for chunk in nlist.get_chunks(2**12)) == len(expected_i)
+
+
+def test_NeighborList_exceptions():
+    unitcell = UnitCell(3)
+    with pytest.raises(ValueError):
+        NeighborList([[0, 0, 0]], unitcell, 0)
+    with pytest.raises(ValueError):
+        NeighborList([[0, 0, 0]], unitcell, 4, ncells=[2, 2, 2])
+    i, j, distances = NeighborList(np.zeros((0, 3)), unitcell, 1).get_pairs()
+    assert len(i) == len(j) == len(distances) == 0
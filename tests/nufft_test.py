@@ -0,0 +1,57 @@
+import pytest
+import numpy as np
+from numpy.testing import assert_allclose
+from javelin.grid import Grid
+from javelin.fourier import sum_phase_factors
+from javelin.nufft import get_spreading_width, sum_phases_fft
+
+
+def test_get_spreading_width():
+    assert get_spreading_width(1e-6) == 7
+    assert get_spreading_width(1e-1) == 2
+    assert get_spreading_width(1e-30) == 16
+    with pytest.raises(ValueError):
+        get_spreading_width(0)
+
+
+def test_sum_phases_fft():
+    rng = np.random.RandomState(0)
+    positions = rng.rand(200, 3)*10
+    weights = rng.rand(200, 3)
+    grid = Grid(ll=[0.1, -0.2, 0.3], lr=[2.1, 0.3, 0.3], ul=[0.1, 1.3, 0.4],
+                tl=[0.5, -0.2, 1.3], bins=[16, 13, 9])
+    for tolerance in (1e-3, 1e-6, 1e-9):
+        expected = sum_phase_factors(positions, grid)
+        assert_allclose(sum_phases_fft(positions, grid, tolerance=tolerance), expected,
+                        atol=tolerance*np.abs(expected).max())
+    expected = sum_phase_factors(positions, grid, weights)
+    results = sum_phases_fft(positions, grid, weights, max_memory=2**16)
+    assert results.shape == (3, 16, 13, 9)
+    assert_allclose(results, expected, atol=1e-6*np.abs(expected).max())
+
+
+def test_sum_phases_fft_2D():
+    rng = np.random.RandomState(1)
+    positions = rng.rand(100, 3)*[5, 5, 1]
+    grid = Grid(bins=[3, 20])
+    expected = sum_phase_factors(positions, grid)
+    results = sum_phases_fft(positions, grid)
+    assert results.shape == (3, 20, 1)
+    assert_allclose(results, expected, atol=1e-6*np.abs(expected).max())
+
+
+def test_sum_phases_nufft():
+    from javelin.nufft import sum_phases_nufft
+    rng = np.random.RandomState(2)
+    positions = rng.rand(150, 3)*[6, 5, 4] + [-2, 1, 0]
+    weights = rng.rand(150, 2)
+    q = rng.rand(120, 3)*2 - [0, 1, 0.5]
+    expected = np.dot(np.exp(2j*np.pi*np.dot(q, positions.T)), weights).T
+    for tolerance in (1e-3, 1e-6, 1e-9):
+        results = sum_phases_nufft(positions, q, weights, tolerance, max_memory=2**16)
+        assert results.shape == (2, 120)
+        assert_allclose(results, expected, atol=tolerance*np.abs(expected).max())
+    q[:, 2] = 0.3  # constant along an axis
+    expected = np.exp(2j*np.pi*np.dot(q, positions.T)).sum(axis=1)
+    assert_allclose(sum_phases_nufft(positions, q), expected, atol=1e-6*np.abs(expected).max())
+    assert sum_phases_nufft(positions, q[:0]).shape == (0,)
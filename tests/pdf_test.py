@@ -0,0 +1,40 @@
+import numpy as np
+from numpy.testing import assert_array_equal, assert_allclose
+from javelin.structure import Structure
+from javelin.pdf import calc_pdf, calc_partial_pdfs, get_partial_rdfs
+
+
+def create_structure():
+    structure = Structure(symbols=['Na', 'Cl'], positions=[[0, 0, 0], [0.5, 0, 0]],
+                          unitcell=(5.6, 2.8, 2.8))
+    structure.repeat((3, 6, 6))
+    return structure
+
+
+def test_get_partial_rdfs():
+    atomic_numbers, counts, r, rdfs = get_partial_rdfs(create_structure(), rmax=5, dr=0.1)
+    assert_array_equal(atomic_numbers, [11, 17])
+    assert_array_equal(counts, [108, 108])
+    assert len(r) == 50
+    # 4 Na around each Na and 2 Cl around each Na at 2.8 A
+    density = 2 / (5.6*2.8*2.8)
+    shell = 4*np.pi/3*(2.8**3 - 2.7**3)
+    assert_allclose(rdfs[:, :, 27], np.array([[4, 2], [2, 4]]) / (density/2*shell))
+    assert_allclose(rdfs[:, :, 26], 0)
+
+
+def test_calc_pdf():
+    from javelin.fourier import get_ff
+    structure = create_structure()
+    partials = calc_partial_pdfs(structure, rmax=5, dr=0.1)
+    assert_array_equal(partials.pair, ['Na-Na', 'Na-Cl', 'Cl-Cl'])
+    assert partials.dims == ('pair', 'r')
+    total = calc_pdf(structure, rmax=5, dr=0.1)
+    assert total.dims == ('r',)
+    b = np.array([get_ff(11, 'neutron'), get_ff(17, 'neutron')])
+    weights = np.array([b[0]**2, 2*b[0]*b[1], b[1]**2]) / b.sum()**2
+    assert_allclose(total, np.dot(weights, partials))
+    assert_allclose(calc_pdf(structure, rmax=5, dr=0.1, workers=2, max_memory=2**10), total)
+    # Without disorder there are no distances below the shortest bond
+    density = 2 / (5.6*2.8*2.8)
+    assert_allclose(total[:27], -4*np.pi*total.r[:27]*density)
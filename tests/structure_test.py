@@ -209,6 +209,63 @@ def test_reindex():
                                                     [0., 0., 5.]])
 
 
+def test_cell_indices():
+    structure = Structure(symbols=['Au', 'Ag'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=5)
+    structure.repeat((2, 1, 3))
+    assert_array_equal(structure.ncells, [2, 1, 3, 2])
+    cells = structure.get_cell_indices()
+    assert_array_equal(cells, structure.atoms.index.tolist())
+    assert_array_equal(structure.get_scaled_positions(), structure.xyz + cells[:, :3])
+    assert structure.atoms.x.dtype == np.float64
+    assert structure.atoms.Z.dtype == np.int64
+    assert structure.get_chemical_symbols().dtype == object
+    # The atoms DataFrame is a copy which is applied when set again
+    atoms = structure.atoms
+    atoms['x'] = 0.25
+    assert_array_equal(structure.x, [0, 0.5]*6)
+    structure.atoms = atoms
+    assert_array_equal(structure.x, [0.25]*12)
+    assert_array_almost_equal(structure.xyz_cartn[1], [1.25, 2.5, 2.5])
+    atoms['x'] = [0, 0.5]*6
+    atoms['Z'] = 47
+    structure.atoms = atoms
+    assert_array_equal(structure.get_atom_symbols(), ['Ag'])
+    assert_array_equal(structure.ncells, [2, 1, 3, 2])
+    # The positions are read-only views, they have to be set
+    with pytest.raises(ValueError):
+        structure.xyz[0] = 0.3
+    with pytest.raises(ValueError):
+        structure.x += 0.1
+    structure.x = structure.x + 0.1
+    assert_array_almost_equal(structure.xyz_cartn[1], [3, 2.5, 2.5])
+    structure.set_atomic_numbers(79)
+    assert_array_equal(structure.get_atom_symbols(), ['Au'])
+    # Atoms outside of the cells are kept with their indices
+    structure.add_atom(0, 0, 3, 0, symbol='Pt', position=[0, 0, 0])
+    assert_array_equal(structure.ncells, [2, 1, 4, 2])
+    assert_array_equal(structure.get_cell_indices()[-1], [0, 0, 3, 0])
+    assert_array_almost_equal(structure.xyz_cartn[-1], [0, 0, 15])
+    structure.add_atom(0, 0, 3, 0, symbol='Cu', position=[0, 0, 0.5])
+    assert structure.number_of_atoms == 13
+    assert_array_equal(structure.get_chemical_symbols()[-1], 'Cu')
+
+
+def test_lazy_cartn():
+    structure = Structure(symbols=['Au'], positions=[[0.5, 0, 0.25]], unitcell=(3, 4, 5))
+    structure.repeat((2, 1, 1))
+    assert structure._cartn is None
+    cartn = structure.xyz_cartn
+    assert_array_almost_equal(cartn, [[1.5, 0, 1.25], [4.5, 0, 1.25]])
+    assert structure.xyz_cartn is cartn
+    structure.unitcell.cell = (6, 4, 5)
+    assert_array_almost_equal(structure.xyz_cartn, [[3, 0, 1.25], [9, 0, 1.25]])
+    structure.z = structure.z + 0.25
+    assert_array_almost_equal(structure.xyz_cartn, [[3, 0, 2.5], [9, 0, 2.5]])
+    structure.reindex([1, 2, 1, 1])
+    assert_array_almost_equal(structure.xyz_cartn, [[3, 0, 2.5], [3, 4, 2.5]])
+
+
 def test_except():
     with pytest.raises(ValueError):
         Structure(symbols=['U'], positions=[[0, 0, 0]], ncells=[1, 1, 1, 2])
@@ -259,3 +316,66 @@ def test_get_rotation_matrix_from_versor():
                               [[0.33333333, 0.9106836, -0.24401694],
                                [-0.24401694, 0.33333333, 0.9106836],
                                [0.9106836, -0.24401694, 0.33333333]])
+
+
+def test_magnetic_moments():
+    from pandas import DataFrame
+    structure = Structure(symbols=['Fe', 'Mn'], positions=[[0, 0, 0]]*2, magnetic_moments=True)
+    assert_array_equal(structure.magmons, np.zeros((2, 3)))
+    structure.magmons[:] = [[1, 0, 0], [0, 1, 0]]
+    structure.add_atom(1, 0, 0, 0, symbol='Fe', position=[0, 0, 0])
+    structure.add_atom(0, 0, 0, 2, symbol='Fe', position=[0, 0, 0])
+    assert_array_equal(structure.get_magnetic_moments(), [[1, 0, 0], [0, 1, 0],
+                                                          [0, 0, 0], [0, 0, 0]])
+    # DataFrames are matched to the atoms by their index
+    index = structure.atoms.index[::-1]
+    structure.magmons = DataFrame([[0, 0, 4], [0, 0, 3], [0, 0, 2], [0, 0, 1]], index=index,
+                                  columns=['spinx', 'spiny', 'spinz'])
+    assert_array_equal(structure.magmons[:, 2], [1, 2, 3, 4])
+    structure = Structure(symbols=['Fe', 'Mn'], positions=[[0, 0, 0]]*2, magnetic_moments=True)
+    structure.magmons = [0, 0, 1]
+    structure.magmons[1] = [1, 0, 0]
+    structure.repeat((2, 1, 1))
+    assert_array_equal(structure.magmons, [[0, 0, 1], [1, 0, 0]]*2)
+    structure.magmons = None
+    assert structure.get_magnetic_moments() is None
+
+
+def test_magnetic_ions():
+    structure = Structure(symbols=['Fe', 'Mn', 'Fe'], positions=[[0, 0, 0]]*3)
+    assert structure.get_magnetic_ions() is None
+    structure.set_magnetic_ions({'Fe': 2})
+    assert_array_equal(structure.get_magnetic_ions(), [2, 3, 2])
+    structure.set_magnetic_ions({25: 4})
+    assert_array_equal(structure.get_magnetic_ions(), [2, 4, 2])
+    structure.set_magnetic_ions([2, 4, 3])
+    assert_array_equal(structure.get_magnetic_ions(), [2, 4, 3])
+    structure.set_magnetic_ions(1)
+    assert_array_equal(structure.get_magnetic_ions(), [1, 1, 1])
+    structure.set_magnetic_ions([2, 4, 3])
+    structure.repeat((2, 1, 1))
+    assert_array_equal(structure.get_magnetic_ions(), [2, 4, 3]*2)
+
+
+def test_neighbor_list():
+    structure = Structure(symbols=['Fe', 'Mn'], positions=[[0, 0, 0], [0.5, 0.5, 0.5]],
+                          unitcell=3)
+    structure.repeat(4)
+    nlist = structure.get_neighbor_list(3.0)
+    assert structure.get_neighbor_list(2.8) is nlist
+    i, j, distances = structure.get_pairs(2.7)
+    # 8 body centre neighbours per atom
+    assert len(i) == 128*8//2
+    assert_array_almost_equal(distances, np.sqrt(3)*1.5)
+    assert (structure.get_atomic_numbers()[i] != structure.get_atomic_numbers()[j]).all()
+    indices, distances = structure.get_nearest_neighbors(9)
+    assert indices.shape == (128, 9)
+    assert_array_almost_equal(distances[:, :8], np.sqrt(3)*1.5)
+    assert_array_almost_equal(distances[:, 8], 3)
+    assert (indices >= 0).all()
+    # Moving atoms invalidates the neighbour list
+    structure.x = structure.x + 0.01
+    assert structure.get_neighbor_list(2.8) is not nlist
+    indices, distances = structure.get_nearest_neighbors(2, rmax=1)
+    assert (indices == -1).all()
+    assert np.isinf(distances).all()
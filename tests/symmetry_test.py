@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+from numpy.testing import assert_array_equal
+from javelin.grid import Grid
+from javelin.symmetry import (get_laue_classes, get_operators, get_group, get_index_maps,
+                              get_representatives)
+
+
+def test_get_operators():
+    orders = {'-1': 2, '2/m': 4, 'mmm': 8, '4/m': 8, '4/mmm': 16, '-3': 6, '-3m': 12,
+              '-3m1': 12, '-31m': 12, '6/m': 12, '6/mmm': 24, 'm-3': 24, 'm-3m': 48}
+    assert get_laue_classes() == sorted(orders)
+    for name, order in orders.items():
+        operators = get_operators(name)
+        assert len(operators) == order
+        for operator in operators:
+            assert_array_equal(operator, np.round(operator))
+            assert abs(np.linalg.det(operator)) == pytest.approx(1)
+    assert len(get_operators([np.diag([-1, 1, 1])])) == 2
+    with pytest.raises(ValueError):
+        get_operators('m3m')
+    with pytest.raises(ValueError):
+        get_operators([[1, 0, 0]])
+    with pytest.raises(ValueError):
+        get_group([np.diag([2, 1, 1])])
+
+
+def test_get_representatives():
+    grid = Grid(ll=[-1, -1, 0], lr=[1, -1, 0], ul=[-1, 1, 0], bins=[3, 3])
+    representatives = get_representatives(grid, get_operators('4/mmm'))
+    assert_array_equal(representatives, [[8, 7, 8],
+                                         [7, 4, 7],
+                                         [8, 7, 8]])
+    grid = Grid(ll=[-1, -1, -1], lr=[1, -1, -1], ul=[-1, 1, -1], tl=[-1, -1, 1],
+                bins=[5, 5, 5])
+    assert len(np.unique(get_representatives(grid, get_operators('m-3m')))) == 10
+    assert len(np.unique(get_representatives(grid, get_operators('-1')))) == 63
+    # Rows along the first axis give the same representatives
+    representatives = get_representatives(grid, get_operators('m-3m'))
+    assert_array_equal(get_representatives(grid, get_operators('m-3m'), 1, 3),
+                       representatives[1:3])
+    assert_array_equal(get_representatives(grid, get_operators('m-3m'), 4),
+                       representatives[4:])
+
+    # Not closed
+    assert get_representatives(grid, get_operators('6/m')) is None
+    grid.tl = [-1, -1, 2]
+    assert get_representatives(grid, get_operators('-1')) is None
+    grid = Grid(ll=[-1, -1, 0], lr=[1, -1, 0], ul=[-1, 1, 0], bins=[3, 3])
+    assert get_representatives(grid, get_operators('m-3m')) is None
+
+
+def test_get_index_maps():
+    grid = Grid(ll=[-1, -1, 0], lr=[1, -1, 0], ul=[-1, 1, 0], bins=[3, 5])
+    # The identity is left out
+    maps = get_index_maps(grid, get_operators('-1'))
+    assert len(maps) == 1
+    rotation, translation = maps[0]
+    assert_array_equal(rotation, -np.eye(2))
+    assert_array_equal(translation, [2, 4])
+    assert get_index_maps(grid, [np.eye(3)]) == []
+    assert get_index_maps(grid, get_operators('4/m')) is None